@@ -0,0 +1,169 @@
+# In-process caches for the Fancast plugin
+#
+# LRUCache holds values for a limited time (per entry) within a size budget, evicting the least recently used entries
+# The size of each entry is given by the caller, eg the length of a page's source for parsed pages
+# Entries are kept in an OrderedDict from least to most recently used, so hits and evictions take constant time
+#
+# SingleFlight coalesces concurrent calls for the same key so that only one of them does the work
+#
+# This module does not depend on the plugin framework
+
+import sys
+import time
+import threading
+import collections
+
+
+class LRUCache(object):
+
+  def __init__(self, maxSize):
+    self.maxSize = maxSize
+    self.size = 0
+    # key -> (value, size, expires), least recently used first
+    self.entries = collections.OrderedDict()
+    self.lock = threading.Lock()
+    self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+  def Get(self, key):
+    # Returns the value for key, or None if it isn't cached or has expired
+    self.lock.acquire()
+    try:
+      entry = self.entries.get(key)
+      if entry == None:
+        self.stats['misses'] = self.stats['misses'] + 1
+        return None
+      value, size, expires = entry
+      if expires <= time.time():
+        self.Remove(key)
+        self.stats['expired'] = self.stats['expired'] + 1
+        self.stats['misses'] = self.stats['misses'] + 1
+        return None
+      # Move it to the most recently used end (OrderedDict in Python 2 has no move_to_end)
+      del self.entries[key]
+      self.entries[key] = entry
+      self.stats['hits'] = self.stats['hits'] + 1
+      return value
+    finally:
+      self.lock.release()
+
+  def Set(self, key, value, size, ttl):
+    # Caches value for ttl seconds, replacing any existing value for key
+    # Values larger than the whole cache are not stored
+    self.lock.acquire()
+    try:
+      if key in self.entries:
+        self.Remove(key)
+      if size > self.maxSize or ttl <= 0:
+        return
+      while self.size + size > self.maxSize:
+        self.Evict()
+      self.entries[key] = (value, size, time.time() + ttl)
+      self.size = self.size + size
+    finally:
+      self.lock.release()
+
+  def Invalidate(self, key):
+    # Removes key from the cache, eg because the underlying data is known to have changed
+    self.lock.acquire()
+    try:
+      if key in self.entries:
+        self.Remove(key)
+        self.stats['invalidations'] = self.stats['invalidations'] + 1
+    finally:
+      self.lock.release()
+
+  def Clear(self):
+    self.lock.acquire()
+    try:
+      self.stats['invalidations'] = self.stats['invalidations'] + len(self.entries)
+      self.entries = collections.OrderedDict()
+      self.size = 0
+    finally:
+      self.lock.release()
+
+  def Stats(self):
+    # Returns a copy of the counters along with the current size and hit rate
+    self.lock.acquire()
+    try:
+      stats = dict(self.stats)
+      stats['entries'] = len(self.entries)
+      stats['size'] = self.size
+      stats['maxSize'] = self.maxSize
+    finally:
+      self.lock.release()
+    lookups = stats['hits'] + stats['misses']
+    if lookups > 0:
+      stats['hitRate'] = float(stats['hits']) / lookups
+    else:
+      stats['hitRate'] = 0.0
+    return stats
+
+  ######
+  # Internals, the lock must be held
+
+  def Remove(self, key):
+    self.size = self.size - self.entries[key][1]
+    del self.entries[key]
+
+  def Evict(self):
+    # Drops the least recently used entry
+    key, entry = self.entries.popitem(last=False)
+    self.size = self.size - entry[1]
+    self.stats['evictions'] = self.stats['evictions'] + 1
+
+
+class SingleFlight(object):
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.calls = {}
+    self.stats = {'calls': 0, 'coalesced': 0}
+
+  def Do(self, key, function):
+    # Returns function(), unless a call for key is already in flight in which case this waits for and returns its result
+    # If the call in flight raises, every caller waiting on it raises the same exception
+
+    self.lock.acquire()
+    try:
+      call = self.calls.get(key)
+      if call == None:
+        call = {'done': threading.Event(), 'result': None, 'error': None}
+        self.calls[key] = call
+        self.stats['calls'] = self.stats['calls'] + 1
+        leader = True
+      else:
+        self.stats['coalesced'] = self.stats['coalesced'] + 1
+        leader = False
+    finally:
+      self.lock.release()
+
+    if not leader:
+      call['done'].wait()
+      if call['error'] != None:
+        raise call['error']
+      return call['result']
+
+    try:
+      try:
+        call['result'] = function()
+      except Exception:
+        call['error'] = sys.exc_info()[1]
+        raise
+    finally:
+      self.lock.acquire()
+      try:
+        del self.calls[key]
+      finally:
+        self.lock.release()
+      call['done'].set()
+
+    return call['result']
+
+  def Stats(self):
+    self.lock.acquire()
+    try:
+      stats = dict(self.stats)
+      stats['inFlight'] = len(self.calls)
+    finally:
+      self.lock.release()
+    return stats
@@ -0,0 +1,546 @@
+# Page extraction for the Fancast plugin
+#
+# Turns fancast.com pages into show ids, filters and records
+# Pages are passed in already parsed, as lxml elements from the framework's XML.ElementFromString or from lxml directly,
+# so the same extraction is used by the plugin and by Tools/Crawl.py, which crawls outside PMS
+# Urls found on the pages are made absolute with siteUrl
+#
+# Every selector and pattern is compiled once, when the module is imported, as extraction runs for thousands of rows per crawl
+# Rows of the episode lists and the video.playerData of assets are read in a single walk of their elements,
+# collecting each field as it is passed rather than searching the element again per field
+#
+# This module does not depend on the plugin framework
+
+import re
+import Store
+from Support import *
+
+try:
+  from lxml import etree
+  def XPath(path):
+    return etree.XPath(path)
+except ImportError:
+  # Without lxml the paths are evaluated by the elements themselves, uncompiled
+  etree = None
+  def XPath(path):
+    return lambda element, **variables: element.xpath(path, **variables)
+
+# Listing pages can be parsed as they are read (see ListingParser) with lxml's pull parser, older versions lack it
+STREAMING = hasattr(etree, 'HTMLPullParser')
+
+# The version of each extractor, bump it when what the extractor returns changes
+# Records extracted by an older version are then refreshed (shows and assets) or fetched again (episodes and movies)
+VERSIONS = {'show': 1, 'asset': 1, 'episodes': 2, 'movie': 2}
+
+SHOW_ID = re.compile(r'^(.*/(?:movies|tv)/[^/]+/\d+/)')
+PLAYER_DATA = re.compile(r'video.playerData = "(.*</entity>)')
+FILTER_URL = re.compile(r"'([^']+)'")
+NETWORK = re.compile(r'\/tv-networks\/([^\/]+)\/')
+SEASON_NAME = re.compile(r'^\s*(\S.*\S)\s*$')
+DURATION = re.compile(r'([^)]+)')
+YEAR = re.compile(r'\(([^\(]+)\)')
+SEASON = re.compile(r'S')
+EPISODE = re.compile(r'Ep')
+UNKNOWN = re.compile(r'Unknown')
+SMALL_IMAGE = re.compile('121_87')
+ASSET_PATH = re.compile(r'(.*)/videos')
+
+# Listing pages
+TRAILER_ROWS = XPath("//div[@id='episodeList']/ul[@class='fullEpisodeList']/li[not(@class='head')]")
+NEW_ROWS = XPath("//div[@class='fullEpisodeList']//div/ul/li/div") # New episodes are within a 'new episode' div
+UNPROTECTED_ROWS = XPath("//div[@class='fullEpisodeList']//div/ul/li[not(starts-with(@class, 'protected'))]")
+ROWS = XPath("//div[@class='fullEpisodeList']//div/ul/li")
+NETWORK_FILTERS = XPath("//div[@id='filters']/div[@class='FilterbyNetwork']/ul/li[not(@class='selected')]/a")
+GENRE_FILTERS = XPath("//div[@id='filters']/div[@class='FilterbyGenre']/ul/li[not(@class='selected')]/a")
+
+# Show pages
+SHOW_TITLE = XPath("//div[@id='pageHeadline']//span[@class='title']")
+SHOW_IMAGES = XPath("//div[@id='listHolder']/ul[@id='viewTable']/li/a/img")
+NETWORK_LINKS = XPath("//div[@id='swoosh']/a")
+
+# Episode lists
+SEASON_OPTIONS = XPath("//div[@id='listHolder']/ul[1]/li[@class='seasonsMenu']/select[@name='seasons']/option[not(@value='all')]")
+EPISODE_ROWS = XPath("//div[@id='listHolder']//tr[not(@class='newEpHeader')]")
+SEASON_DIVS = XPath("//div[@id]")
+SEASON_ROWS = XPath("./table[@class='videoList fourColumn']//tr[not(@class='newEpHeader')]")
+
+# Movie pages
+MOVIE_TABLE = XPath("//table[@class='videoList twoColumn']")
+MOVIE_META = XPath("//div[@id='pageHeadline']//span[@class='meta']")
+MOVIE_SUMMARY = XPath("//div[@id='leftcontent']/div[@class='clearfix']/p")
+MOVIE_THUMBS = XPath("//div[@id='thumbNail']//img")
+
+# The front page, div is the id of a Top 5 list's div
+TOP5_ITEMS = XPath("//div[@id=$div]/ol/li")
+
+# The fields of an asset's video.playerData, by the tags of the element and its parent
+PLAYER_FIELDS = {
+  ('metadata', 'entityName'): 'showTitle',
+  ('metadata', 'videoTitle'): 'episodeTitle',
+  ('entity', 'imageUrl'): 'thumb',
+  ('metadata', 'description'): 'description',
+  ('metadata', 'duration'): 'duration',
+  ('metadata', 'airDate'): 'airdate',
+  ('metadata', 'season'): 'season',
+  ('metadata', 'episode'): 'episodeNumber'
+}
+
+
+######
+# Records
+#
+# Episodes, seasons and movies are persisted (see Records.py) and put in snapshots as lists of their fields, see Dump and Load
+
+class EpisodeRecord(object):
+  # duration is in ms
+  __slots__ = ('title', 'summary', 'episode', 'airdate', 'duration', 'thumb', 'url')
+  FIELDS = __slots__
+
+  def __init__(self, title='', summary='', episode='', airdate='', duration='', thumb='', url=''):
+    self.title = title
+    self.summary = summary
+    self.episode = episode
+    self.airdate = airdate
+    self.duration = duration
+    self.thumb = thumb
+    self.url = url
+
+
+class SeasonRecord(object):
+  # episodes is an ordered list of EpisodeRecords, the thumb is the first episode's
+  __slots__ = ('id', 'name', 'thumb', 'episodes')
+  FIELDS = __slots__
+
+  def __init__(self, id=None, name=None, thumb='', episodes=None):
+    self.id = id
+    self.name = name
+    self.thumb = thumb
+    self.episodes = episodes or []
+
+
+class MovieRecord(object):
+  __slots__ = ('title', 'url', 'duration', 'yearAndRating', 'summary', 'thumb')
+  FIELDS = __slots__
+
+  def __init__(self, title='', url='', duration='', yearAndRating='', summary='', thumb=''):
+    self.title = title
+    self.url = url
+    self.duration = duration
+    self.yearAndRating = yearAndRating
+    self.summary = summary
+    self.thumb = thumb
+
+
+def Dump(record):
+  # Returns the list of a record's fields, the seasons of a show as a list of them
+  if isinstance(record, list):
+    return [Dump(season) for season in record]
+  if isinstance(record, SeasonRecord):
+    return [record.id, record.name, record.thumb, [Dump(episode) for episode in record.episodes]]
+  return [getattr(record, field) for field in record.FIELDS]
+
+
+def LoadSeasons(values):
+  # Returns the SeasonRecords from Dump of a show's seasons
+  return [SeasonRecord(id, name, thumb, [EpisodeRecord(*episode) for episode in episodes]) for id, name, thumb, episodes in values]
+
+
+def LoadMovie(values):
+  # Returns the MovieRecord from Dump of a movie
+  return MovieRecord(*values)
+
+
+class ListingRow(object):
+  # A show listed on a tv, movies, trailers or filter page, url is where the row links to (eg a trailer's videos page)
+  # protected is set for shows from 'Protected Providers', new for shows listed with new episodes
+  __slots__ = ('showId', 'url', 'protected', 'new')
+
+  def __init__(self, showId, url, protected=False, new=False):
+    self.showId = showId
+    self.url = url
+    self.protected = protected
+    self.new = new
+
+
+######
+# Extraction
+
+def ShowIdOf(url):
+  # Returns the show id at the start of a show, asset or page url, or None if there isn't one
+  match = SHOW_ID.search(url)
+  if match == None:
+    return None
+  return match.group(1)
+
+
+def ShowIds(page, trailers=False, filterType=None, hideProtected=True):
+  # Returns the list of show ids found on a listing page
+  # With a filterType of 'new' only shows with new episodes are returned
+
+  if trailers:
+    shows = TRAILER_ROWS(page)
+  elif filterType == 'new':
+    shows = NEW_ROWS(page)
+  elif hideProtected:
+    shows = UNPROTECTED_ROWS(page)
+  else:
+    shows = ROWS(page)
+
+  # Build a list of availalbe show id's, from the first link in each row (it can be within a 'new episode' div)
+  showIds = []
+  for show in shows:
+    showFullUrl = next(show.iter('a')).get('href')
+    showIds.append(SHOW_ID.search(showFullUrl).group(1))
+
+  return showIds
+
+
+class ListingParser(object):
+  # Parses a listing page incrementally, as ShowIds and Filters do for the parsed page
+  # Feed() takes the next part of the page and returns the ListingRows completed by it, so the rows can be acted on
+  # while the rest of the page is still being parsed. filters holds the genre and network filters seen so far
+  # Each row and filter is cleared once read, along with everything else already passed, so the tree never holds
+  # more than the elements still open and memory stays flat however long the page is
+  # Requires lxml with HTMLPullParser, see STREAMING
+
+  def __init__(self, trailers, siteUrl, hidden=()):
+    self.trailers = trailers
+    self.siteUrl = siteUrl
+    self.hidden = hidden
+    self.filters = {'genre': [], 'network': []}
+    self.parser = etree.HTMLPullParser(events=('start', 'end'))
+    self.open = None # The row or filter being read
+
+  def Feed(self, data):
+    self.parser.feed(data)
+    return self.Read()
+
+  def Close(self):
+    # Returns the rows completed by the end of the page
+    self.parser.close()
+    return self.Read()
+
+  def Read(self):
+    rows = []
+    for event, element in self.parser.read_events():
+      if event == 'start':
+        if self.open == None and element.tag == 'li' and (self.IsRow(element) or self.FilterType(element) != None):
+          self.open = element
+        continue
+
+      if self.open != None and element is not self.open:
+        # Within a row, kept until the row is read
+        continue
+
+      if element is self.open:
+        self.open = None
+        filterType = self.FilterType(element)
+        if filterType != None:
+          self.ReadFilter(element, filterType)
+        else:
+          rows.append(self.ReadRow(element))
+
+      # Done with this element and those before it
+      element.clear()
+      parent = element.getparent()
+      if parent != None:
+        while element.getprevious() != None:
+          del parent[0]
+    return rows
+
+  def IsRow(self, li):
+    # As the paths of ShowIds
+    ul = li.getparent()
+    if ul == None or ul.tag != 'ul':
+      return False
+    div = ul.getparent()
+    if div == None or div.tag != 'div':
+      return False
+    if self.trailers:
+      return ul.get('class') == 'fullEpisodeList' and div.get('id') == 'episodeList' and li.get('class') != 'head'
+    ancestor = div.getparent()
+    while ancestor != None:
+      if ancestor.tag == 'div' and ancestor.get('class') == 'fullEpisodeList':
+        return True
+      ancestor = ancestor.getparent()
+    return False
+
+  def FilterType(self, li):
+    # 'genre' or 'network' for the unselected filters on the page, as the paths of Filters, otherwise None
+    if self.trailers or li.get('class') == 'selected':
+      return None
+    ul = li.getparent()
+    if ul == None or ul.tag != 'ul':
+      return None
+    div = ul.getparent()
+    if div == None or div.tag != 'div':
+      return None
+    filters = div.getparent()
+    if filters == None or filters.tag != 'div' or filters.get('id') != 'filters':
+      return None
+    return {'FilterbyGenre': 'genre', 'FilterbyNetwork': 'network'}.get(div.get('class'))
+
+  def ReadRow(self, li):
+    # The show id comes from the first link in the row, which is within the 'new episode' div for shows with new episodes
+    # Trailers are listed whatever their provider
+    showFullUrl = next(li.iter('a')).get('href')
+    isProtected = not self.trailers and (li.get('class') or '').startswith('protected')
+    isNew = len([child for child in li if child.tag == 'div']) > 0
+    return ListingRow(SHOW_ID.search(showFullUrl).group(1), AbsoluteUrl(showFullUrl, self.siteUrl), isProtected, isNew)
+
+  def ReadFilter(self, li, filterType):
+    for link in li:
+      if link.tag == 'a':
+        filterName = str(link.text)
+        if filterName not in self.hidden:
+          self.filters[filterType].append((filterName, self.siteUrl + FILTER_URL.search(link.get('onclick')).group(1)))
+
+
+def TrailerUrls(page, siteUrl):
+  # Returns {showId: url} of the videos page of the first trailer listed for each show on the trailers page
+  trailerUrls = {}
+  for row in TRAILER_ROWS(page):
+    trailerUrl = next(row.iter('a')).get('href')
+    showId = SHOW_ID.search(trailerUrl).group(1)
+    if showId not in trailerUrls:
+      trailerUrls[showId] = AbsoluteUrl(trailerUrl, siteUrl)
+  return trailerUrls
+
+
+def AbsoluteUrl(url, siteUrl):
+  # Links on the site are mostly relative to it
+  if url.startswith('/'):
+    return siteUrl + url
+  return url
+
+
+def Filters(page, filterType, siteUrl, hidden=()):
+  # Returns a list of (filterName, filterUrl) for the genres or networks listed on a tv / movies widget
+  # Filters named in hidden (eg networks we cannot play) are left out
+
+  if ( filterType == 'network' ):
+    links = NETWORK_FILTERS(page)
+  else:
+    links = GENRE_FILTERS(page)
+
+  filters = []
+  for link in links:
+    # Strip away the javascript function call (filterEpList)
+    filterUrl = siteUrl + FILTER_URL.search(link.get('onclick')).group(1)
+    filterName = str(link.text)
+
+    if filterName not in hidden:
+      filters.append((filterName, filterUrl))
+
+  return filters
+
+
+def Show(page, showId):
+  # Returns (ShowRecord, errors) from a show's photos page, errors lists the (field, exception) that couldn't be extracted
+  # Raises ExtractError if none of the fields could be
+
+  showMeta = Store.ShowRecord()
+
+  # Each field is extracted on its own, so a page missing one still gives us the others
+  errors = []
+
+  # Find the show title from the page
+  showMeta.title = ExtractField(errors, 'title', lambda: TidyString(SHOW_TITLE(page)[0].text), TitleFromId(showId))
+
+  # Find the show's photos
+  def Thumb():
+    images = SHOW_IMAGES(page)
+    if len(images) > 0:
+      # src is already fully qualified, zoom up to a decent size (this assumes all images are avaialble in all sizes
+      return SMALL_IMAGE.sub('640_320', images[0].get('src'))
+    return ''
+  showMeta.thumb = ExtractField(errors, 'thumb', Thumb)
+
+  # Find the show's network - Not all shows display a network
+  def Network():
+    networkLinks = NETWORK_LINKS(page)
+    if len(networkLinks) > 0:
+      return NETWORK.search(networkLinks[0].get('href')).group(1)
+    return ''
+  showMeta.network = ExtractField(errors, 'network', Network)
+
+  if len(errors) == 3:
+    # No title, thumb or network, nothing worth storing
+    raise ExtractError(errors)
+
+  return (showMeta, errors)
+
+
+def Asset(body, assetId, siteUrl, parseXML):
+  # Returns (AssetRecord, errors) from the source of an asset's videos page, as Show
+  # The metadata is stored within the javascript on the page (video.playerData), parseXML parses it into an element
+
+  assetMeta = Store.AssetRecord()
+
+  # Extract the value of video.playerData and parse as XML
+  errors = []
+  assetMetadataString = ExtractField(errors, 'playerData', lambda: PLAYER_DATA.search(body).group(1), None)
+  if assetMetadataString == None:
+    raise ExtractError(errors)
+  assetMetadata = parseXML(assetMetadataString)
+
+  # Gather the available metadata in one walk, keeping the first of each field
+  values = {}
+  for parent in assetMetadata.iter():
+    for element in parent:
+      field = PLAYER_FIELDS.get((parent.tag, element.tag))
+      if field != None and field not in values:
+        values[field] = element.text
+
+  # Each field on its own so a missing one doesn't lose the others
+  assetMeta.showTitle = ExtractField(errors, 'showTitle', lambda: values['showTitle'])
+  assetMeta.episodeTitle = ExtractField(errors, 'episodeTitle', lambda: values['episodeTitle'])
+  assetMeta.thumb = ExtractField(errors, 'thumb', lambda: values['thumb'])
+  assetMeta.description = ExtractField(errors, 'description', lambda: values['description'])
+  assetMeta.duration = ExtractField(errors, 'duration', lambda: ConvertDuration(values['duration']), '0')
+  assetMeta.airdate = ExtractField(errors, 'airdate', lambda: values['airdate'])
+  assetMeta.season = ExtractField(errors, 'season', lambda: values['season'])
+  assetMeta.episodeNumber = ExtractField(errors, 'episodeNumber', lambda: values['episodeNumber'])
+
+  if not assetMeta.season:
+    assetMeta.season = 'Unknown'
+  if not assetMeta.episodeNumber:
+    assetMeta.episodeNumber = 'Unknown'
+
+  assetMeta.url = siteUrl + assetId + '/videos'
+
+  if len(errors) == 8:
+    # None of the fields, nothing worth storing
+    raise ExtractError(errors)
+
+  return (assetMeta, errors)
+
+
+def Episodes(page, siteUrl):
+  # Parses a full-episodes page into a list of SeasonRecords
+  # Shows without multiple seasons have a single season with an id of None holding every episode
+
+  # TV shows can have multiple seasons
+  seasonOptions = SEASON_OPTIONS(page)
+
+  if len(seasonOptions) <= 1:
+    return [SeasonRecord(None, None, '', [Episode(row, siteUrl) for row in EPISODE_ROWS(page)])]
+
+  # Find each season's div in one pass rather than searching the whole document per season
+  seasonDivs = {}
+  for div in SEASON_DIVS(page):
+    seasonDivs[div.get('id')] = div
+
+  seasons = []
+  for option in seasonOptions:
+    seasonId = option.get('value')
+    seasonName = SEASON_NAME.search(option.text).group(1)
+
+    episodes = []
+    if seasonId in seasonDivs:
+      episodes = [Episode(row, siteUrl) for row in SEASON_ROWS(seasonDivs[seasonId])]
+
+    # The thumbnail for the season is the thumbnail for the first listed episode in the season
+    thumb = ''
+    if len(episodes) > 0:
+      thumb = episodes[0].thumb
+
+    seasons.append(SeasonRecord(seasonId, seasonName, thumb, episodes))
+
+  return seasons
+
+
+def Episode(row, siteUrl):
+  # Returns the EpisodeRecord for a row of the episode list
+  # The row is walked once: the links of the first cell give the url and title, its span the duration,
+  # the 'two' and 'three' cells the episode and airdate, and the first paragraph and image in the row the summary and thumb
+
+  number = airdate = duration = summary = thumb = None
+  urlLink = titleLink = None
+  firstCell = True
+  for cell in row:
+    cellClass = cell.get('class')
+    if cellClass == 'two':
+      number = cell.text
+    elif cellClass == 'three':
+      airdate = cell.text
+
+    links = 0
+    for element in cell.iter():
+      tag = element.tag
+      if tag == 'a' and element.getparent() is cell:
+        links = links + 1
+        if links == 1 and cellClass == 'first' and urlLink == None:
+          urlLink = element
+        elif links == 2 and firstCell:
+          titleLink = element
+      elif tag == 'span' and cellClass == 'first' and duration == None:
+        duration = element.text
+      elif tag == 'p' and summary == None:
+        summary = element
+      elif tag == 'img' and thumb == None:
+        thumb = element.get('src')
+    if cell.tag == 'td':
+      firstCell = False
+
+  if urlLink == None or titleLink == None or duration == None or summary == None or thumb == None:
+    raise ExtractError([(field, LookupError('not found')) for field, value in
+      (('url', urlLink), ('title', titleLink), ('duration', duration), ('summary', summary), ('thumb', thumb)) if value == None])
+
+  # The pipe between the season and episode is kept, eg Season 1 | Episode 2
+  episode = TidyString(number)
+  episode = SEASON.sub('Season ', episode)
+  episode = EPISODE.sub('Episode ', episode)
+  episode = UNKNOWN.sub('Season: Unknown', episode)
+
+  return EpisodeRecord(
+    title=TidyString(titleLink.text),
+    summary=summary.text,
+    episode=episode,
+    airdate=TidyString(airdate),
+    duration=ConvertDuration(DURATION.search(duration).group(1)),
+    thumb=thumb,
+    url=str(siteUrl + urlLink.get('href'))
+  )
+
+
+def Movie(listingsPage, aboutPage, siteUrl):
+  # Returns the MovieRecord from the full-movie (listings) and about pages
+
+  # Get metadata from listingsPage, the details are all within the one table
+  table = MOVIE_TABLE(listingsPage)[0]
+  cell = [cell for cell in table.iter('td') if cell.get('class') == 'first'][0]
+  links = [link for link in cell if link.tag == 'a']
+  duration = [span for link in links for span in link if span.tag == 'span'][0].text
+  # Strip the brackets surrounding the year
+  yearAndRating = YEAR.sub(r'\1', TidyString(MOVIE_META(listingsPage)[0].text))
+
+  # Get metadata from about page
+  thumb = ''
+  thumbs = MOVIE_THUMBS(aboutPage)
+  if len(thumbs) > 0:
+    thumb = thumbs[0].get('src')
+
+  return MovieRecord(
+    title=TidyString(links[1].text),
+    url=str(siteUrl + links[0].get('href')),
+    duration=ConvertDuration(DURATION.search(duration).group(1)),
+    yearAndRating=yearAndRating,
+    summary=MOVIE_SUMMARY(aboutPage)[0].text,
+    thumb=thumb
+  )
+
+
+def Top5(page, divIds, siteUrl):
+  # Returns {mediaType: [assetId]} for the Top 5 lists on the front page, divIds maps each media type to the id of its div
+  # The available metadata is very sparse so only the asset ids are taken, their metadata comes from their own pages
+
+  top5 = {}
+  for mediaType, divId in divIds.items():
+    assetIds = []
+    for item in TOP5_ITEMS(page, div=divId):
+      itemUrl = [link for link in item if link.tag == 'a'][0].get('href')
+      # The asset id is the path after siteUrl, up to /videos
+      assetIds.append(ASSET_PATH.search(itemUrl[itemUrl.index(siteUrl) + len(siteUrl):]).group(1))
+    top5[mediaType] = assetIds
+  return top5
@@ -0,0 +1,376 @@
+# Shared HTTP fetch engine for the Fancast metadata crawl
+#
+# Crawl requests go through a FetchEngine rather than one connection per task, the engine provides:
+#  - a cap on the number of concurrent requests (and worker threads in Map)
+#  - persistent (keep-alive) connections, pooled and reused per scheme and host, http and https urls only
+#  - a token bucket rate limiter per host
+#  - retry with jittered exponential backoff on transient errors
+#  - redirects followed, up to maxRedirects per request
+#  - per-request latency, on each Response and aggregated in Stats()
+#  - partial reads, stopping once a marker (eg '</head>') has been received
+#  - binary reads (eg images), returning the body as bytes rather than text
+#  - an optional observer, called as observer(url, status, latency, bytes) after every attempt (status is None if it failed)
+#
+# This module does not depend on the plugin framework so it can also be used by tools run outside PMS
+
+import sys
+import time
+import random
+import socket
+import threading
+try:
+  import httplib
+  from urlparse import urlsplit, urljoin
+except ImportError:
+  import http.client as httplib
+  from urllib.parse import urlsplit, urljoin
+
+# Status codes worth retrying, anything else is returned to the caller as is
+RETRY_STATUSES = (408, 429, 500, 502, 503, 504)
+
+# Status codes whose Location is followed
+REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+
+# Sent with every request unless the engine's or the caller's headers replace it
+USER_AGENT = 'Mozilla/5.0 (compatible; Fancast.bundle)'
+
+
+class FetchError(Exception):
+  # Raised when a request fails after all retries, or returns an error status to Get
+  def __init__(self, url, message, status=None):
+    Exception.__init__(self, "%s: %s" % (url, message))
+    self.url = url
+    self.status = status
+
+
+class Response(object):
+  # The result of a request, headers are keyed by lower case name
+
+  def __init__(self, url, status, headers, body, latency, attempts):
+    self.url = url
+    self.status = status
+    self.headers = headers
+    self.body = body
+    self.latency = latency
+    self.attempts = attempts
+
+
+class TokenBucket(object):
+  # Allows burst requests at once, then rate requests per second
+
+  def __init__(self, rate, burst):
+    self.rate = float(rate)
+    self.burst = float(burst)
+    self.tokens = float(burst)
+    self.updated = time.time()
+    self.lock = threading.Lock()
+
+  def Take(self):
+    # Blocks until a token is available
+    while True:
+      self.lock.acquire()
+      try:
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+          self.tokens = self.tokens - 1
+          return
+        wait = (1 - self.tokens) / self.rate
+      finally:
+        self.lock.release()
+      time.sleep(wait)
+
+
+class FetchEngine(object):
+
+  def __init__(self, workers=8, rate=5.0, burst=10, retries=3, backoff=1.0, timeout=30, proxy=None, headers=None, maxRedirects=5):
+    # workers caps concurrent requests across all callers
+    # proxy is an optional 'host:port' that all requests are sent through (eg a local mirror of the site)
+    self.workers = workers
+    self.rate = rate
+    self.burst = burst
+    self.retries = retries
+    self.backoff = backoff
+    self.timeout = timeout
+    self.proxy = proxy
+    self.headers = {'User-Agent': USER_AGENT}
+    self.headers.update(headers or {})
+    self.maxRedirects = maxRedirects
+    self.observer = None
+
+    self.slots = threading.Semaphore(workers)
+    self.lock = threading.Lock()
+    self.buckets = {}
+    self.idle = {}
+    self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'connections': 0, 'redirects': 0, 'bytes': 0, 'latencyTotal': 0.0, 'latencyMax': 0.0}
+
+  ######
+  # Requests
+
+  def Request(self, url, headers=None, until=None, binary=False):
+    # Performs a GET request for url, retrying transient errors and following redirects
+    # Returns a Response for any status that isn't retried (or is still failing after all retries), its url is the one finally fetched
+    # Raises FetchError if no response could be had at all, or after more than maxRedirects redirects
+    # If until is given the body is only read up to and including the first occurrence of it
+    # If binary is set the body is returned as bytes, without being decoded
+    # Raises FetchError straight away for a url (or redirect target) that isn't http or https
+
+    redirects = 0
+    while True:
+      response = self.Send(url, headers, until, binary)
+      location = response.headers.get('location')
+      if response.status not in REDIRECT_STATUSES or not location:
+        return response
+      if redirects >= self.maxRedirects:
+        self.Count('failures')
+        raise FetchError(url, "more than %d redirects" % self.maxRedirects, response.status)
+      redirects = redirects + 1
+      self.Count('redirects')
+      url = urljoin(url, location)
+
+  def Send(self, url, headers, until, binary):
+    # Requests url (retrying transient errors) without following redirects, see Request
+
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https'):
+      raise FetchError(url, "unsupported scheme '%s'" % parts.scheme)
+    host = parts.netloc
+    path = parts.path or '/'
+    if parts.query:
+      path = path + '?' + parts.query
+
+    # Connections are pooled per origin, the scheme and the host connected to
+    origin = (parts.scheme, host)
+    if self.proxy:
+      # Proxies (eg a local mirror) are spoken to in plain http and take the absolute url
+      origin = ('http', self.proxy)
+      path = url
+
+    requestHeaders = dict(self.headers)
+    requestHeaders['Host'] = host
+    if headers:
+      requestHeaders.update(headers)
+
+    bucket = self.Bucket(host)
+    attempt = 0
+    while True:
+      attempt = attempt + 1
+      bucket.Take()
+      self.slots.acquire()
+      try:
+        start = time.time()
+        try:
+          if until:
+            status, responseHeaders, body = self.PartialExchange(origin, path, requestHeaders, until)
+          else:
+            status, responseHeaders, body = self.Exchange(origin, path, requestHeaders, binary)
+          error = None
+        except (socket.error, httplib.HTTPException):
+          status = None
+          error = sys.exc_info()[1]
+        latency = time.time() - start
+      finally:
+        self.slots.release()
+
+      self.Record(latency, body=(status and body) or '')
+      if self.observer:
+        self.observer(url, status, latency, len((status and body) or ''))
+
+      if status != None and (status not in RETRY_STATUSES or attempt > self.retries):
+        return Response(url, status, responseHeaders, body, latency, attempt)
+
+      if attempt > self.retries:
+        self.Count('failures')
+        raise FetchError(url, "%s after %d attempts" % (error, attempt))
+
+      self.Count('retries')
+      time.sleep(self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+
+  def Get(self, url, headers=None, until=None, binary=False):
+    # As Request but raises FetchError unless the response is 200 OK
+    response = self.Request(url, headers, until, binary)
+    if response.status != 200:
+      self.Count('failures')
+      raise FetchError(url, "HTTP status %d" % response.status, response.status)
+    return response
+
+  def Map(self, function, items, onError=None):
+    # Calls function(item) for each item using at most 'workers' threads, returns the results in the same order
+    # An item whose call raises has a result of None, onError(item, exc_info) is called if given
+
+    items = list(items)
+    results = [None] * len(items)
+    queue = list(enumerate(items))
+    queueLock = threading.Lock()
+
+    def Worker():
+      while True:
+        queueLock.acquire()
+        try:
+          if not queue:
+            return
+          index, item = queue.pop(0)
+        finally:
+          queueLock.release()
+        try:
+          results[index] = function(item)
+        except Exception:
+          if onError:
+            onError(item, sys.exc_info())
+
+    threads = []
+    for i in range(min(self.workers, len(items))):
+      thread = threading.Thread(target=Worker)
+      thread.start()
+      threads.append(thread)
+    for thread in threads:
+      thread.join()
+
+    return results
+
+  def Stats(self):
+    # Returns a copy of the aggregate counters, including the mean request latency
+    self.lock.acquire()
+    try:
+      stats = dict(self.stats)
+    finally:
+      self.lock.release()
+    if stats['requests'] > 0:
+      stats['latencyMean'] = stats['latencyTotal'] / stats['requests']
+    else:
+      stats['latencyMean'] = 0.0
+    return stats
+
+  ######
+  # Internals
+
+  def Bucket(self, host):
+    self.lock.acquire()
+    try:
+      if host not in self.buckets:
+        self.buckets[host] = TokenBucket(self.rate, self.burst)
+      return self.buckets[host]
+    finally:
+      self.lock.release()
+
+  def Exchange(self, origin, path, headers, binary=False):
+    # Sends a single request over a pooled connection to origin, a (scheme, host) tuple, and reads the whole response
+    # Connections are only returned to the pool once the response has been fully read
+
+    connection, reused = self.Checkout(origin)
+    try:
+      connection.request('GET', path, headers=headers)
+      response = connection.getresponse()
+      body = response.read()
+    except (socket.error, httplib.HTTPException):
+      connection.close()
+      if not reused:
+        raise
+      # The server closed the idle connection, try once more on a new one
+      connection = self.Connect(origin)
+      try:
+        connection.request('GET', path, headers=headers)
+        response = connection.getresponse()
+        body = response.read()
+      except:
+        connection.close()
+        raise
+
+    if str is not bytes and not binary:
+      body = body.decode(self.Charset(response.getheader('content-type')), 'replace')
+
+    responseHeaders = {}
+    for name, value in response.getheaders():
+      responseHeaders[name.lower()] = value
+
+    if response.will_close:
+      connection.close()
+    else:
+      self.Checkin(origin, connection)
+
+    return (response.status, responseHeaders, body)
+
+  def PartialExchange(self, origin, path, headers, until, chunkSize=4096):
+    # Sends a request on a new connection to origin and reads the response until 'until' has been received
+    # The rest of the response is abandoned, so the connection is closed rather than pooled
+
+    connection = self.Connect(origin)
+    try:
+      connection.request('GET', path, headers=headers)
+      response = connection.getresponse()
+      charset = self.Charset(response.getheader('content-type'))
+      if not isinstance(until, bytes):
+        until = until.encode(charset)
+
+      body = b''
+      while True:
+        chunk = response.read(chunkSize)
+        if not chunk:
+          break
+        # Only the tail of what we already have needs searching again, in case the marker spans two chunks
+        searchFrom = max(0, len(body) - len(until))
+        body = body + chunk
+        end = body.find(until, searchFrom)
+        if end >= 0:
+          body = body[:end + len(until)]
+          break
+
+      responseHeaders = {}
+      for name, value in response.getheaders():
+        responseHeaders[name.lower()] = value
+    finally:
+      connection.close()
+
+    if str is not bytes:
+      body = body.decode(charset, 'replace')
+
+    return (response.status, responseHeaders, body)
+
+  def Checkout(self, origin):
+    # Returns an idle connection to origin if there is one, otherwise a new connection
+    # along with a flag noting whether the connection has been used before
+    self.lock.acquire()
+    try:
+      connections = self.idle.get(origin)
+      if connections:
+        return (connections.pop(), True)
+    finally:
+      self.lock.release()
+    return (self.Connect(origin), False)
+
+  def Connect(self, origin):
+    scheme, host = origin
+    self.Count('connections')
+    if scheme == 'https':
+      return httplib.HTTPSConnection(host, timeout=self.timeout)
+    return httplib.HTTPConnection(host, timeout=self.timeout)
+
+  def Checkin(self, origin, connection):
+    self.lock.acquire()
+    try:
+      self.idle.setdefault(origin, []).append(connection)
+    finally:
+      self.lock.release()
+
+  def Charset(self, contentType):
+    if contentType and 'charset=' in contentType:
+      return contentType.split('charset=')[-1].split(';')[0].strip()
+    return 'utf-8'
+
+  def Record(self, latency, body):
+    self.lock.acquire()
+    try:
+      self.stats['requests'] = self.stats['requests'] + 1
+      self.stats['bytes'] = self.stats['bytes'] + len(body)
+      self.stats['latencyTotal'] = self.stats['latencyTotal'] + latency
+      self.stats['latencyMax'] = max(self.stats['latencyMax'], latency)
+    finally:
+      self.lock.release()
+
+  def Count(self, name):
+    self.lock.acquire()
+    try:
+      self.stats[name] = self.stats[name] + 1
+    finally:
+      self.lock.release()
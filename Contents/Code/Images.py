@@ -0,0 +1,164 @@
+# Image cache for the Fancast plugin
+#
+# Thumbnails are stored as items in a storage object (the framework's Data in the plugin) under a name derived from their url
+# An index of url, size, content type and last use is kept in memory, and the least recently used images are removed
+# once the total size exceeds maxSize
+# The index is dumped and loaded by the caller, so it can be persisted alongside the plugin's other state
+#
+# This module does not depend on the plugin framework, storage only needs Save(name, data), Load(name) and Remove(name)
+
+import hashlib
+import threading
+
+CONTENT_TYPES = {'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif'}
+
+
+def ContentType(url):
+  # Guesses the content type of an image from the extension in its url
+  extension = url.split('?')[0].split('.')[-1].lower()
+  return CONTENT_TYPES.get(extension, 'image/jpeg')
+
+
+class ImageCache(object):
+
+  def __init__(self, storage, maxSize):
+    self.storage = storage
+    self.maxSize = maxSize
+    self.lock = threading.Lock()
+    # url -> [name, size, contentType, lastUsed]
+    self.index = {}
+    self.size = 0
+    self.tick = 0
+    self.dirty = False
+    self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+  def Name(self, url):
+    return 'image-' + hashlib.md5(url.encode('utf-8')).hexdigest()
+
+  def Has(self, url):
+    return url in self.index
+
+  def Get(self, url):
+    # Returns (data, contentType) for url, or None if it isn't cached
+    self.lock.acquire()
+    try:
+      entry = self.index.get(url)
+      if entry == None:
+        self.stats['misses'] = self.stats['misses'] + 1
+        return None
+      self.tick = self.tick + 1
+      entry[3] = self.tick
+      self.dirty = True
+    finally:
+      self.lock.release()
+
+    data = self.storage.Load(entry[0])
+    if data == None:
+      # The stored item has gone, forget it unless another thread has evicted or stored it again meanwhile
+      self.lock.acquire()
+      try:
+        if self.index.get(url) is entry:
+          self.Forget(url)
+        self.stats['misses'] = self.stats['misses'] + 1
+      finally:
+        self.lock.release()
+      return None
+
+    self.lock.acquire()
+    try:
+      self.stats['hits'] = self.stats['hits'] + 1
+    finally:
+      self.lock.release()
+    return (data, entry[2])
+
+  def Put(self, url, data, contentType=None):
+    # Stores the image data for url, evicting the least recently used images to make room
+    # Images larger than the whole cache are not stored
+    if len(data) > self.maxSize:
+      return
+    if contentType == None:
+      contentType = ContentType(url)
+
+    name = self.Name(url)
+    self.storage.Save(name, data)
+
+    self.lock.acquire()
+    try:
+      if url in self.index:
+        self.size = self.size - self.index[url][1]
+      self.tick = self.tick + 1
+      self.index[url] = [name, len(data), contentType, self.tick]
+      self.size = self.size + len(data)
+      self.stats['stores'] = self.stats['stores'] + 1
+      self.dirty = True
+      evicted = self.Evict(url)
+    finally:
+      self.lock.release()
+
+    for evictedName in evicted:
+      self.storage.Remove(evictedName)
+
+  def Stats(self):
+    self.lock.acquire()
+    try:
+      stats = dict(self.stats)
+      stats['entries'] = len(self.index)
+      stats['size'] = self.size
+      stats['maxSize'] = self.maxSize
+    finally:
+      self.lock.release()
+    lookups = stats['hits'] + stats['misses']
+    if lookups > 0:
+      stats['hitRate'] = float(stats['hits']) / lookups
+    else:
+      stats['hitRate'] = 0.0
+    return stats
+
+  ######
+  # Persistence
+
+  def Dump(self):
+    self.lock.acquire()
+    try:
+      self.dirty = False
+      return dict([(url, list(entry)) for url, entry in self.index.items()])
+    finally:
+      self.lock.release()
+
+  def Load(self, index):
+    # Replaces the index with one returned by Dump, the stored images are assumed to still be there
+    self.lock.acquire()
+    try:
+      self.index = {}
+      self.size = 0
+      self.tick = 0
+      for url, entry in (index or {}).items():
+        self.index[url] = list(entry)
+        self.size = self.size + entry[1]
+        self.tick = max(self.tick, entry[3])
+      self.dirty = False
+    finally:
+      self.lock.release()
+
+  ######
+  # Internals, the lock must be held
+
+  def Forget(self, url):
+    self.size = self.size - self.index[url][1]
+    del self.index[url]
+    self.dirty = True
+
+  def Evict(self, keep):
+    # Drops least recently used entries (other than keep) until the cache fits, returns the names to remove from storage
+    evicted = []
+    if self.size <= self.maxSize:
+      return evicted
+    for url, entry in sorted(self.index.items(), key=lambda item: item[1][3]):
+      if self.size <= self.maxSize:
+        break
+      if url == keep:
+        continue
+      evicted.append(entry[0])
+      self.Forget(url)
+      self.stats['evictions'] = self.stats['evictions'] + 1
+    return evicted
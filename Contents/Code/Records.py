@@ -0,0 +1,175 @@
+# Persistent cache of extracted records for the Fancast plugin
+#
+# Rather than keeping whole pages in the framework's HTTP cache, what was extracted from them (eg a show's seasons and episodes,
+# or a movie's details) is kept as zlib compressed JSON, a few hundred bytes per record instead of the page
+# Each record is an item in a storage object (the framework's Data in the plugin), stored with the time it expires and the
+# version of the extractor that produced it. Records from another version count as missing, so a change to the extraction
+# takes effect without clearing anything
+# Records found expired, outdated or corrupt are removed from storage. An index of each stored record's expiry and size is kept,
+# Sweep() removes the expired records and, over a total size, those expiring soonest. The index is dumped and loaded by the caller
+#
+# This module does not depend on the plugin framework, storage only needs Save(name, data), Load(name) and Remove(name)
+
+import zlib
+import json
+import hashlib
+import threading
+
+
+class RecordCache(object):
+
+  def __init__(self, storage, versions):
+    # versions maps each kind of record to the version of the extractor producing it, eg {'episodes': 1}
+    self.storage = storage
+    self.versions = versions
+    self.lock = threading.Lock()
+    # name -> [expiresAt, size]
+    self.index = {}
+    self.size = 0
+    self.dirty = False
+    self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'outdated': 0, 'corrupt': 0, 'stores': 0, 'removed': 0, 'bytesStored': 0, 'bytesExtracted': 0}
+
+  def Name(self, kind, key):
+    return 'record-%s-%s' % (kind, hashlib.md5(key.encode('utf-8')).hexdigest())
+
+  def Get(self, kind, key, now):
+    # Returns (expiresAt, record) for key, or None if there is no current record
+    name = self.Name(kind, key)
+    blob = self.storage.Load(name)
+    if blob == None:
+      self.Count('misses')
+      self.lock.acquire()
+      try:
+        self.Forget(name)
+      finally:
+        self.lock.release()
+      return None
+
+    try:
+      version, expiresAt, record = json.loads(zlib.decompress(blob).decode('utf-8'))
+    except (zlib.error, ValueError, TypeError, UnicodeDecodeError):
+      self.Remove(name, 'corrupt')
+      return None
+    if version != self.versions[kind]:
+      self.Remove(name, 'outdated')
+      return None
+    if expiresAt <= now:
+      self.Remove(name, 'expired')
+      return None
+
+    self.Count('hits')
+    return (expiresAt, record)
+
+  def Has(self, kind, key):
+    # Returns True if a record for key has been stored (it may since have expired), without reading it
+    return self.Name(kind, key) in self.index
+
+  def Put(self, kind, key, record, now, ttl):
+    # Stores record for key until now + ttl, record must be plain dicts, lists, strings and numbers
+    text = json.dumps([self.versions[kind], now + ttl, record], separators=(',', ':'))
+    if not isinstance(text, bytes):
+      text = text.encode('utf-8')
+    blob = zlib.compress(text, 6)
+    name = self.Name(kind, key)
+    self.storage.Save(name, blob)
+
+    self.lock.acquire()
+    try:
+      self.Forget(name)
+      self.index[name] = [now + ttl, len(blob)]
+      self.size = self.size + len(blob)
+      self.dirty = True
+      self.stats['stores'] = self.stats['stores'] + 1
+      self.stats['bytesStored'] = self.stats['bytesStored'] + len(blob)
+      self.stats['bytesExtracted'] = self.stats['bytesExtracted'] + len(text)
+    finally:
+      self.lock.release()
+
+  def Sweep(self, now, maxSize):
+    # Removes the expired records, then those expiring soonest until the records stored total at most maxSize bytes
+    # Returns the number of records removed
+    self.lock.acquire()
+    try:
+      names = [name for name, (expiresAt, size) in self.index.items() if expiresAt <= now]
+      size = self.size - sum([self.index[name][1] for name in names])
+      if size > maxSize:
+        for name, (expiresAt, recordSize) in sorted(self.index.items(), key=lambda item: item[1][0]):
+          if size <= maxSize:
+            break
+          if expiresAt > now:
+            names.append(name)
+            size = size - recordSize
+    finally:
+      self.lock.release()
+
+    for name in names:
+      self.Remove(name, None)
+    return len(names)
+
+  def Stats(self):
+    self.lock.acquire()
+    try:
+      stats = dict(self.stats)
+      stats['entries'] = len(self.index)
+      stats['size'] = self.size
+    finally:
+      self.lock.release()
+    lookups = stats['hits'] + stats['misses'] + stats['expired'] + stats['outdated'] + stats['corrupt']
+    if lookups > 0:
+      stats['hitRate'] = float(stats['hits']) / lookups
+    else:
+      stats['hitRate'] = 0.0
+    return stats
+
+  ######
+  # Persistence
+
+  def Dump(self):
+    self.lock.acquire()
+    try:
+      self.dirty = False
+      return dict([(name, list(entry)) for name, entry in self.index.items()])
+    finally:
+      self.lock.release()
+
+  def Load(self, index):
+    # Replaces the index with one returned by Dump, the stored records are assumed to still be there
+    self.lock.acquire()
+    try:
+      self.index = {}
+      self.size = 0
+      for name, entry in (index or {}).items():
+        self.index[name] = list(entry)
+        self.size = self.size + entry[1]
+      self.dirty = False
+    finally:
+      self.lock.release()
+
+  ######
+  # Internals
+
+  def Remove(self, name, reason):
+    # Removes a stored record, counting it under reason if one is given
+    self.storage.Remove(name)
+    self.lock.acquire()
+    try:
+      self.Forget(name)
+      self.stats['removed'] = self.stats['removed'] + 1
+      if reason:
+        self.stats[reason] = self.stats[reason] + 1
+    finally:
+      self.lock.release()
+
+  def Forget(self, name):
+    # Drops name from the index, the lock must be held
+    entry = self.index.pop(name, None)
+    if entry != None:
+      self.size = self.size - entry[1]
+      self.dirty = True
+
+  def Count(self, name):
+    self.lock.acquire()
+    try:
+      self.stats[name] = self.stats[name] + 1
+    finally:
+      self.lock.release()
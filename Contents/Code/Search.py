@@ -0,0 +1,96 @@
+# Search index for the Fancast plugin
+#
+# An inverted index from normalized tokens to the documents (shows and episodes) containing them
+# Text is lower cased, accents and punctuation are dropped and it is split into words, so "Grey's Anatomy" gives greys and anatomy
+# Every word of a query matches as a prefix, "gre ana" finds Grey's Anatomy, which suits typing with a remote
+# The tokens are also kept sorted so each prefix is looked up with a binary search
+#
+# Documents are added with a weight per field, a document scores the weight of the best field matching each query word
+# with a bonus for whole word matches, all the words of a query must match
+#
+# This module does not depend on the plugin framework
+
+import re
+import bisect
+import unicodedata
+
+WORD = re.compile(r'\w+', re.UNICODE)
+
+# Bonus added to the score for each query word matching a whole word, rather than just a prefix of one
+EXACT_BONUS = 0.5
+
+
+def Tokenize(text):
+  # Returns the normalized words of text, apostrophes are removed rather than splitting the word
+  if not text:
+    return []
+  if isinstance(text, bytes):
+    text = text.decode('utf-8', 'replace')
+  text = unicodedata.normalize('NFKD', text)
+  text = u''.join([c for c in text if not unicodedata.combining(c)])
+  text = text.lower().replace(u"'", u'').replace(u'\u2019', u'')
+  return WORD.findall(text)
+
+
+class SearchIndex(object):
+  # Built once and then only read, a new index is built and swapped in to update it
+
+  def __init__(self):
+    self.documents = []
+    self.postings = {}
+    self.tokens = []
+
+  def Add(self, document, fields):
+    # Adds document (any value, returned by Search) with fields, a list of (text, weight)
+    index = len(self.documents)
+    self.documents.append(document)
+    for text, weight in fields:
+      for token in Tokenize(text):
+        posting = self.postings.setdefault(token, {})
+        if posting.get(index, 0) < weight:
+          posting[index] = weight
+
+  def Finish(self):
+    # Must be called once every document has been added
+    self.tokens = sorted(self.postings.keys())
+
+  def Search(self, query, limit=None):
+    # Returns the documents matching every word of query, best first
+    words = Tokenize(query)
+    if not words:
+      return []
+
+    scores = None
+    for word in words:
+      matches = self.Matches(word)
+      if scores == None:
+        scores = matches
+      else:
+        scores = dict([(index, scores[index] + score) for index, score in matches.items() if index in scores])
+      if not scores:
+        return []
+
+    # Best score first, ties in the order the documents were added
+    ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+    if limit != None:
+      ranked = ranked[:limit]
+    return [self.documents[index] for index, score in ranked]
+
+  def Matches(self, word):
+    # Returns {document index: score} for the documents with a token starting with word
+    matches = {}
+    position = bisect.bisect_left(self.tokens, word)
+    while position < len(self.tokens) and self.tokens[position].startswith(word):
+      token = self.tokens[position]
+      bonus = 0
+      if token == word:
+        bonus = EXACT_BONUS
+      for index, weight in self.postings[token].items():
+        score = weight + bonus
+        if matches.get(index, 0) < score:
+          matches[index] = score
+      position = position + 1
+    return matches
+
+  def Stats(self):
+    return {'documents': len(self.documents), 'tokens': len(self.tokens)}
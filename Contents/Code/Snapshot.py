@@ -0,0 +1,35 @@
+# Snapshots for the Fancast plugin
+#
+# A snapshot holds everything the menus are served from, as plain dicts and lists:
+# the stored listings, browse index and filters, Top 5 lists and the dumped metadata store
+# It is written as a single blob of zlib compressed JSON, so it is compact and loads with one read
+# The blob carries a format version and the time it was created, blobs of another version or that don't decode are ignored
+#
+# This module does not depend on the plugin framework
+
+import zlib
+import json
+
+# Bump this when the layout of the state changes, snapshots with another version are ignored
+SNAPSHOT_VERSION = 2
+
+
+def Dump(state, createdAt):
+  # Returns the blob for state
+  text = json.dumps({'version': SNAPSHOT_VERSION, 'createdAt': createdAt, 'state': state}, separators=(',', ':'))
+  if not isinstance(text, bytes):
+    text = text.encode('utf-8')
+  return zlib.compress(text, 6)
+
+
+def Load(blob):
+  # Returns (createdAt, state) from a blob returned by Dump, or None if it is missing, corrupt or from another version
+  if not blob:
+    return None
+  try:
+    snapshot = json.loads(zlib.decompress(blob).decode('utf-8'))
+  except (zlib.error, ValueError, UnicodeDecodeError):
+    return None
+  if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+    return None
+  return (snapshot.get('createdAt', 0), snapshot.get('state') or {})
@@ -0,0 +1,198 @@
+# Instrumentation for the Fancast plugin
+#
+# A Registry aggregates:
+#  - counters, eg cache hits and misses or bytes fetched
+#  - gauges, values that are replaced rather than added to, eg the duration of the last cache update
+#  - timings, latency histograms with fixed buckets from which the mean, max and approximate percentiles are reported
+#
+# Timings can be recorded with the Timed decorator, with Start / Stop around a block, or for every call of
+# selected methods of an object through Proxy (eg the framework's Dict, HTTP and XML)
+# Snapshot() returns everything as plain dicts and lists, ready to be serialized
+#
+# This module does not depend on the plugin framework
+
+import time
+import functools
+import threading
+
+# The upper bounds (seconds) of the latency histogram buckets, anything slower falls in a final unbounded bucket
+LATENCY_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+
+try:
+  STRING_TYPES = (basestring,)
+except NameError:
+  STRING_TYPES = (str, bytes)
+
+
+class Histogram(object):
+  # Not thread safe by itself, the registry holds its lock while updating
+
+  def __init__(self, bounds=LATENCY_BUCKETS):
+    self.bounds = bounds
+    self.counts = [0] * (len(bounds) + 1)
+    self.count = 0
+    self.total = 0.0
+    self.max = 0.0
+
+  def Add(self, value):
+    index = 0
+    while index < len(self.bounds) and value > self.bounds[index]:
+      index = index + 1
+    self.counts[index] = self.counts[index] + 1
+    self.count = self.count + 1
+    self.total = self.total + value
+    self.max = max(self.max, value)
+
+  def Percentile(self, fraction):
+    # Returns the upper bound of the bucket holding the given fraction of values (the max for the last bucket)
+    if self.count == 0:
+      return 0.0
+    target = fraction * self.count
+    seen = 0
+    for index, count in enumerate(self.counts):
+      seen = seen + count
+      if seen >= target and count > 0:
+        if index < len(self.bounds):
+          return min(self.bounds[index], self.max)
+        return self.max
+    return self.max
+
+  def Snapshot(self):
+    buckets = []
+    for index, count in enumerate(self.counts):
+      if index < len(self.bounds):
+        buckets.append([self.bounds[index], count])
+      else:
+        buckets.append([None, count])
+
+    mean = 0.0
+    if self.count > 0:
+      mean = self.total / self.count
+
+    return {'count': self.count, 'total': self.total, 'mean': mean, 'max': self.max,
+      'p50': self.Percentile(0.5), 'p95': self.Percentile(0.95), 'p99': self.Percentile(0.99), 'buckets': buckets}
+
+
+class Registry(object):
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.started = time.time()
+    self.counters = {}
+    self.gauges = {}
+    self.timings = {}
+
+  ######
+  # Recording
+
+  def Increment(self, name, amount=1):
+    self.lock.acquire()
+    try:
+      self.counters[name] = self.counters.get(name, 0) + amount
+    finally:
+      self.lock.release()
+
+  def Gauge(self, name, value):
+    self.lock.acquire()
+    try:
+      self.gauges[name] = value
+    finally:
+      self.lock.release()
+
+  def Observe(self, name, seconds):
+    self.lock.acquire()
+    try:
+      if name not in self.timings:
+        self.timings[name] = Histogram()
+      self.timings[name].Add(seconds)
+    finally:
+      self.lock.release()
+
+  def Start(self):
+    # Returns a token for Stop, for timing a block of code
+    return time.time()
+
+  def Stop(self, name, start):
+    # Records the time since start under name and returns it
+    elapsed = time.time() - start
+    self.Observe(name, elapsed)
+    return elapsed
+
+  def Timed(self, name):
+    # Decorator recording the duration of every call under name, and counting calls that raise at name.errors
+    # The wrapped function keeps its name, which the framework uses to route Function() callbacks
+    def Decorator(function):
+      def Wrapper(*args, **kwargs):
+        start = time.time()
+        try:
+          return function(*args, **kwargs)
+        except:
+          self.Increment(name + '.errors')
+          raise
+        finally:
+          self.Observe(name, time.time() - start)
+      return functools.wraps(function)(Wrapper)
+    return Decorator
+
+  def Proxy(self, target, prefix, methods):
+    # Returns an object that behaves as target but times calls of the named methods at prefix.method
+    # The length of any string they return is counted at prefix.method.bytes
+    return TimedProxy(self, target, prefix, methods)
+
+  ######
+  # Reporting
+
+  def Snapshot(self):
+    self.lock.acquire()
+    try:
+      timings = {}
+      for name, histogram in self.timings.items():
+        timings[name] = histogram.Snapshot()
+      return {'uptime': time.time() - self.started, 'counters': dict(self.counters), 'gauges': dict(self.gauges), 'timings': timings}
+    finally:
+      self.lock.release()
+
+  def Reset(self):
+    self.lock.acquire()
+    try:
+      self.started = time.time()
+      self.counters = {}
+      self.gauges = {}
+      self.timings = {}
+    finally:
+      self.lock.release()
+
+
+class TimedProxy(object):
+
+  def __init__(self, registry, target, prefix, methods):
+    self.__dict__['target'] = target
+    for method in methods:
+      self.__dict__[method] = self.Wrap(registry, getattr(target, method), prefix + '.' + method)
+
+  def Wrap(self, registry, method, name):
+    def Wrapper(*args, **kwargs):
+      start = time.time()
+      try:
+        result = method(*args, **kwargs)
+      except:
+        registry.Increment(name + '.errors')
+        raise
+      finally:
+        registry.Observe(name, time.time() - start)
+      if isinstance(result, STRING_TYPES):
+        registry.Increment(name + '.bytes', len(result))
+      return result
+    return Wrapper
+
+  def __getattr__(self, name):
+    return getattr(self.__dict__['target'], name)
+
+  def __setattr__(self, name, value):
+    setattr(self.__dict__['target'], name, value)
+
+  def __getitem__(self, key):
+    return self.__dict__['target'][key]
+
+  def __setitem__(self, key, value):
+    self.__dict__['target'][key] = value
@@ -0,0 +1,315 @@
+# Metadata store for the Fancast plugin
+#
+# Show and asset metadata is held in memory as compact records (one __slots__ object per show or asset)
+# rather than as one plugin dictionary entry per id
+# Writes only change the in memory records, Dump() returns the whole store as a single value to be persisted once per batch
+#
+# Each record carries fetchedAt (when its metadata was fetched) and listedAt (when it was last seen listed on the site),
+# these drive the refresh scheduling
+#
+# Ids whose metadata couldn't be fetched or extracted have a FailureRecord, noting the error and when to try again
+# The delay before retrying doubles with each consecutive failure, see Fail
+#
+# This module does not depend on the plugin framework
+
+import hashlib
+import threading
+
+# Bump this when the persisted layout changes, stores with another version are discarded and refetched
+SCHEMA_VERSION = 1
+
+
+class ShowRecord(object):
+  __slots__ = ('title', 'thumb', 'network', 'fetchedAt', 'listedAt')
+  FIELDS = __slots__
+
+  def __init__(self, title='', thumb='', network='', fetchedAt=0, listedAt=0):
+    self.title = title
+    self.thumb = thumb
+    self.network = network
+    self.fetchedAt = fetchedAt
+    self.listedAt = listedAt
+
+
+class AssetRecord(object):
+  __slots__ = ('showTitle', 'episodeTitle', 'thumb', 'description', 'duration', 'airdate', 'season', 'episodeNumber', 'url', 'fetchedAt', 'listedAt')
+  FIELDS = __slots__
+
+  def __init__(self, showTitle='', episodeTitle='', thumb='', description='', duration='', airdate='', season='', episodeNumber='', url='', fetchedAt=0, listedAt=0):
+    self.showTitle = showTitle
+    self.episodeTitle = episodeTitle
+    self.thumb = thumb
+    self.description = description
+    self.duration = duration
+    self.airdate = airdate
+    self.season = season
+    self.episodeNumber = episodeNumber
+    self.url = url
+    self.fetchedAt = fetchedAt
+    self.listedAt = listedAt
+
+
+class FailureRecord(object):
+  # kind is 'show' or 'asset', partial is set when some metadata was extracted and stored despite the error
+  __slots__ = ('kind', 'errorClass', 'message', 'count', 'firstFailedAt', 'lastFailedAt', 'retryAt', 'partial')
+  FIELDS = __slots__
+
+  def __init__(self, kind='', errorClass='', message='', count=0, firstFailedAt=0, lastFailedAt=0, retryAt=0, partial=False):
+    self.kind = kind
+    self.errorClass = errorClass
+    self.message = message
+    self.count = count
+    self.firstFailedAt = firstFailedAt
+    self.lastFailedAt = lastFailedAt
+    self.retryAt = retryAt
+    self.partial = partial
+
+
+class MetadataStore(object):
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.shows = {}
+    self.assets = {}
+    self.networks = {}
+    self.failures = {}
+    self.dirty = False
+
+  ######
+  # Reads
+
+  def HasShow(self, showId):
+    return showId in self.shows
+
+  def HasAsset(self, assetId):
+    return assetId in self.assets
+
+  def GetShow(self, showId):
+    return self.shows.get(showId)
+
+  def GetAsset(self, assetId):
+    return self.assets.get(assetId)
+
+  def GetShows(self, showIds):
+    # Returns the records for a list of show ids, in the same order, with None for any we don't hold
+    shows = self.shows
+    return [shows.get(showId) for showId in showIds]
+
+  def GetAssets(self, assetIds):
+    assets = self.assets
+    return [assets.get(assetId) for assetId in assetIds]
+
+  def AssetIds(self):
+    return list(self.assets.keys())
+
+  def Counts(self):
+    return {'shows': len(self.shows), 'assets': len(self.assets), 'networks': len(self.networks), 'failures': len(self.failures)}
+
+  def GetFailure(self, id):
+    return self.failures.get(id)
+
+  def GetFailures(self):
+    # Returns a list of (id, FailureRecord) for every id that is currently failing
+    self.lock.acquire()
+    try:
+      return list(self.failures.items())
+    finally:
+      self.lock.release()
+
+  def InBackoff(self, id, now):
+    # Returns True if id has failed and shouldn't be tried again yet
+    failure = self.failures.get(id)
+    return failure != None and failure.retryAt > now
+
+  def Fingerprint(self):
+    # Returns a short hash of the metadata held, and of which ids are failing
+    # fetchedAt and listedAt are left out, they change on every cache update without changing what is shown
+    digest = hashlib.md5()
+    self.lock.acquire()
+    try:
+      for records, fields in ((self.shows, ShowRecord.FIELDS[:-2]), (self.assets, AssetRecord.FIELDS[:-2])):
+        for id in sorted(records.keys()):
+          record = records[id]
+          digest.update(repr((id, [getattr(record, field) for field in fields])).encode('utf-8'))
+      digest.update(repr(sorted(self.failures.keys())).encode('utf-8'))
+    finally:
+      self.lock.release()
+    return digest.hexdigest()
+
+  ######
+  # Writes
+
+  def PutShow(self, showId, record):
+    self.lock.acquire()
+    try:
+      record.network = self.Intern(record.network)
+      self.shows[showId] = record
+      self.dirty = True
+    finally:
+      self.lock.release()
+
+  def PutAsset(self, assetId, record):
+    self.lock.acquire()
+    try:
+      self.assets[assetId] = record
+      self.dirty = True
+    finally:
+      self.lock.release()
+
+  def Touch(self, records, ids, now):
+    # Notes that ids are still listed on the site, ids we hold no record for are ignored
+    self.lock.acquire()
+    try:
+      for id in ids:
+        record = records.get(id)
+        if record != None and record.listedAt != now:
+          record.listedAt = now
+          self.dirty = True
+    finally:
+      self.lock.release()
+
+  def TouchShows(self, showIds, now):
+    self.Touch(self.shows, showIds, now)
+
+  def TouchAssets(self, assetIds, now):
+    self.Touch(self.assets, assetIds, now)
+
+  def Expire(self, kind):
+    # Marks every show (kind 'show') or asset record as never fetched, so they are first in line to be refreshed
+    self.lock.acquire()
+    try:
+      records = self.shows
+      if kind == 'asset':
+        records = self.assets
+      for record in records.values():
+        record.fetchedAt = 0
+      self.dirty = True
+    finally:
+      self.lock.release()
+
+  def Fail(self, kind, id, errorClass, message, now, delay, maxDelay, partial=False):
+    # Records a failure for id, it won't be retried for delay seconds, doubled for each previous consecutive failure up to maxDelay
+    # Returns the failure record
+    self.lock.acquire()
+    try:
+      failure = self.failures.get(id)
+      if failure == None:
+        failure = FailureRecord(kind, firstFailedAt=now)
+        self.failures[id] = failure
+      failure.errorClass = errorClass
+      failure.message = message
+      failure.count = failure.count + 1
+      failure.lastFailedAt = now
+      failure.retryAt = now + min(delay * (2 ** (failure.count - 1)), maxDelay)
+      failure.partial = partial
+      self.dirty = True
+      return failure
+    finally:
+      self.lock.release()
+
+  def Succeed(self, id):
+    # Clears any failure recorded for id
+    self.lock.acquire()
+    try:
+      if id in self.failures:
+        del self.failures[id]
+        self.dirty = True
+    finally:
+      self.lock.release()
+
+  def Stale(self, now, minAge, forgetAfter):
+    # Returns (fetchedAt, kind, id) for every record fetched at least minAge seconds ago, kind is 'show' or 'asset'
+    # Ids that have failed are left out until their retry time
+    # Records that haven't been listed for forgetAfter seconds are dropped from the store,
+    # as are failures that haven't been retried for that long
+
+    stale = []
+    self.lock.acquire()
+    try:
+      for kind, records in (('show', self.shows), ('asset', self.assets)):
+        for id, record in list(records.items()):
+          if now - record.listedAt > forgetAfter:
+            del records[id]
+            self.dirty = True
+          elif now - record.fetchedAt >= minAge and not self.InBackoff(id, now):
+            stale.append((record.fetchedAt, kind, id))
+      for id, failure in list(self.failures.items()):
+        if now - failure.lastFailedAt > forgetAfter and failure.retryAt <= now:
+          del self.failures[id]
+          self.dirty = True
+    finally:
+      self.lock.release()
+    return stale
+
+  ######
+  # Persistence
+  # Records are dumped as tuples of their fields, network names are stored once and referenced by index
+
+  def Dump(self):
+    self.lock.acquire()
+    try:
+      networks = []
+      networkIndex = {}
+      shows = {}
+      for showId, record in self.shows.items():
+        if record.network not in networkIndex:
+          networkIndex[record.network] = len(networks)
+          networks.append(record.network)
+        shows[showId] = (record.title, record.thumb, networkIndex[record.network], record.fetchedAt, record.listedAt)
+
+      assets = {}
+      for assetId, record in self.assets.items():
+        assets[assetId] = tuple([getattr(record, field) for field in AssetRecord.FIELDS])
+
+      failures = {}
+      for id, record in self.failures.items():
+        failures[id] = tuple([getattr(record, field) for field in FailureRecord.FIELDS])
+
+      self.dirty = False
+    finally:
+      self.lock.release()
+
+    return {'version': SCHEMA_VERSION, 'networks': networks, 'shows': shows, 'assets': assets, 'failures': failures}
+
+  def Load(self, data):
+    # Replaces the contents of the store with a value returned by Dump
+    # Returns False (leaving the store empty) if data is missing or from another schema version
+
+    shows = {}
+    assets = {}
+    networks = {}
+    failures = {}
+    loaded = False
+
+    if data and data.get('version') == SCHEMA_VERSION:
+      networkNames = []
+      for name in data['networks']:
+        networks[name] = name
+        networkNames.append(name)
+      for showId, (title, thumb, network, fetchedAt, listedAt) in data['shows'].items():
+        shows[showId] = ShowRecord(title, thumb, networkNames[network], fetchedAt, listedAt)
+      for assetId, fields in data['assets'].items():
+        assets[assetId] = AssetRecord(*fields)
+      # Stores dumped before failures were recorded don't have any
+      for id, fields in data.get('failures', {}).items():
+        failures[id] = FailureRecord(*fields)
+      loaded = True
+
+    self.lock.acquire()
+    try:
+      self.shows = shows
+      self.assets = assets
+      self.networks = networks
+      self.failures = failures
+      self.dirty = False
+    finally:
+      self.lock.release()
+
+    return loaded
+
+  ######
+  # Internals, the lock must be held
+
+  def Intern(self, name):
+    # Shares one copy of each network name between all the shows on that network
+    return self.networks.setdefault(name, name)
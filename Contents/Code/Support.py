@@ -1,11 +1,23 @@
 # Support functions for Fancast plugin
 import re
+import sys
+import hashlib
+try:
+  from urllib import unquote
+except ImportError:
+  from urllib.parse import unquote
+
+# Compiled once, ConvertDuration and TidyString run for every row extracted
+DURATION_PARTS = re.compile(r'((\d*):)?(\d+):(\d+)')
+NEW_LINES = re.compile(r'\n')
+TIDY = re.compile(r'^\s*(\S.*?\S?)\s*$')
+SHOW_NAME = re.compile(r'/(?:tv|movies)/([^/]+)/')
 
 def ConvertDuration(durationString):
   # Takes hh:mm:ss or mm:ss and returns a plex duration (ms)
 
-  if re.search(r':', durationString):
-    durationParts = re.search(r'((\d*):)?(\d+):(\d+)', durationString)
+  if ':' in durationString:
+    durationParts = DURATION_PARTS.search(durationString)
     if durationParts.group(2) is not None:
       # Time has hours minutes and seconds
       durationSeconds = (int(durationParts.group(2)) * 3600 )+ ( int(durationParts.group(3)) * 60 ) +  int(durationParts.group(4))
@@ -22,9 +34,9 @@ def TidyString(stringToTidy):
   # Function to tidy up strings works ok with unicode, 'strip' seems to have issues in some cases so we use a regex
   if stringToTidy:
     # Strip new lines
-    stringToTidy = re.sub(r'\n', r' ', stringToTidy)
+    stringToTidy = NEW_LINES.sub(' ', stringToTidy)
     # Strip leading / trailing spaces
-    stringSearch = re.search(r'^\s*(\S.*?\S?)\s*$', stringToTidy)
+    stringSearch = TIDY.search(stringToTidy)
     if stringSearch == None:
       return ''
     else:
@@ -32,3 +44,36 @@ def TidyString(stringToTidy):
   else:
     return ''
 
+
+
+def Fingerprint(strings):
+  # Returns a short hash identifying an ordered list of strings, used to detect changes in show lists
+  digest = hashlib.md5()
+  for string in strings:
+    if not isinstance(string, bytes):
+      string = string.encode('utf-8')
+    digest.update(string)
+    digest.update(b'\n')
+  return digest.hexdigest()
+
+
+class ExtractError(Exception):
+  # Raised when none of the metadata could be extracted from a page, errors is the list of (field, exception) from ExtractField
+  def __init__(self, errors):
+    Exception.__init__(self, '; '.join(["%s: %s" % (field, error) for field, error in errors]))
+    self.errors = errors
+
+def ExtractField(errors, field, extractor, default=''):
+  # Returns extractor(), or default if it raises in which case (field, exception) is appended to errors
+  try:
+    return extractor()
+  except Exception:
+    errors.append((field, sys.exc_info()[1]))
+    return default
+
+def TitleFromId(showId):
+  # Makes a title from a show id, eg /tv/South-Park/62926/ gives South Park
+  match = SHOW_NAME.search(showId)
+  if match == None:
+    return ''
+  return unquote(match.group(1)).replace('-', ' ')
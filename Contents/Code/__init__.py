@@ -4,7 +4,21 @@ from PMS import *
 from Support import *
 import re
 import os
-import random
+import sys
+import glob
+import time
+import Fetch
+import Cache
+import Store
+import Stats
+import Search
+import Images
+import Snapshot
+import Extract
+import Records
+import heapq
+import functools
+import threading
 ######
 
 ######
@@ -29,10 +43,77 @@ HIDE_PROTECTED_PROVIDERS        = True # Some movies are supplied by 'Protected
 # Cache Intervals
 CACHE_FRONTPAGE                 = 3600   # The length of time to cache the front page, used for Top5
 CACHE_SHOWLIST                  = 18000  # The length of time to cache the list of available shows
-CACHE_SHOWMETADATA              = 2419200# The length of time to cache the metadata for show (photo and network) - 4 weeks
 CACHE_SHOWASSETS                = 18000  # The length of time to cache the availalbe assets for a show
-CACHE_ASSETMETADATA             = 2419200# The length of time to cache the metadata for an individual asset - 4 weeks
-METADATE_UPDATE_PROBABILITY     = 0.02   # The probability that an update for existing show metadata will be attempted, this should update all assets over a week, after the original cache has expired
+CACHE_RAWPAGE                   = 0      # The length of time pages are kept in the framework's HTTP cache, what is extracted from them is cached instead, see RecordStore
+PAGE_CACHE_SIZE                 = 4194304# The total size (bytes of page source) of the parsed listing pages kept in memory, see GetPage
+MOVIE_CACHE_SIZE                = 500    # The number of movie records kept in memory, see GetMovie
+EPISODE_CACHE_SIZE              = 20000  # The total number of episodes (of recently viewed shows) kept in memory, see GetShowEpisodes
+RESPONSE_CACHE_SIZE             = 20000  # The total number of items in the menu responses kept in memory, see CachedResponse
+CACHE_ASPECT                    = 2592000# The length of time the aspect ratio of an asset's player is kept, see GetAspect - 30 days
+ASPECT_CACHE_SIZE               = 5000   # The number of aspect ratios kept in memory, see GetAspect
+RECORD_CACHE_SIZE               = 52428800# The total size (bytes, compressed) of the records kept in RecordStore, the soonest to expire are removed first - 50MB
+######
+# Image Cache
+# Thumbnails are kept on disk and served by the plugin rather than fetched from the site by every client, see Thumb
+IMAGE_CACHE                     = True   # Serve thumbnails through the image cache, if False clients are sent to the site's images
+IMAGE_CACHE_SIZE                = 209715200# The total size (bytes) of the images kept on disk, the least recently used are removed first - 200MB
+IMAGE_PREFETCH_BUDGET           = 500    # The maximum number of images fetched ahead of time per UpdateCache run
+IMAGE_INDEX_SAVE_INTERVAL       = 300    # The longest time (seconds) changes to the image cache's index go unsaved while serving images
+######
+# Metadata Refresh
+# Existing show and asset metadata is refreshed oldest first, a limited number each time UpdateCache runs
+REFRESH_BUDGET_COUNT            = 50     # The maximum number of existing metadata entries refreshed per UpdateCache run
+REFRESH_BUDGET_TIME             = 300    # The maximum time (seconds) spent refreshing existing metadata per UpdateCache run
+REFRESH_BATCH_SIZE              = 10     # The number of entries refreshed in parallel, the time budget is checked between batches
+REFRESH_MIN_AGE                 = 86400  # Metadata younger than this (seconds) is never refreshed
+REFRESH_FORGET_AFTER            = 1209600# Stop refreshing metadata for shows / assets that haven't been listed for this long (seconds) - 2 weeks
+INCREMENTAL_UPDATE              = True   # Use conditional requests and compare show lists so UpdateCache skips listing pages that have not changed
+######
+# Crawl Order
+# UpdateCache fetches show metadata with shows with new episodes and Top 5 shows first, in batches
+# After each batch the browse index is rebuilt, so the menus list the shows fetched so far while the crawl continues
+CRAWL_BATCH_SIZE                = 100    # The number of shows whose metadata is fetched before the browse index is rebuilt
+STREAM_LISTINGS                 = True   # Parse downloaded listing pages a part at a time (the download itself is whole), fetching the metadata of shows that need it while the listings are still being read
+LISTING_CHUNK_SIZE              = 16384  # The size (characters) of each part of a listing page handed to the parser when streaming
+######
+# Prefetch
+# While a menu is shown the pages behind its first items are fetched in the background, so drilling down doesn't wait on the site
+# Prefetches still queued when the user moves on to another menu are dropped
+PREFETCH                        = True   # Prefetch the next level of the menus
+PREFETCH_ITEMS                  = 5      # The number of shows (or videos) at the top of a list whose next level is prefetched
+PREFETCH_EPISODES               = 3      # The number of episodes at the top of an episode list whose asset pages are prefetched
+PREFETCH_WORKERS                = 2      # The number of prefetches run at once
+PREFETCH_BUDGET                 = 20     # The most prefetches queued at once, the rest of a menu's are left out
+######
+# Snapshot Import
+# A snapshot written by Tools/Crawl.py, eg on another machine or against a local mirror, can stand in for the plugin's own crawl
+SNAPSHOT_IMPORT_PATH            = None   # Optional path of the snapshot file, checked at the start of each UpdateCache run
+SNAPSHOT_IMPORT_MAX_AGE         = 172800 # Snapshots older than this (seconds) are ignored and UpdateCache crawls as usual - 2 days
+######
+# Crawl Failures
+# Shows / assets whose metadata can't be fetched or extracted are not tried again for a while, see CrawlFailed
+FAILURE_RETRY_DELAY             = 3600   # The time (seconds) before retrying an id after its first failure, doubled for each further failure
+FAILURE_RETRY_MAX               = 604800 # The longest time (seconds) between retries - 1 week
+FAILURE_POISONED_AFTER          = 4      # Ids that have failed this many times in a row are reported as poisoned by SummarizeFailures
+######
+# Crawl Fetch Engine
+# Listing, show and asset metadata requests made by UpdateCache are sent through a shared engine, see Fetch.py
+FETCH_WORKERS                   = 8      # The maximum number of concurrent crawl requests
+FETCH_RATE                      = 5.0    # The sustained number of crawl requests per second allowed to each host
+FETCH_BURST                     = 10     # The number of requests a host may receive in a burst before FETCH_RATE applies
+FETCH_RETRIES                   = 3      # The number of times a request is retried after a transient error
+FETCH_BACKOFF                   = 1.0    # The base delay (seconds) before a retry, doubled for each attempt and jittered
+FETCH_TIMEOUT                   = 30     # Socket timeout (seconds) for crawl requests
+FETCH_PROXY                     = None   # Optional 'host:port' of a proxy or local mirror to send crawl requests through
+######
+# Paging
+PAGE_SIZE                       = 50     # The number of shows / episodes listed at once, a 'More...' item leads to the next page
+######
+# Search
+SEARCH_RESULTS                  = 50     # The maximum number of shows / episodes listed for a search
+######
+# Playback
+FLASH_BOOKMARKS                 = "~/Library/Preferences/Macromedia/Flash Player/#SharedObjects/*/www.fancast.com/static-*/swf/FCVidContainerInit.swf/comfancastbookmarks.sol"
 ######
 # Debug Flags
 DEBUG                           = False # General logging
@@ -48,10 +129,42 @@ DEBUG_XML_RESPONSE              = False # Log the response to PMS
 # A show can be either a TV Series or a Movie
 # The identifier used by the plugin is taken from the url eg
 # /tv/South-Park/62926/ or /movies/The-Taking-of-Pelham-1%2C-2%2C-3/22089/ etc..
-# The metadata once retrieved is stored in the plugin dictionary at show-id ie show-/tv/South-Park/62926/
-# Metadata for shows is:
+# The metadata once retrieved is held in the metadata store (see Store.py) keyed by id, which is persisted in the plugin dictionary at metadataStore
+# Metadata for shows is: title, thumb and network
 
 # A show consists of multiple assets, i.e. episodes, clips or the movie itself
+# Assets are identified in the same way eg /tv/South-Park/62926/1234567
+
+# The shared fetch engine used by the metadata crawl
+CrawlEngine = Fetch.FetchEngine(workers=FETCH_WORKERS, rate=FETCH_RATE, burst=FETCH_BURST, retries=FETCH_RETRIES, backoff=FETCH_BACKOFF, timeout=FETCH_TIMEOUT, proxy=FETCH_PROXY)
+
+# A separate engine for requests made while the user waits, so they never queue behind the crawl
+UserEngine = Fetch.FetchEngine(workers=FETCH_WORKERS, rate=FETCH_RATE, burst=FETCH_BURST, retries=1, backoff=FETCH_BACKOFF, timeout=FETCH_TIMEOUT, proxy=FETCH_PROXY)
+
+# Parsed listing pages shared between the menus, see GetPage
+PageCache = Cache.LRUCache(PAGE_CACHE_SIZE)
+
+# Show and asset metadata, see LoadMetadata / CommitMetadata
+MetaStore = Store.MetadataStore()
+
+# Timings, counters and gauges served by StatsReport
+Metrics = Stats.Registry()
+
+# Menu responses, see CachedResponse
+ResponseCache = Cache.LRUCache(RESPONSE_CACHE_SIZE)
+
+# Every framework request, parse and dictionary access is timed
+HTTP = Metrics.Proxy(HTTP, 'http', ('Request',))
+XML = Metrics.Proxy(XML, 'xml', ('ElementFromURL', 'ElementFromString'))
+Dict = Metrics.Proxy(Dict, 'dict', ('Get', 'Set', 'HasKey'))
+Data = Metrics.Proxy(Data, 'data', ('Save', 'Load', 'Remove'))
+
+# Thumbnails, see Thumb
+ImageStore = Images.ImageCache(Data, IMAGE_CACHE_SIZE)
+
+# Episode lists and movie details extracted from their pages, see GetShowEpisodes and FetchMovie
+# The aspect ratios of assets (see GetAspect) are kept there too, they are worked out by the plugin rather than by Extract
+RecordStore = Records.RecordCache(Data, dict(Extract.VERSIONS, aspect=1))
 
 
 def Start():
@@ -67,46 +180,494 @@ def Start():
   MediaContainer.viewGroup = 'List'
   MediaContainer.art = R('art-default.png')
 
+  CrawlEngine.observer = FetchObserver('crawl')
+  UserEngine.observer = FetchObserver('user')
+
+  LoadMetadata()
+  if not MenusAvailable():
+    LoadSnapshot()
+  LoadImages()
+  LoadRecords()
+  BuildSearchIndex()
+
+  # Aspect ratios were kept in the dictionary at aspects before they moved to RecordStore, see GetAspect
+  if Dict.Get('aspects') != None:
+    Dict.Set('aspects', None)
+
 ###########################
 # Caching and metadata update functions
 #
 
+@Metrics.Timed('crawl.UpdateCache')
 def UpdateCache():
 
   # Updates the metadata dictionary for shows
-  # This must run at least once before the plugin is available
+  # The menus become available as soon as the first batch of shows has metadata, see MenusAvailable
   # Show metadata is stored in the plugin dictionary once retrieved
   # The user facing plugin functions pull from the dictionary and thus do not refresh the cache directly
 
   # We retrieve metadata for tv, movies and trailers
+  # For tv and movies the genre / network filter pages are also checked, they make up the browse index
+
+  started = time.time()
 
-  for url in ( FANCAST_TV_WIDGET, FANCAST_MOVIES_WIDGET, FANCAST_TRAILERS_URL):
-    page = XML.ElementFromURL(url, isHTML=True, cacheTime=CACHE_SHOWLIST)
-    if url == FANCAST_TRAILERS_URL:
-      shows = page.xpath("//div[@id='episodeList']/ul[@class='fullEpisodeList']/li[not(@class='head')]")
+  # A recent snapshot from Tools/Crawl.py takes the place of the crawl
+  if not ImportSnapshot():
+    Crawl()
+
+  # Rebuild the lists of shows the menus are served from
+  BuildBrowseIndex()
+  BuildSearchIndex()
+
+  # Fetch the thumbnails the menus will show first
+  PrefetchImages()
+  CommitImages(force=True)
+
+  # Remove the records that have expired, or don't fit within RECORD_CACHE_SIZE
+  SweepRecords()
+
+  # Once UpdateCache has run at least once we note this in the dictionary
+  Dict.Set('cacheRanOnce', True)
+
+  # Keep a copy of what the menus are served from for the next start, see LoadSnapshot
+  SaveSnapshot()
+
+  RecordCoverage(started)
+
+@Metrics.Timed('crawl.Crawl')
+def Crawl():
+
+  # Fetches the listings, Top 5 and metadata that have changed or are missing, and refreshes the oldest metadata
+
+  # The listings come first, they are only a few pages and say which shows need metadata
+  # When streaming, the shows that need it are fetched as they are found, see EarlyShowFetches
+  onShow = finishEarlyFetches = None
+  if STREAM_LISTINGS and Extract.STREAMING:
+    onShow, finishEarlyFetches = EarlyShowFetches()
+
+  # The early fetches are always finished, even when a listing fails, so their thread and queued shows aren't left waiting
+  showIds = []
+  try:
+    for url in ( FANCAST_TV_WIDGET, FANCAST_MOVIES_WIDGET, FANCAST_TRAILERS_URL):
+      try:
+        showIds = showIds + UpdateListing(url, onShow)
+      except Exception:
+        # Keep the shows stored for this page last time, those still lacking metadata get their pass
+        Metrics.Increment('crawl.listings.failed')
+        PMS.Log("Failed to update listing %s: %s" % (url, sys.exc_info()[1]))
+        showIds = showIds + MissingShowMetadata(GetListing(url).get('showIds', []))
+
+      for filterType, availableFilters in GetListing(url).get('filters', {}).items():
+        for filterName, filterUrl in availableFilters:
+          try:
+            showIds = showIds + UpdateListing(filterUrl, onShow)
+          except Exception:
+            # Keep whatever we had for this filter last time
+            Metrics.Increment('crawl.listings.failed')
+            PMS.Log("Failed to update %s listing %s: %s" % (filterType, filterName, sys.exc_info()[1]))
+
+    # Precompute the Top 5 lists, these come from the front page
+    try:
+      UpdateTop5()
+    except Exception:
+      PMS.Log("Failed to update the Top 5: %s" % sys.exc_info()[1])
+  finally:
+    if finishEarlyFetches:
+      finishEarlyFetches()
+
+  # Fetch the show metadata most likely to be wanted first, publishing the shows to the menus as we go
+  showIds = PrioritizeShows(Unique(showIds))
+  for batchStart in range(0, len(showIds), CRAWL_BATCH_SIZE):
+    GetShowMetadata(showIds[batchStart:batchStart + CRAWL_BATCH_SIZE])
+    if batchStart + CRAWL_BATCH_SIZE < len(showIds):
+      CommitMetadata()
+      BuildBrowseIndex()
+
+  # Refresh the oldest of the metadata we already hold
+  RefreshStaleMetadata()
+
+  # Report anything that keeps failing
+  SummarizeFailures()
+
+  # Persist everything fetched during this run in one go
+  CommitMetadata()
+
+@Metrics.Timed('crawl.UpdateListing')
+def UpdateListing(url, onShow=None):
+
+  # Fetches a listing page (tv, movies, trailers or a genre / network filter) and returns the show ids that need a metadata pass
+  # In incremental mode the page is requested conditionally and the list of show ids is compared with the previous run
+  # so that only new shows, or shows still lacking metadata, are returned
+  # When streaming, onShow(showId, new) is also called for each of these as soon as it is parsed, see StreamListing
+
+  # The validators and extracted shows and filters from the previous run are stored in the dictionary at listing-url
+  listingKey = 'listing-' + url
+  listing = GetListing(url)
+  previousIds = listing.get('showIds', [])
+
+  if INCREMENTAL_UPDATE:
+    body, etag, lastModified = ConditionalRequest(url, listing.get('etag'), listing.get('lastModified'))
+  else:
+    # Every page is fetched and parsed in full, and all of its shows get a metadata pass
+    body, etag, lastModified = ConditionalRequest(url)
+    listing = {}
+    previousIds = []
+
+  if body == None:
+    # The server reports the page is unchanged, no need to parse it
+    Metrics.Increment('crawl.listings.notModified')
+    if DEBUG:
+      PMS.Log("Listing unchanged (not modified): %s" % url)
+    MetaStore.TouchShows(previousIds, time.time())
+    return MissingShowMetadata(previousIds)
+
+  bodyHash = Fingerprint([body])
+  if bodyHash == listing.get('bodyHash'):
+    # Same bytes as last time, the server just doesn't support conditional requests
+    Metrics.Increment('crawl.listings.sameBody')
+    showIds = previousIds
+    newEpisodeIds = listing.get('newEpisodeIds', [])
+    filters = listing.get('filters', {})
+    trailerUrls = listing.get('trailerUrls', {})
+  else:
+    Metrics.Increment('crawl.listings.parsed')
+    if STREAM_LISTINGS and Extract.STREAMING:
+      # No tree is kept, the menus parse the page themselves if they need it
+      PageCache.Invalidate(url)
+      showIds, newEpisodeIds, filters, trailerUrls = StreamListing(url, body, previousIds, onShow)
     else:
-      if HIDE_PROTECTED_PROVIDERS:
-        shows = page.xpath("//div[@class='fullEpisodeList']//div/ul/li[not(starts-with(@class, 'protected'))]")
+      page = XML.ElementFromString(body, isHTML=True)
+      showIds = ExtractShowIds(page, url)
+
+      # The page has changed, replace any copy the menus have parsed with this one
+      PageCache.Invalidate(url)
+      PageCache.Set(url, page, len(body), CACHE_SHOWLIST)
+      newEpisodeIds = []
+      filters = {}
+      trailerUrls = {}
+      if url == FANCAST_TV_WIDGET:
+        newEpisodeIds = ExtractShowIds(page, url, 'new')
+        filters['genre'] = ExtractFilters(page, 'genre')
+        filters['network'] = ExtractFilters(page, 'network')
+      elif url == FANCAST_MOVIES_WIDGET:
+        filters['genre'] = ExtractFilters(page, 'genre')
+      elif url == FANCAST_TRAILERS_URL:
+        trailerUrls = Extract.TrailerUrls(page, FANCAST_URL)
+
+  fingerprint = Fingerprint(showIds)
+  if fingerprint == listing.get('fingerprint'):
+    if DEBUG:
+      PMS.Log("Listing unchanged (same shows): %s" % url)
+    newIds = []
+  else:
+    previous = set(previousIds)
+    current = set(showIds)
+    newIds = [id for id in showIds if id not in previous]
+    if DEBUG:
+      PMS.Log("Listing changed: %s, %d new shows, %d removed shows" % (url, len(newIds), len(previous - current)))
+
+  Dict.Set(listingKey, {'etag': etag, 'lastModified': lastModified, 'bodyHash': bodyHash, 'fingerprint': fingerprint, 'showIds': showIds, 'newEpisodeIds': newEpisodeIds, 'filters': filters, 'trailerUrls': trailerUrls})
+  MetaStore.TouchShows(showIds, time.time())
+
+  newIdSet = set(newIds)
+  return newIds + MissingShowMetadata([id for id in showIds if id not in newIdSet])
+
+@Metrics.Timed('extract.StreamListing')
+def StreamListing(url, body, previousIds, onShow):
+
+  # Parses a listing page LISTING_CHUNK_SIZE at a time, see Extract.ListingParser
+  # Only the parse is incremental, body is the whole page as downloaded by ConditionalRequest
+  # (the body hash and the conditional request's validators are checked before anything is parsed)
+  # Returns (showIds, newEpisodeIds, filters, trailerUrls) as UpdateListing extracts them from the whole page
+  # onShow(showId, new) is called for each listed show that is new or still lacks metadata as soon as its row is parsed
+
+  parser = Extract.ListingParser(url == FANCAST_TRAILERS_URL, FANCAST_URL, HiddenNetworks())
+  previous = set(previousIds)
+  showIds = []
+  newEpisodeIds = []
+  trailerUrls = {}
+
+  def Listed(rows):
+    for row in rows:
+      # Shows with new episodes are only taken from the tv page, protected or not
+      if row.new and url == FANCAST_TV_WIDGET:
+        newEpisodeIds.append(row.showId)
+      if url == FANCAST_TRAILERS_URL and row.showId not in trailerUrls:
+        trailerUrls[row.showId] = row.url
+      if row.protected and HIDE_PROTECTED_PROVIDERS:
+        continue
+      showIds.append(row.showId)
+      if onShow and (row.showId not in previous or MissingShowMetadata([row.showId])):
+        onShow(row.showId, row.new)
+
+  for start in range(0, len(body), LISTING_CHUNK_SIZE):
+    Listed(parser.Feed(body[start:start + LISTING_CHUNK_SIZE]))
+  Listed(parser.Close())
+
+  filters = {}
+  if url == FANCAST_TV_WIDGET:
+    filters = parser.filters
+  elif url == FANCAST_MOVIES_WIDGET:
+    filters['genre'] = parser.filters['genre']
+
+  return (showIds, newEpisodeIds, filters, trailerUrls)
+
+def EarlyShowFetches():
+
+  # Starts fetching show metadata on a background thread as the show ids are handed to it
+  # Returns (onShow, finish): onShow(showId, new) queues a show, those with new episodes ahead of the rest,
+  # finish() waits for every queued show to be fetched
+  # As with the crawl's batches the shows fetched are published to the menus CRAWL_BATCH_SIZE at a time
+
+  condition = threading.Condition()
+  queued = set()
+  first = []
+  rest = []
+  finishing = []
+
+  def OnShow(showId, new):
+    condition.acquire()
+    try:
+      if showId in queued:
+        return
+      queued.add(showId)
+      if new:
+        first.append(showId)
       else:
-        shows = page.xpath("//div[@class='fullEpisodeList']//div/ul/li")
+        rest.append(showId)
+      condition.notify()
+    finally:
+      condition.release()
+
+  def Run():
+    while True:
+      condition.acquire()
+      try:
+        while not first and not rest and not finishing:
+          condition.wait()
+        fromFirst = min(len(first), CRAWL_BATCH_SIZE)
+        batch = first[:fromFirst] + rest[:CRAWL_BATCH_SIZE - fromFirst]
+        del first[:fromFirst]
+        del rest[:len(batch) - fromFirst]
+      finally:
+        condition.release()
+      if not batch:
+        return
+
+      try:
+        GetShowMetadata(batch)
+        CommitMetadata()
+        BuildBrowseIndex()
+      except Exception:
+        PMS.Log("Failed to fetch show metadata during the listings: %s" % sys.exc_info()[1])
+
+  thread = threading.Thread(target=Run)
+  thread.daemon = True
+  thread.start()
+
+  def Finish():
+    condition.acquire()
+    try:
+      finishing.append(True)
+      condition.notify()
+    finally:
+      condition.release()
+    thread.join()
+    Metrics.Increment('crawl.earlyFetches', len(queued))
+
+  return (OnShow, Finish)
+
+def GetPage(url, cacheTime):
+
+  # Returns the parsed page at url, shared between handlers for up to cacheTime seconds
+  # Parsed pages are held in PageCache, which is bounded by PAGE_CACHE_SIZE and evicts the least recently used page
+  # The page source is only kept by the framework for CACHE_RAWPAGE
+
+  page = PageCache.Get(url)
+  if page == None:
+    start = Metrics.Start()
+    body = HTTP.Request(url, cacheTime=CACHE_RAWPAGE)
+    Metrics.Stop('fetch.framework.' + PageType(url), start)
+    page = XML.ElementFromString(body, isHTML=True)
+    PageCache.Set(url, page, len(body), cacheTime)
+  return page
+
+def GetListing(url):
+
+  # Returns what UpdateListing last stored for url, or an empty dict if the page hasn't been crawled yet
+  listingKey = 'listing-' + url
+  if Dict.HasKey(listingKey):
+    return Dict.Get(listingKey)
+  return {}
+
+def ConditionalRequest(url, etag=None, lastModified=None):
+
+  # Performs a conditional GET through the crawl engine using the validators returned by a previous request for the same url
+  # Returns a tuple of (body, etag, lastModified), body is None when the server reports the page is unchanged (304)
+
+  headers = {}
+  if etag:
+    headers['If-None-Match'] = etag
+  if lastModified:
+    headers['If-Modified-Since'] = lastModified
+
+  response = CrawlEngine.Request(url, headers)
+  if response.status == 304:
+    return (None, etag, lastModified)
+  if response.status != 200:
+    raise Fetch.FetchError(url, "HTTP status %d" % response.status, response.status)
+
+  return (response.body, response.headers.get('etag'), response.headers.get('last-modified'))
+
+def PrioritizeShows(showIds):
+
+  # Orders showIds for fetching: shows with new episodes first, then those in the Top 5, then the rest as listed
+  wanted = set(showIds)
+  first = list(GetListing(FANCAST_TV_WIDGET).get('newEpisodeIds', []))
+  for mediaType in TOP5_DIVS.keys():
+    for assetId in (Dict.Get('top5-' + mediaType) or {}).get('assetIds', []):
+      showId = Extract.ShowIdOf(assetId)
+      if showId:
+        first.append(showId)
+  return Unique([id for id in first if id in wanted] + showIds)
+
+def MissingShowMetadata(showIds):
+
+  # Returns the show ids that have no metadata yet, eg because an earlier fetch failed, or only partial metadata
+  return [id for id in showIds if not MetaStore.HasShow(id) or MetaStore.GetFailure(id) != None]
+
+@Metrics.Timed('extract.ExtractShowIds')
+def ExtractShowIds(page, url, filterType=None):
+
+  # Returns the list of show ids found on a listing page, see Extract.ShowIds
+  # With a filterType of 'new' only shows with new episodes are returned
+  return Extract.ShowIds(page, url == FANCAST_TRAILERS_URL, filterType, HIDE_PROTECTED_PROVIDERS)
+
+@Metrics.Timed('extract.ExtractFilters')
+def ExtractFilters(page, filterType):
+
+  # Returns a list of (filterName, filterUrl) for the genres or networks listed on a tv / movies widget
+  # Networks we cannot play are left out
+  return Extract.Filters(page, filterType, FANCAST_URL, HiddenNetworks())
+
+def HiddenNetworks():
+
+  # The names of the network filters to leave out, see HIDE_ABC and HIDE_CW
+  hidden = []
+  if HIDE_ABC:
+    hidden.append('ABC')
+  if HIDE_CW:
+    hidden.append('CW')
+  return hidden
 
-    # Build a list of availalbe show id's
-    showIds = []
-    for show in shows:
-        showFullUrl = show.xpath(".//a")[0].get('href') # //a here as the link can be within a 'new episode' div
-        showId = re.search('^(.*/(?:movies|tv)/[^/]+/\d+/)', showFullUrl).group(1)
-        showIds.append(showId)
+###########################
+# Browse index
+#
+# UpdateCache stores the shows for each menu in the dictionary at browseIndex, keyed by BrowseKey
+# Each entry is an ordered list of show records (showId, title, thumb and network) with the excluded providers removed
+# The trailers list (trailers|all) is of the shows on the trailers page, each record also has the url of the show's trailer
+# The genre / network filters for each media type are stored at browseFilters, keyed by mediaType|filterType
 
-    GetShowMetadata(showIds)
+@Metrics.Timed('crawl.BuildBrowseIndex')
+def BuildBrowseIndex():
 
-  # Once UpdateCache has run at least once we note this in the dictionary, users can now access the plugin
-  Dict.Set('cacheRanOnce', True)
+  # Rebuilds the browse index from the stored listings and show metadata, no requests are made
 
-def GetShowMetadata(showIds):
+  index = {}
+  browseFilters = {}
 
-  # Grabs metadata for shows and updates the dictionary
+  for mediaType, url in (('tv', FANCAST_TV_WIDGET), ('movies', FANCAST_MOVIES_WIDGET)):
+    listing = GetListing(url)
+    index[BrowseKey(mediaType, 'all')] = ShowRecords(listing.get('showIds', []))
+    if mediaType == 'tv':
+      index[BrowseKey(mediaType, 'new')] = ShowRecords(listing.get('newEpisodeIds', []))
+
+    for filterType, availableFilters in listing.get('filters', {}).items():
+      browseFilters[mediaType + '|' + filterType] = availableFilters
+      for filterName, filterUrl in availableFilters:
+        index[BrowseKey(mediaType, filterType, filterName)] = ShowRecords(GetListing(filterUrl).get('showIds', []))
+
+  # Shows whose trailer url isn't known (eg from a listing stored before they were kept) are left out
+  trailersListing = GetListing(FANCAST_TRAILERS_URL)
+  trailerUrls = trailersListing.get('trailerUrls', {})
+  trailers = []
+  for show in ShowRecords(trailersListing.get('showIds', [])):
+    if show['showId'] in trailerUrls:
+      show['url'] = trailerUrls[show['showId']]
+      trailers.append(show)
+  index[BrowseKey('trailers', 'all')] = trailers
+
+  Dict.Set('browseIndex', index)
+  Dict.Set('browseFilters', browseFilters)
+
+  # Only start a new generation of menu responses if what they show has changed
+  fingerprint = BrowseFingerprint(index, browseFilters)
+  if fingerprint != Dict.Get('browseFingerprint'):
+    Dict.Set('browseFingerprint', fingerprint)
+    NewGeneration()
+
+  if DEBUG:
+    PMS.Log("Browse index built with %d lists" % len(index))
+
+def BrowseFingerprint(index, browseFilters):
+
+  # Returns a fingerprint of everything in the browse index that is shown to the user
+  parts = []
+  for key in sorted(index.keys()):
+    parts.append(key)
+    for show in index[key]:
+      parts.extend([show['showId'], show['title'], show['thumb'], show['network'], show.get('url', '')])
+  for key in sorted(browseFilters.keys()):
+    parts.append(key)
+    for filterName, filterUrl in browseFilters[key]:
+      parts.extend([filterName, filterUrl])
+  return Fingerprint(parts)
+
+def BrowseKey(mediaType, filterType, filterName=None):
+
+  # 'all' and 'new' are not filtered by name
+  if filterType in ('all', 'new'):
+    filterName = ''
+  return "%s|%s|%s" % (mediaType, filterType, filterName)
+
+def ShowRecords(showIds):
+
+  # Returns the records for showIds that have metadata, leaving out shows from networks we cannot play
+
+  records = []
+  showIds = Unique(showIds)
+  for showId, show in zip(showIds, MetaStore.GetShows(showIds)):
+
+    # Check that we have metadata for this show, if not just ignore it and it will be picked up in the next cache update
+    if show != None:
+      network = show.network
+
+      # Hide ABC and CW networks, append all the others
+      if not (network.find('ABC-Entertainment') >= 0) or HIDE_ABC == False:
+        if not (network.find('CW-Television-Network') >= 0) or HIDE_CW == False:
+          records.append({'showId': showId, 'title': show.title, 'thumb': show.thumb, 'network': network})
+    else:
+      if DEBUG:
+        PMS.Log ("No show metadata was found for %s" % showId)
+
+  return records
+
+def Unique(ids):
+
+  # Removes duplicates from a list, keeping the first occurrence of each
+  seen = set()
+  unique = []
+  for id in ids:
+    if id not in seen:
+      seen.add(id)
+      unique.append(id)
+  return unique
+
+def GetShowMetadata(showIds, refresh=False):
+
+  # Grabs metadata for shows and updates the metadata store
   # showIds is a list of ids
-  # If we already have metadata then we roll the die to decide if we will refresh or not
+  # Shows we already have metadata for are skipped unless refresh is set, see RefreshStaleMetadata
 
   # This should only be called from UpdateCache
 
@@ -114,139 +675,1040 @@ def GetShowMetadata(showIds):
   if len (showIds) == 0:
     return False
 
-  # To efficienty retrieve metadata from the site we perform parallel requests
+  def GetShow(showId):
 
-  @parallelize
-  def GetShows():
-    for id in showIds:
-      if not Dict.HasKey('show-'+id) or ( random.random() < METADATE_UPDATE_PROBABILITY ):
-        @task
-        def GetShow(showId = id):
-
-          # Start with clean metadata each time
-          showMeta = {};
-
-          if DEBUG_METADATA_FETCH:
-            PMS.Log("Fetching Metadata for show: %s" % showId)
-
-          # We use the 'photos' page of the show to retrieve both a photo and the associated network
-          photoPageUrl = FANCAST_URL + showId + "photos"
-          page = XML.ElementFromURL(photoPageUrl, isHTML=True, cacheTime=CACHE_SHOWMETADATA)
-
-          # Find the show title from the page
-          title = TidyString(page.xpath("//div[@id='pageHeadline']//span[@class='title']")[0].text)
-          showMeta['title'] = title
-
-          # Find the show's photos
-          images = page.xpath("//div[@id='listHolder']/ul[@id='viewTable']/li/a/img")
-          imageUrlLarge = ''
-          if len(images) > 0:
-            imageElement = images[0]
-            imageUrlSmall = imageElement.get('src') # src is already fully qualified
-            # Zoom up to a decent size (this assumes all images are avaialble in all sizes
-            imageUrlLarge = re.sub('121_87', '640_320', imageUrlSmall)
-            showMeta['thumb'] = imageUrlLarge
-          else:
-            showMeta['thumb'] = ''
-
-          if DEBUG_METADATA_FETCH:
-            PMS.Log("Thumb for %s set to %s" % (showId, showMeta['thumb']))
-
-          # Find the show's network - Not all shows display a network
-          networkLinks = page.xpath("//div[@id='swoosh']/a")
-          if len(networkLinks) > 0:
-            networkLink = networkLinks[0].get('href')
-            networkName = re.search(r'\/tv-networks\/([^\/]+)\/', networkLink).group(1)
-            showMeta['network'] = networkName
-          else:
-            showMeta['network'] = ''
-
-          if DEBUG_METADATA_FETCH:
-            PMS.Log("Network for %s set to %s" % (showId, showMeta['network']))
-
-          # Store the metadata into the dictionary
-          key = "show-"+showId
-          if DEBUG_METADATA_FETCH:
-            PMS.Log( "Adding to dictionary with key: %s" % key)
-          Dict.Set(key, showMeta)
-
-
-def GetAssetMetadata(assetIds):
+    if DEBUG_METADATA_FETCH:
+      PMS.Log("Fetching Metadata for show: %s" % showId)
+
+    # We use the 'photos' page of the show to retrieve both a photo and the associated network
+    photoPageUrl = FANCAST_URL + showId + "photos"
+    response = CrawlEngine.Get(photoPageUrl)
+    page = XML.ElementFromString(response.body, isHTML=True)
+
+    if DEBUG_METADATA_FETCH:
+      PMS.Log("Fetched %s in %.3fs" % (photoPageUrl, response.latency))
+
+    # Each field is extracted on its own, so a page missing one still gives us the others, see Extract.Show
+    extractStart = Metrics.Start()
+    showMeta, errors = Extract.Show(page, showId)
+    Metrics.Stop('extract.show', extractStart)
+
+    if DEBUG_METADATA_FETCH:
+      PMS.Log("Thumb for %s set to %s, network set to %s" % (showId, showMeta.thumb, showMeta.network))
+
+    StoreShow(showId, showMeta, errors)
+
+  # To efficienty retrieve metadata from the site we perform parallel requests through the crawl engine
+  # Shows that failed recently are left for later, see CrawlFailed
+  CrawlEngine.Map(GetShow, DueForFetch(showIds, MetaStore.HasShow, refresh), onError=CrawlFailed('show'))
+
+
+def GetAssetMetadata(assetIds, refresh=False):
 
   # Grabs metadata for individual assets
   # This is used when a page has show id's but lacks sufficient metadata about the shows for a nice presentation to the user
 
   # Pass a list of assetIds to grab metadata for
+  # Assets we already have metadata for are skipped unless refresh is set, see RefreshStaleMetadata
+
+  if not refresh:
+    MetaStore.TouchAssets(assetIds, time.time())
+
+  def FetchAsset(assetId):
+
+    if DEBUG_METADATA_FETCH:
+      PMS.Log("Fetching Metadata for asset: %s" % assetId)
+
+    # The metadata is stored within the javascript on the video's page (video.playerData), see Extract.Asset
+    assetPageUrl = FANCAST_URL + assetId + '/videos'
+    response = CrawlEngine.Get(assetPageUrl)
+
+    if DEBUG_METADATA_FETCH:
+      PMS.Log("Fetched %s in %.3fs" % (assetPageUrl, response.latency))
+
+    extractStart = Metrics.Start()
+    assetMeta, errors = Extract.Asset(response.body, assetId, FANCAST_URL, lambda text: XML.ElementFromString(text, isHTML=False))
+    Metrics.Stop('extract.asset', extractStart)
+
+    StoreAsset(assetId, assetMeta, errors)
+
+  # The assets are fetched in parallel through the crawl engine
+  CrawlEngine.Map(FetchAsset, DueForFetch(assetIds, MetaStore.HasAsset, refresh), onError=CrawlFailed('asset'))
+
+def StoreShow(showId, showMeta, errors):
+
+  # Stores the metadata extracted for a show, it is persisted with the rest of the batch by CommitMetadata
+  # Fields that couldn't be extracted keep their value from the last fetch, if there was one
+  if DEBUG_METADATA_FETCH:
+    PMS.Log( "Adding to metadata store: %s" % showId)
+  showMeta.fetchedAt = showMeta.listedAt = time.time()
+  previous = MetaStore.GetShow(showId)
+  if previous != None:
+    showMeta.listedAt = previous.listedAt
+    KeepPrevious(showMeta, previous, errors)
+  MetaStore.PutShow(showId, showMeta)
+  CrawlSucceeded('show', showId, errors)
+
+def StoreAsset(assetId, assetMeta, errors):
+
+  # As StoreShow, for an asset
+  if DEBUG_METADATA_FETCH:
+    PMS.Log( "Adding to metadata store: %s" % assetId)
+  assetMeta.fetchedAt = assetMeta.listedAt = time.time()
+  previous = MetaStore.GetAsset(assetId)
+  if previous != None:
+    assetMeta.listedAt = previous.listedAt
+    KeepPrevious(assetMeta, previous, errors)
+  MetaStore.PutAsset(assetId, assetMeta)
+  CrawlSucceeded('asset', assetId, errors)
+
+###########################
+# Crawl failures
+#
+# When the metadata for a show or asset can't be fetched, or none of it can be extracted, the metadata store records
+# a failure for the id (see Store.py) and it isn't fetched again until FAILURE_RETRY_DELAY has passed, doubling for each
+# consecutive failure up to FAILURE_RETRY_MAX
+# When only some fields can be extracted the rest is stored and the id is also backed off, then retried to complete it
+# Ids failing FAILURE_POISONED_AFTER times in a row are reported by SummarizeFailures and in the stats report
+
+def DueForFetch(ids, hasRecord, refresh):
+
+  # Returns the ids to fetch metadata for: those with no or partial metadata, or all of them when refreshing
+  # Ids that failed recently are left out
+  now = time.time()
+  return [id for id in ids if (refresh or not hasRecord(id) or MetaStore.GetFailure(id) != None) and not MetaStore.InBackoff(id, now)]
+
+def KeepPrevious(record, previous, errors):
+
+  # Copies the fields that couldn't be extracted from the previous record
+  for field, error in errors:
+    if field in previous.FIELDS:
+      setattr(record, field, getattr(previous, field))
+
+def CrawlSucceeded(kind, id, errors):
+
+  # Called once metadata has been stored for id, errors lists the fields that couldn't be extracted
+  if len(errors) == 0:
+    MetaStore.Succeed(id)
+    return
+
+  Metrics.Increment('crawl.metadata.partial')
+  failure = MetaStore.Fail(kind, id, 'ExtractError', str(ExtractError(errors)), time.time(), FAILURE_RETRY_DELAY, FAILURE_RETRY_MAX, partial=True)
+  if DEBUG_METADATA_FETCH:
+    PMS.Log("Partial metadata for %s (%d times): %s" % (id, failure.count, failure.message))
+
+def CrawlFailed(kind):
+
+  # Returns the error handler for the crawl engine when fetching the metadata for a show or asset fails
+  def OnError(id, excInfo):
+    Metrics.Increment('crawl.metadata.failed')
+    failure = MetaStore.Fail(kind, id, excInfo[0].__name__, str(excInfo[1]), time.time(), FAILURE_RETRY_DELAY, FAILURE_RETRY_MAX)
+    PMS.Log("Failed to fetch metadata for %s (%d times, next try in %ds): %s" % (id, failure.count, failure.retryAt - failure.lastFailedAt, failure.message))
+  return OnError
+
+def SummarizeFailures():
+
+  # Logs the ids that keep failing and notes the number of failing ids in the stats, returns the failure report
+  failures = MetaStore.GetFailures()
+  report = FailureReport(failures)
+
+  Metrics.Gauge('crawl.failures', len(failures))
+  Metrics.Gauge('crawl.failures.partial', report['partial'])
+  Metrics.Gauge('crawl.failures.poisoned', len(report['poisoned']))
+
+  if len(report['poisoned']) > 0:
+    PMS.Log("%d of %d failing ids are poisoned (failed %d or more times in a row):" % (len(report['poisoned']), len(failures), FAILURE_POISONED_AFTER))
+    for poisoned in report['poisoned']:
+      PMS.Log("  %s %s: %d failures, %s: %s" % (poisoned['kind'], poisoned['id'], poisoned['count'], poisoned['errorClass'], poisoned['message']))
+
+  return report
+
+def FailureReport(failures):
+
+  # Summarizes a list of (id, FailureRecord): counts by error class, and the details of the poisoned ids
+  byErrorClass = {}
+  partial = 0
+  poisoned = []
+  for id, failure in failures:
+    byErrorClass[failure.errorClass] = byErrorClass.get(failure.errorClass, 0) + 1
+    if failure.partial:
+      partial = partial + 1
+    if failure.count >= FAILURE_POISONED_AFTER:
+      poisoned.append({'id': id, 'kind': failure.kind, 'count': failure.count, 'errorClass': failure.errorClass, 'message': failure.message,
+        'firstFailedAt': failure.firstFailedAt, 'retryAt': failure.retryAt, 'partial': failure.partial})
+  poisoned.sort(key=lambda item: -item['count'])
+  return {'failing': len(failures), 'partial': partial, 'byErrorClass': byErrorClass, 'poisoned': poisoned}
+
+def LoadMetadata():
+
+  # Loads the metadata store from the dictionary
+  # If there is none, or it was written with another schema version, the store starts empty and UpdateCache refetches it
+
+  # The previous release kept each show and asset at its own show-id / asset-id key, and never stored the ids, so those keys can't be
+  # found to be moved into the store: the dictionary is reset instead, removing them, and with cacheRanOnce cleared the menus wait for the next crawl
+  if Dict.Get('cacheRanOnce') == True and not Dict.HasKey('metadataStore'):
+    PMS.Log("Removing the metadata stored by the previous release, it will be fetched again by the next cache update")
+    Dict.Reset()
+
+  if not MetaStore.Load(Dict.Get('metadataStore')):
+    PMS.Log("No usable metadata store found, metadata will be fetched by the next cache update")
+
+  # Records from an older version of the show or asset extractor are refreshed first, see RefreshStaleMetadata
+  versions = Dict.Get('extractorVersions') or {}
+  for kind in ('show', 'asset'):
+    if versions.get(kind, Extract.VERSIONS[kind]) != Extract.VERSIONS[kind]:
+      PMS.Log("The %s extractor has changed, existing %s metadata will be refreshed" % (kind, kind))
+      MetaStore.Expire(kind)
+  Dict.Set('extractorVersions', {'show': Extract.VERSIONS['show'], 'asset': Extract.VERSIONS['asset']})
+
+@Metrics.Timed('crawl.CommitMetadata')
+def CommitMetadata():
+
+  # Persists the metadata store as a single dictionary entry, if anything has changed since it was last committed
+  # It is always written the first time, its key is how LoadMetadata tells this release's dictionary from the previous one's
+  if MetaStore.dirty or not Dict.HasKey('metadataStore'):
+    Dict.Set('metadataStore', MetaStore.Dump())
+
+###########################
+# Snapshot
+#
+# At the end of each UpdateCache run the listings, browse index, Top 5 lists and metadata store are saved together
+# as a compressed snapshot (see Snapshot.py), a single data item at snapshot
+# When the dictionary has nothing to serve the menus from, eg after it has been wiped, Start restores the snapshot
+# so the menus are available straight away rather than once the first cache update has finished
+
+SNAPSHOT_ITEM = 'snapshot'
+
+def ListingUrls():
+
+  # Returns the urls of every listing page stored by UpdateListing, the tv, movies and trailers pages and their filters
+  urls = []
+  for url in (FANCAST_TV_WIDGET, FANCAST_MOVIES_WIDGET, FANCAST_TRAILERS_URL):
+    urls.append(url)
+    for filterType, availableFilters in GetListing(url).get('filters', {}).items():
+      urls = urls + [filterUrl for filterName, filterUrl in availableFilters]
+  return Unique(urls)
+
+@Metrics.Timed('crawl.SaveSnapshot')
+def SaveSnapshot():
+
+  # The snapshot is only written again when the menus or the metadata behind them have changed since the last one,
+  # the fingerprint of what it was taken from is kept in the dictionary at snapshotFingerprint
+  top5Ids = [(Dict.Get('top5-' + mediaType) or {}).get('assetIds', []) for mediaType in sorted(TOP5_DIVS.keys())]
+  fingerprint = Fingerprint([Dict.Get('browseFingerprint') or '', MetaStore.Fingerprint(), repr(top5Ids)])
+  if fingerprint == Dict.Get('snapshotFingerprint'):
+    Metrics.Increment('snapshot.unchanged')
+    return
+
+  listings = {}
+  for url in ListingUrls():
+    listing = GetListing(url)
+    if listing:
+      listings[url] = listing
+
+  top5 = {}
+  for mediaType in TOP5_DIVS.keys():
+    if Dict.HasKey('top5-' + mediaType):
+      top5[mediaType] = Dict.Get('top5-' + mediaType)
+
+  state = {'listings': listings, 'browseIndex': Dict.Get('browseIndex') or {}, 'browseFilters': Dict.Get('browseFilters') or {},
+    'top5': top5, 'metadataStore': Dict.Get('metadataStore')}
+  blob = Snapshot.Dump(state, time.time())
+  Data.Save(SNAPSHOT_ITEM, blob)
+  Dict.Set('snapshotFingerprint', fingerprint)
+  Metrics.Gauge('snapshot.size', len(blob))
+
+@Metrics.Timed('start.LoadSnapshot')
+def LoadSnapshot():
+
+  # Restores the last snapshot into the dictionary and metadata store, returns False if there is no usable snapshot
+  snapshot = Snapshot.Load(Data.Load(SNAPSHOT_ITEM))
+  if snapshot == None or not ApplySnapshot(*snapshot):
+    return False
+
+  PMS.Log("Restored the snapshot taken %d seconds ago" % (time.time() - snapshot[0]))
+  return True
+
+@Metrics.Timed('crawl.ImportSnapshot')
+def ImportSnapshot():
+
+  # Returns True if the snapshot at SNAPSHOT_IMPORT_PATH is recent enough to stand in for a crawl, importing it if it has changed
+  # The dictionary at snapshotImport notes the modification time and creation time of the last snapshot imported
+
+  if not SNAPSHOT_IMPORT_PATH:
+    return False
+
+  path = os.path.expanduser(SNAPSHOT_IMPORT_PATH)
+  try:
+    modifiedAt = os.path.getmtime(path)
+  except OSError:
+    return False
+
+  imported = Dict.Get('snapshotImport') or {}
+  if modifiedAt == imported.get('modifiedAt'):
+    return time.time() - imported.get('createdAt', 0) <= SNAPSHOT_IMPORT_MAX_AGE
+
+  # Crawl.py renames the finished file into place, so this is a whole snapshot, old or new, never one being written
+  snapshotFile = open(path, 'rb')
+  try:
+    snapshot = Snapshot.Load(snapshotFile.read())
+  finally:
+    snapshotFile.close()
+
+  if snapshot == None:
+    PMS.Log("Ignoring snapshot %s, it is unreadable or from another version" % path)
+    return False
+  if time.time() - snapshot[0] > SNAPSHOT_IMPORT_MAX_AGE:
+    PMS.Log("Ignoring snapshot %s, it is %d seconds old" % (path, time.time() - snapshot[0]))
+    return False
+  if not ApplySnapshot(*snapshot):
+    PMS.Log("Ignoring snapshot %s, its metadata store is from another schema version" % path)
+    return False
+
+  Dict.Set('snapshotImport', {'modifiedAt': modifiedAt, 'createdAt': snapshot[0]})
+  Metrics.Increment('snapshot.imported')
+  PMS.Log("Imported the snapshot %s taken %d seconds ago" % (path, time.time() - snapshot[0]))
+  return True
+
+def ApplySnapshot(createdAt, state):
+
+  # Replaces the listings, Top 5 lists and metadata store with those in a snapshot, returns False (changing nothing) if it can't be used
+  # The browse index is taken from the snapshot if it has one, otherwise it is rebuilt
+  # Episode lists in the snapshot (see Crawl.py --episodes) are put in RecordStore until CACHE_SHOWASSETS after createdAt, unless it has fresher ones
+  # They are only loaded into memory when each show is viewed, see GetShowEpisodes
+
+  global MetaStore
+
+  # The new store is loaded on the side and swapped in whole
+  store = Store.MetadataStore()
+  if not store.Load(state.get('metadataStore')):
+    return False
+
+  for url, listing in state.get('listings', {}).items():
+    Dict.Set('listing-' + url, listing)
+  for mediaType, top5 in state.get('top5', {}).items():
+    Dict.Set('top5-' + mediaType, top5)
+  Dict.Set('metadataStore', state['metadataStore'])
+  MetaStore = store
+
+  if 'browseIndex' in state:
+    Dict.Set('browseIndex', state['browseIndex'])
+    Dict.Set('browseFilters', state.get('browseFilters', {}))
+    Dict.Set('browseFingerprint', BrowseFingerprint(state['browseIndex'], state.get('browseFilters', {})))
+    NewGeneration()
+  else:
+    BuildBrowseIndex()
+
+  now = time.time()
+  if createdAt + CACHE_SHOWASSETS > now:
+    for showId, seasons in state.get('episodes', {}).items():
+      stored = RecordStore.Get('episodes', showId, now)
+      if stored == None or stored[0] < createdAt + CACHE_SHOWASSETS:
+        RecordStore.Put('episodes', showId, seasons, createdAt, CACHE_SHOWASSETS)
+
+  return True
+
+def MenusAvailable():
+
+  # The menus can be shown once the first cache update has finished, or as soon as it has listed any shows
+  if Dict.Get('cacheRanOnce') == True:
+    return True
+  browseIndex = Dict.Get('browseIndex') or {}
+  return len(browseIndex.get(BrowseKey('tv', 'all'), [])) + len(browseIndex.get(BrowseKey('movies', 'all'), [])) > 0
+
+###########################
+# Search index
+#
+# Searches are answered from SearchIdx (see Search.py) without any requests
+# It holds the shows in the browse index, by title and network, and episodes by title, show and description:
+# those in the metadata store (eg the Top 5), and those of every tv show whose episode list is held in RecordStore,
+# ie shows viewed recently or crawled by Tools/Crawl.py --episodes
+# UpdateCache builds a new index each run and swaps it in, Start builds one from what was stored by the last run
+
+SearchIdx = Search.SearchIndex()
+
+@Metrics.Timed('crawl.BuildSearchIndex')
+def BuildSearchIndex():
+
+  global SearchIdx
+
+  index = Search.SearchIndex()
+  browseIndex = Dict.Get('browseIndex') or {}
+
+  for mediaType in ('tv', 'movies'):
+    for show in browseIndex.get(BrowseKey(mediaType, 'all'), []):
+      index.Add(('show', mediaType, show), [(show['title'], 3), (show['network'], 1)])
+
+  assetIds = MetaStore.AssetIds()
+  urls = set()
+  for assetId, asset in zip(assetIds, MetaStore.GetAssets(assetIds)):
+    if asset != None:
+      index.Add(('asset', None, asset), [(asset.episodeTitle, 2), (asset.showTitle, 2), (asset.description, 1)])
+      urls.add(asset.url)
+
+  # Only the episode lists already stored are read, none are fetched
+  now = time.time()
+  for show in browseIndex.get(BrowseKey('tv', 'all'), []):
+    if not RecordStore.Has('episodes', show['showId']):
+      continue
+    stored = RecordStore.Get('episodes', show['showId'], now)
+    if stored == None:
+      continue
+    for season in Extract.LoadSeasons(stored[1]):
+      for episode in season.episodes:
+        if episode.url not in urls:
+          index.Add(('episode', show['title'], episode), [(episode.title, 2), (show['title'], 2), (episode.summary, 1)])
+          urls.add(episode.url)
+
+  index.Finish()
+  SearchIdx = index
+
+  stats = index.Stats()
+  Metrics.Gauge('search.documents', stats['documents'])
+  Metrics.Gauge('search.tokens', stats['tokens'])
+
+###########################
+# Metadata refresh scheduling
+#
+# Each show and asset record holds when it was fetched (fetchedAt) and when it was last listed on the site (listedAt)
+# Each UpdateCache run refreshes the records with the oldest fetchedAt first, within the REFRESH_BUDGET_* limits
+# so the upstream request rate is flat and every record is refreshed within a predictable number of runs
+
+@Metrics.Timed('crawl.RefreshStaleMetadata')
+def RefreshStaleMetadata():
+
+  # Refreshes existing show and asset metadata, oldest first
+  # Stops when REFRESH_BUDGET_COUNT entries have been refreshed or REFRESH_BUDGET_TIME has passed
+
+  now = time.time()
+  deadline = now + REFRESH_BUDGET_TIME
+
+  # Build the queue ordered by age, the store forgets anything that is no longer listed on the site
+  queue = MetaStore.Stale(now, REFRESH_MIN_AGE, REFRESH_FORGET_AFTER)
+  heapq.heapify(queue)
+  staleCount = len(queue)
+  refreshed = 0
+
+  while queue and refreshed < REFRESH_BUDGET_COUNT and time.time() < deadline:
+    showIds = []
+    assetIds = []
+    while queue and len(showIds) + len(assetIds) < min(REFRESH_BATCH_SIZE, REFRESH_BUDGET_COUNT - refreshed):
+      fetchedAt, kind, id = heapq.heappop(queue)
+      if kind == 'show':
+        showIds.append(id)
+      else:
+        assetIds.append(id)
+
+    if len(showIds) > 0:
+      GetShowMetadata(showIds, refresh=True)
+    if len(assetIds) > 0:
+      GetAssetMetadata(assetIds, refresh=True)
+    refreshed = refreshed + len(showIds) + len(assetIds)
+
+  Metrics.Gauge('crawl.refresh.stale', staleCount)
+  Metrics.Gauge('crawl.refresh.refreshed', refreshed)
+
+  if DEBUG:
+    counts = MetaStore.Counts()
+    PMS.Log("Refreshed %d of %d stale metadata entries, %d shows and %d assets in total" % (refreshed, staleCount, counts['shows'], counts['assets']))
+
+###########################
+# Episode cache
+#
+# The full-episodes page of a tv show is parsed once per CACHE_SHOWASSETS into a list of seasons
+# Each season is a SeasonRecord of id, name, thumb and episodes, an ordered list of EpisodeRecords (see Extract.py)
+# from which ShowBrowserTV renders both of its views
+# Shows without multiple seasons have a single season with an id of None holding every episode
+# The seasons of recently viewed shows are held in memory (EpisodeCache, bounded by EPISODE_CACHE_SIZE episodes),
+# and every show's in RecordStore so they outlive a restart
+
+EpisodeCache = Cache.LRUCache(EPISODE_CACHE_SIZE)
+episodeFetches = Cache.SingleFlight()
+
+def GetShowEpisodes(showId):
+
+  # Returns the cached seasons for showId, fetching and parsing the full-episodes page if they have expired
+  # Concurrent requests for the same show (eg a prefetch and the user) share a single fetch
+
+  seasons = EpisodeCache.Get(showId)
+  if seasons != None:
+    Metrics.Increment('cache.episodes.hits')
+    return seasons
+
+  Metrics.Increment('cache.episodes.misses')
+  return episodeFetches.Do(showId, lambda: LoadShowEpisodes(showId))
+
+def LoadShowEpisodes(showId):
+
+  # Returns the seasons for showId from RecordStore, or from the full-episodes page, and holds them in memory
+
+  now = time.time()
+  stored = RecordStore.Get('episodes', showId, now)
+  if stored != None:
+    expiresAt, seasons = stored[0], Extract.LoadSeasons(stored[1])
+  else:
+    start = Metrics.Start()
+    page = XML.ElementFromURL(FANCAST_URL + showId + 'full-episodes', isHTML=True, cacheTime=CACHE_RAWPAGE)
+    Metrics.Stop('fetch.framework.full-episodes', start)
+    seasons = ExtractEpisodes(page)
+    expiresAt = now + CACHE_SHOWASSETS
+    RecordStore.Put('episodes', showId, Extract.Dump(seasons), now, CACHE_SHOWASSETS)
+
+  # Shows are weighed by their number of episodes
+  EpisodeCache.Set(showId, seasons, sum([len(season.episodes) for season in seasons]) + 1, expiresAt - now)
+
+  return seasons
+
+@Metrics.Timed('extract.ExtractEpisodes')
+def ExtractEpisodes(page):
+
+  # Parses a full-episodes page into a list of seasons, see Extract.Episodes
+  return Extract.Episodes(page, FANCAST_URL)
+
+###########################
+# Top 5
+#
+# The Top 5 tv, movies and trailers on the front page are stored in the dictionary at top5-mediaType
+# as a dict of updatedAt and assetIds, the ids of assets whose metadata is in the metadata store
+# Top5Browser serves these as they are, if they are older than CACHE_FRONTPAGE a refresh is started in the background
+
+TOP5_DIVS = {'tv': 'playlistTabBody0', 'movies': 'playlistTabBody1', 'trailers': 'playlistTabBody2'}
+
+top5Lock = threading.Lock()
+top5Refreshing = False
+
+@Metrics.Timed('crawl.UpdateTop5')
+def UpdateTop5():
+
+  # Fetches the front page and the metadata for each of the Top 5 assets, then stores the lists
+
+  page = XML.ElementFromString(CrawlEngine.Get(FANCAST_URL).body, isHTML=True)
+
+  for mediaType, assetIds in Extract.Top5(page, TOP5_DIVS, FANCAST_URL).items():
+
+    # The available metadata is very sparse so we grab the asset id's then search for their metadata
+    GetAssetMetadata(assetIds)
+
+    # Assets whose metadata couldn't be fetched are left out
+    assetIds = [id for id in assetIds if MetaStore.HasAsset(id)]
+    Dict.Set('top5-'+mediaType, {'updatedAt': time.time(), 'assetIds': assetIds})
+
+def RefreshTop5InBackground():
+
+  # Starts UpdateTop5 on a background thread unless a refresh is already running
+
+  global top5Refreshing
+  top5Lock.acquire()
+  try:
+    if top5Refreshing:
+      return
+    top5Refreshing = True
+  finally:
+    top5Lock.release()
+
+  def Refresh():
+    global top5Refreshing
+    try:
+      try:
+        UpdateTop5()
+        CommitMetadata()
+      except Exception:
+        PMS.Log("Failed to refresh the Top 5: %s" % sys.exc_info()[1])
+    finally:
+      top5Lock.acquire()
+      top5Refreshing = False
+      top5Lock.release()
+
+  thread = threading.Thread(target=Refresh)
+  thread.daemon = True
+  thread.start()
+
+###########################
+# Movie cache
+#
+# The details shown for a movie come from two pages, its full-movie and about pages
+# These are fetched in parallel and the extracted details cached as one record (title, url, duration, yearAndRating, summary and thumb)
+# in memory (MovieCache) and in RecordStore. Concurrent requests for the same movie share a single fetch
+
+MovieCache = Cache.LRUCache(MOVIE_CACHE_SIZE)
+movieFetches = Cache.SingleFlight()
+
+def GetMovie(showId):
+
+  # Returns the movie record for showId, fetching it if it isn't cached
+
+  movie = MovieCache.Get(showId)
+  if movie == None:
+    movie = movieFetches.Do(showId, lambda: FetchMovie(showId))
+  return movie
+
+def FetchMovie(showId):
+
+  # Fetches the full-movie and about pages at the same time and caches the extracted movie record
+  # unless RecordStore still has the record
+  # Raises Fetch.FetchError if either page can't be fetched
+
+  now = time.time()
+  stored = RecordStore.Get('movie', showId, now)
+  if stored != None:
+    expiresAt, movie = stored[0], Extract.LoadMovie(stored[1])
+    MovieCache.Set(showId, movie, 1, expiresAt - now)
+    return movie
+
+  # A page that fails is left out of pages and its error noted, the tasks must not raise
+  pages = {}
+  errors = {}
 
   @parallelize
-  def FetchAssets():
-    for id in assetIds:
-      if not Dict.HasKey('asset-'+id) or ( random.random() < METADATE_UPDATE_PROBABILITY ):
-        @task
-        def FetchAsset(assetId = id):
-
-          # Start with clean metadata each time
-          assetMeta = {}
-
-          if DEBUG_METADATA_FETCH:
-            PMS.Log("Fetching Metadata for asset: %s" % assetId)
-
-          # The metadata is stored within the javascript on the video's page (video.playerData)
-          # So fetch the page as a string and grep out the bit we want
-          assetPageUrl = FANCAST_URL + assetId + '/videos'
-          page = HTTP.Request(assetPageUrl, cacheTime=CACHE_ASSETMETADATA)
-
-          # Extract the value of video.playerData and parse as XML
-          assetMetadataString = re.search (r'video.playerData = "(.*</entity>)', page).group(1)
-          assetMetadata = XML.ElementFromString(assetMetadataString, isHTML=False)
-
-          # Gather available metadata
-          showTitle = assetMetadata.xpath("//metadata/entityName")[0].text
-          episodeTitle = assetMetadata.xpath("//metadata/videoTitle")[0].text
-          thumb = assetMetadata.xpath("//entity/imageUrl")[0].text
-          description = assetMetadata.xpath("//metadata/description")[0].text
-          duration = ConvertDuration( assetMetadata.xpath("//metadata/duration")[0].text )
-          airdate = assetMetadata.xpath("//metadata/airDate")[0].text
-          season = assetMetadata.xpath("//metadata/season")[0].text
-          episodeNumber = assetMetadata.xpath("//metadata/episode")[0].text
-
-          if not season:
-            season = 'Unknown'
-          if not episodeNumber:
-            episodeNumber = 'Unknown'
-
-          assetMeta['showTitle'] = showTitle
-          assetMeta['episodeTitle'] = episodeTitle
-          assetMeta['thumb'] = thumb
-          assetMeta['description'] = description
-          assetMeta['duration'] = duration
-          assetMeta['airdate'] = airdate
-          assetMeta['season'] = season
-          assetMeta['episodeNumber'] = episodeNumber
-          assetMeta['url'] = FANCAST_URL + assetId + '/videos'
-
-          # Store metadata into the dictionary
-          key = 'asset-' + assetId
-          if DEBUG_METADATA_FETCH:
-            PMS.Log( "Adding to dictionary with key: %s" % key)
-          Dict.Set(key, assetMeta)
+  def FetchPages():
+    for pageName in ('full-movie', 'about'):
+      @task
+      def FetchPage(pageName = pageName):
+        start = Metrics.Start()
+        try:
+          pages[pageName] = XML.ElementFromURL(FANCAST_URL + showId + pageName, isHTML=True, cacheTime=CACHE_RAWPAGE)
+        except Exception:
+          errors[pageName] = sys.exc_info()[1]
+          return
+        Metrics.Stop('fetch.framework.' + pageName, start)
+
+  for pageName in ('full-movie', 'about'):
+    if pageName not in pages:
+      Metrics.Increment('fetch.framework.' + pageName + '.failed')
+      raise Fetch.FetchError(FANCAST_URL + showId + pageName, "movie page not fetched: %s" % errors.get(pageName))
+
+  movie = ExtractMovie(pages['full-movie'], pages['about'])
+  MovieCache.Set(showId, movie, 1, CACHE_SHOWASSETS)
+  RecordStore.Put('movie', showId, Extract.Dump(movie), now, CACHE_SHOWASSETS)
+  return movie
+
+@Metrics.Timed('extract.ExtractMovie')
+def ExtractMovie(listingsPage, aboutPage):
+
+  # Returns the MovieRecord from the full-movie (listings) and about pages, see Extract.Movie
+  return Extract.Movie(listingsPage, aboutPage, FANCAST_URL)
+
+###########################
+# Aspect ratios
+#
+# PlayVideo needs the aspect ratio of each asset's player to pick a site configuration
+# Once worked out it is stored in RecordStore, keyed by the asset's url, so replays need no request
+# The most recently played are also held in memory (AspectCache), bounded by ASPECT_CACHE_SIZE
+
+AspectCache = Cache.LRUCache(ASPECT_CACHE_SIZE)
+aspectFetches = Cache.SingleFlight()
+
+def GetAspect(url):
+
+  # Returns '4x3', '16x9' or '2.35x1' for the asset page at url
+  # Concurrent requests for the same url share a single fetch
+
+  aspect = AspectCache.Get(url)
+  if aspect != None:
+    Metrics.Increment('cache.aspects.hits')
+    return aspect
+
+  now = time.time()
+  stored = RecordStore.Get('aspect', url, now)
+  if stored != None:
+    Metrics.Increment('cache.aspects.hits')
+    expiresAt, aspect = stored
+    AspectCache.Set(url, aspect, 1, expiresAt - now)
+    return aspect
+
+  Metrics.Increment('cache.aspects.misses')
+  return aspectFetches.Do(url, lambda: FetchAspect(url))
+
+def FetchAspect(url):
+
+  # Works out the aspect ratio of the asset page at url and stores it
+
+  # The dimensions are in meta tags, so only the head of the page is downloaded and parsed
+  head = UserEngine.Get(url, until='</head>').body
+  metadata = XML.ElementFromString(head, isHTML=True)
+
+  # Determine aspect ratio
+
+  width = MetaContent(metadata, 'video_width')
+  height = MetaContent(metadata, 'video_height')
+
+  if DEBUG:
+    PMS.Log("width %s height %s" % (width, height))
+
+  if float(height) == 0:
+    # For some reason we didn't get a 'height' let's make one up
+    height = 360
+    width = 640
+
+  ratio = float(width) / float(height)
+
+  # 1.55 is the cut off ratio used by Fancast
+  if ratio < 1.55:
+    # Player is 4x3
+    aspect = '4x3'
+
+  elif ratio < 2.2:
+    # Player is 16x9
+    aspect = '16x9'
+
+  else:
+    # Player is 2.35:1 (eg Watchmen HD Trailer)
+    aspect = '2.35x1'
+
+  AspectCache.Set(url, aspect, 1, CACHE_ASPECT)
+  RecordStore.Put('aspect', url, aspect, time.time(), CACHE_ASPECT)
+
+  return aspect
+
+def MetaContent(page, name):
+
+  # Returns the numeric content of a meta tag, or '0' if the tag is missing
+  tags = page.xpath("//meta[@name='" + name + "']")
+  if len(tags) == 0:
+    return '0'
+  content = tags[0].get('content')
+  content = re.sub (r',', r'', content)
+  content = re.sub (r'"', r'', content)
+  return content
+
+###########################
+# Image cache
+#
+# Menus point their thumbs at Thumb (see ThumbUrl), which serves images from ImageStore (see Images.py)
+# UpdateCache fetches the thumbnails of shows with new episodes, the Top 5 and all listed shows ahead of time,
+# other images (episodes, seasons, movies) are fetched the first time a client asks for them
+# The images are data items, the cache's index is stored in the dictionary at imageCache
+
+imageCommitLock = threading.Lock()
+imageCommittedAt = 0
+
+def ThumbUrl(url):
+
+  # Returns the thumb to give an item showing the image at url
+  # Set the default thumbnail if none is found
+  if not url:
+    return R('icon-default.png')
+  if not IMAGE_CACHE:
+    return url
+  return Function(Thumb, url=url)
+
+@Metrics.Timed('handler.Thumb')
+def Thumb(url):
+
+  # Serves the image at url from the image cache, fetching it if it isn't cached
+  cached = ImageStore.Get(url)
+  if cached == None:
+    try:
+      response = UserEngine.Get(url, binary=True)
+    except Fetch.FetchError:
+      # Let the client try the site itself
+      PMS.Log("Failed to fetch image %s: %s" % (url, sys.exc_info()[1]))
+      return Redirect(url)
+    cached = (response.body, ImageType(response))
+    ImageStore.Put(url, cached[0], cached[1])
+
+  CommitImages()
+  return DataObject(cached[0], cached[1])
+
+def ImageType(response):
+
+  # Returns the content type of an image response, guessed from the url if the server doesn't say
+  contentType = response.headers.get('content-type', '')
+  if contentType.startswith('image/'):
+    return contentType.split(';')[0]
+  return Images.ContentType(response.url)
+
+@Metrics.Timed('crawl.PrefetchImages')
+def PrefetchImages():
+
+  # Fetches up to IMAGE_PREFETCH_BUDGET of the thumbnails listed by the menus that aren't cached yet
+  if not IMAGE_CACHE:
+    return
+
+  browseIndex = Dict.Get('browseIndex') or {}
+  urls = [show['thumb'] for show in browseIndex.get(BrowseKey('tv', 'new'), [])]
+  for mediaType in TOP5_DIVS.keys():
+    top5 = Dict.Get('top5-' + mediaType) or {}
+    urls = urls + [asset.thumb for asset in MetaStore.GetAssets(top5.get('assetIds', [])) if asset != None]
+  for mediaType in ('tv', 'movies'):
+    urls = urls + [show['thumb'] for show in browseIndex.get(BrowseKey(mediaType, 'all'), [])]
+
+  urls = [url for url in Unique(urls) if url and not ImageStore.Has(url)][:IMAGE_PREFETCH_BUDGET]
+
+  def FetchImage(url):
+    response = CrawlEngine.Get(url, binary=True)
+    ImageStore.Put(url, response.body, ImageType(response))
+
+  def OnError(url, excInfo):
+    Metrics.Increment('crawl.images.failed')
+    if DEBUG:
+      PMS.Log("Failed to prefetch image %s: %s" % (url, excInfo[1]))
+
+  CrawlEngine.Map(FetchImage, urls, onError=OnError)
+  Metrics.Gauge('crawl.images.prefetched', len(urls))
+
+def LoadImages():
+
+  # Loads the image cache's index from the dictionary
+  ImageStore.Load(Dict.Get('imageCache'))
+
+def CommitImages(force=False):
+
+  # Persists the image cache's index if it has changed, at most every IMAGE_INDEX_SAVE_INTERVAL unless force is set
+  global imageCommittedAt
+  imageCommitLock.acquire()
+  try:
+    if ImageStore.dirty and (force or time.time() - imageCommittedAt > IMAGE_INDEX_SAVE_INTERVAL):
+      Dict.Set('imageCache', ImageStore.Dump())
+      imageCommittedAt = time.time()
+  finally:
+    imageCommitLock.release()
+
+###########################
+# Record store
+#
+# RecordStore's index of the records it holds (see Records.py) is stored in the dictionary at recordCache
+# UpdateCache sweeps it so the records on disk stay within RECORD_CACHE_SIZE
+
+def LoadRecords():
+
+  # Loads the record store's index from the dictionary
+  RecordStore.Load(Dict.Get('recordCache'))
+
+def SweepRecords():
+
+  # Removes expired records and the soonest to expire beyond RECORD_CACHE_SIZE, then persists the index if it has changed
+  removed = RecordStore.Sweep(time.time(), RECORD_CACHE_SIZE)
+  Metrics.Gauge('crawl.records.swept', removed)
+  if RecordStore.dirty:
+    Dict.Set('recordCache', RecordStore.Dump())
+
+###########################
+# Response cache
+#
+# The menus are functions of their arguments and the crawled data, so the containers they return are cached
+# in ResponseCache keyed by handler, arguments and generation
+# The generation is stored in the dictionary at generation and moved on by UpdateCache only when the browse index has changed,
+# which also empties the cache. Each handler's entries also expire after a time to live, matching the data it is built from
+
+def CachedResponse(ttl):
+
+  # Decorator caching the container returned by a menu handler for ttl seconds
+  # The wrapped function keeps its name, which the framework uses to route Function() callbacks
+  # The prefetches the handler asked for are cached with the container and asked for again when it is served, see Prefetch
+
+  def Decorator(function):
+    name = function.__name__
+
+    def Wrapper(sender, **kwargs):
+      key = (name, Dict.Get('generation'), tuple(sorted(kwargs.items())))
+      cached = ResponseCache.Get(key)
+      if cached != None:
+        Metrics.Increment('cache.responses.' + name + '.hits')
+        dir, prefetches = cached
+        Prefetch(prefetches)
+        return dir
+
+      Metrics.Increment('cache.responses.' + name + '.misses')
+      prefetchRequests.asked = []
+      try:
+        dir = function(sender, **kwargs)
+        prefetches = prefetchRequests.asked
+      finally:
+        prefetchRequests.asked = None
+      # Messages report a passing condition (eg a failed fetch) and aren't cached
+      if dir != None and not isinstance(dir, MessageContainer):
+        ResponseCache.Set(key, (dir, prefetches), len(dir) + 1, ttl)
+      return dir
+
+    return functools.wraps(function)(Wrapper)
+  return Decorator
+
+def NewGeneration():
+
+  # Starts a new generation of menu responses, dropping those already cached
+  generation = (Dict.Get('generation') or 0) + 1
+  Dict.Set('generation', generation)
+  ResponseCache.Clear()
+  Metrics.Gauge('cache.responses.generation', generation)
+
+###########################
+# Prefetch
+#
+# Menus ask for the pages behind their first items to be fetched in the background with Prefetch, each as a (kind, key) of
+# ('episodes', showId) for ShowBrowserTV, ('movie', showId) for ShowBrowserMovies or ('aspect', url) for PlayVideo
+# These are the same calls the handlers make, so the handler finds the result cached or joins the fetch in flight
+# Each menu shown (and each video played) replaces what is queued, prefetches for an earlier menu are dropped
+# as the user has moved on. At most PREFETCH_WORKERS run at once and PREFETCH_BUDGET are queued
+
+prefetchLock = threading.Condition()
+prefetchQueue = []
+prefetchThreads = []
+prefetchRequests = threading.local() # The prefetches asked for by the handler being cached, see CachedResponse
+
+PREFETCHERS = {'episodes': lambda showId: GetShowEpisodes(showId), 'movie': lambda showId: GetMovie(showId), 'aspect': lambda url: GetAspect(url)}
+
+def Prefetch(prefetches):
+
+  # Queues prefetches, a list of (kind, key), in place of any still queued
+
+  if getattr(prefetchRequests, 'asked', None) != None:
+    prefetchRequests.asked.extend(prefetches)
+  if not PREFETCH:
+    return
+
+  prefetchLock.acquire()
+  try:
+    if prefetchQueue:
+      Metrics.Increment('prefetch.cancelled', len(prefetchQueue))
+    prefetchQueue[:] = Unique(prefetches)[:PREFETCH_BUDGET]
+    Metrics.Increment('prefetch.queued', len(prefetchQueue))
+
+    # Workers are started the first time they are needed and then wait for more
+    while len(prefetchThreads) < PREFETCH_WORKERS:
+      thread = threading.Thread(target=PrefetchWorker)
+      thread.daemon = True
+      thread.start()
+      prefetchThreads.append(thread)
+    prefetchLock.notify_all()
+  finally:
+    prefetchLock.release()
+
+def Navigated():
+
+  # Drops the queued prefetches, eg when a video is played
+  Prefetch([])
+
+def PrefetchWorker():
+
+  while True:
+    prefetchLock.acquire()
+    try:
+      while not prefetchQueue:
+        prefetchLock.wait()
+      kind, key = prefetchQueue.pop(0)
+    finally:
+      prefetchLock.release()
+
+    start = Metrics.Start()
+    try:
+      PREFETCHERS[kind](key)
+      Metrics.Stop('prefetch.' + kind, start)
+    except Exception:
+      Metrics.Increment('prefetch.failed')
+      if DEBUG:
+        PMS.Log("Failed to prefetch %s %s: %s" % (kind, key, sys.exc_info()[1]))
+
+def ShowPrefetches(mediaType, showIds):
+
+  # The prefetches for the first of a list of shows
+  kind = {'tv': 'episodes'}.get(mediaType, 'movie')
+  return [(kind, showId) for showId in showIds[:PREFETCH_ITEMS]]
+
+###########################
+# Paging
+#
+# Long lists are served PAGE_SIZE rows at a time, only the rows of the requested page are turned into items
+# The cursor handed to the 'More...' item is the position of the next page's first row
+
+def Paginate(rows, cursor):
+
+  # Returns the rows of the page starting at cursor, and the cursor of the next page or None if this is the last
+  start = max(0, int(cursor or 0))
+  end = start + PAGE_SIZE
+  nextCursor = None
+  if end < len(rows):
+    nextCursor = end
+  return (rows[start:end], nextCursor)
+
+###########################
+# Statistics
+#
+# Handlers, crawl phases, extraction and fetches are timed into Metrics (see Stats.py), under names such as
+# handler.TVMovieBrowser, crawl.UpdateListing, extract.ExtractEpisodes and fetch.crawl.photos
+# StatsReport serves these along with the caches', fetch engines' and metadata store's own counters
+
+def FetchObserver(engineName):
+
+  # Returns an observer for a fetch engine, timing each request by the kind of page fetched
+  def Observer(url, status, latency, size):
+    Metrics.Observe('fetch.' + engineName + '.' + PageType(url), latency)
+    Metrics.Increment('fetch.' + engineName + '.bytes', size)
+    if status == None or status >= 400:
+      Metrics.Increment('fetch.' + engineName + '.errors')
+  return Observer
+
+def PageType(url):
+
+  # Names the kind of page at url, eg widget, photos, videos or image
+  if url.startswith(FANCAST_TV_WIDGET) or url.startswith(FANCAST_MOVIES_WIDGET):
+    return 'widget'
+  if url == FANCAST_TRAILERS_URL:
+    return 'trailers'
+  if url.rstrip('/') == FANCAST_URL:
+    return 'front'
+  if url.split('?')[0].split('.')[-1].lower() in Images.CONTENT_TYPES:
+    return 'image'
+  pageType = url.rstrip('/').split('/')[-1]
+  if pageType in ('photos', 'full-episodes', 'full-movie', 'about', 'videos'):
+    return pageType
+  return 'other'
+
+def RecordCoverage(started):
+
+  # Notes how long the cache update that began at started took, and how many of the listed shows have metadata
+  listed = []
+  for url in (FANCAST_TV_WIDGET, FANCAST_MOVIES_WIDGET, FANCAST_TRAILERS_URL):
+    listed = listed + GetListing(url).get('showIds', [])
+  listed = Unique(listed)
+  covered = len(listed) - len(MissingShowMetadata(listed))
+
+  coverage = 1.0
+  if len(listed) > 0:
+    coverage = float(covered) / len(listed)
+
+  Metrics.Gauge('crawl.lastFinished', time.time())
+  Metrics.Gauge('crawl.lastDuration', time.time() - started)
+  Metrics.Gauge('crawl.showsListed', len(listed))
+  Metrics.Gauge('crawl.showsWithMetadata', covered)
+  Metrics.Gauge('crawl.coverage', coverage)
+
+def StatsReport(sender=None):
+
+  # Serves everything collected as JSON, only when the debugStats preference is set (see Defaults.xml)
+  # It isn't listed in any menu, it is called as a function of the plugin at FANCAST_PREFIX/:/function/StatsReport
+
+  if not Prefs.Get('debugStats'):
+    return MessageContainer(header=L('stats'), message=L('statsdisabled'), title1=L('fancast'))
+
+  report = Metrics.Snapshot()
+  report['caches'] = {'pages': PageCache.Stats(), 'movies': MovieCache.Stats(), 'episodes': EpisodeCache.Stats(), 'movieFetches': movieFetches.Stats(), 'episodeFetches': episodeFetches.Stats(), 'aspectFetches': aspectFetches.Stats(), 'responses': ResponseCache.Stats(), 'images': ImageStore.Stats(), 'records': RecordStore.Stats()}
+  report['engines'] = {'crawl': CrawlEngine.Stats(), 'user': UserEngine.Stats()}
+  report['store'] = MetaStore.Counts()
+  report['failures'] = FailureReport(MetaStore.GetFailures())
+  return DataObject(JSON.StringFromObject(report), 'application/json')
 
 #######################
 # Plugin menus
 
+@Metrics.Timed('handler.MainMenu')
 def MainMenu():
 
   # Top level menu
-  # First ensure the cache has been updated at least once, if not ask the user to come back later #TODO check wording
+  # The menus are shown as soon as the first cache update has listed some shows (or a snapshot was restored),
+  # until then ask the user to come back later #TODO check wording
 
-  if Dict.Get('cacheRanOnce') == True:
+  Navigated()
+
+  if MenusAvailable():
 
-    # Dispaly the avaialble categories of content and TODO 'search'
+    # Dispaly the avaialble categories of content and search
     dir = MediaContainer()
 
     dir.Append(Function(DirectoryItem(TVMovieMainMenu, title=L('tv'), thumb=R('icon-default.png')), mediaType='tv'))
     dir.Append(Function(DirectoryItem(TVMovieMainMenu, title=L('movies'), thumb=R('icon-default.png')), mediaType='movies'))
-#    dir.Append(Function(DirectoryItem(TrailerBrowser, title=L('trailers'), thumb=R('icon-default.png'))))
+    dir.Append(Function(SearchDirectoryItem(SearchResults, title=L('search'), prompt=L('searchPrompt'), thumb=R('icon-default.png'))))
+    dir.Append(Function(DirectoryItem(TrailerBrowser, title=L('trailers'), thumb=R('icon-default.png'))))
 #    dir.Append(Function(DirectoryItem(ClipBrowser, title=L('clips'), thumb=R('icon-default.png'))))
 
     if DEBUG_XML_RESPONSE:
@@ -256,11 +1718,15 @@ def MainMenu():
   else:
     return (MessageContainer(header=L('fancast'), message=L('noinitialcache'), title1=L('fancast')))
 
+@Metrics.Timed('handler.TVMovieMainMenu')
+@CachedResponse(CACHE_SHOWLIST)
 def TVMovieMainMenu(sender, mediaType):
 
   # Display the top level menu for TV and Movies
   # They are very similar so we use the same function, just adding new episodes, and network as options to 'tv'
 
+  Navigated()
+
   dir = MediaContainer()
   dir.title2 = L(mediaType)
 
@@ -278,6 +1744,8 @@ def TVMovieMainMenu(sender, mediaType):
   return dir
 
 
+@Metrics.Timed('handler.TVMovieFilterSelector')
+@CachedResponse(CACHE_SHOWLIST)
 def TVMovieFilterSelector(sender, mediaType, filterType):
 
   # Present a list of available 'filers' i.e. Genres or Networks
@@ -285,41 +1753,40 @@ def TVMovieFilterSelector(sender, mediaType, filterType):
   # mediatype is 'tv' or 'movies'
   # filterType is 'genere' or 'network' (tv only)
 
+  Navigated()
+
   dir = MediaContainer()
   dir.title1 = L(mediaType)
   dir.title2 = L(filterType)
 
-  # Pull down the appropriate 'widget', this lists available filters
+  # The available filters are read from the browse index built by UpdateCache
+  # If they haven't been indexed yet pull down the appropriate 'widget', this lists available filters
 
-  if mediaType == 'tv':
-    url = FANCAST_TV_WIDGET
-  else:
-    url = FANCAST_MOVIES_WIDGET
-
-  page = XML.ElementFromURL(url, isHTML=True, cacheTime=CACHE_SHOWLIST)
+  browseFilters = Dict.Get('browseFilters') or {}
+  filterKey = mediaType + '|' + filterType
 
-  if ( filterType == 'network' ):
-    availableFilters = page.xpath("//div[@id='filters']/div[@class='FilterbyNetwork']/ul/li[not(@class='selected')]")
+  if filterKey in browseFilters:
+    availableFilters = browseFilters[filterKey]
   else:
-     availableFilters = page.xpath("//div[@id='filters']/div[@class='FilterbyGenre']/ul/li[not(@class='selected')]")
+    if mediaType == 'tv':
+      url = FANCAST_TV_WIDGET
+    else:
+      url = FANCAST_MOVIES_WIDGET
 
-  for filter in availableFilters:
-    filterOnClick = filter.xpath("./a")[0].get('onclick')
-    # Strip away the javascript function call (filterEpList)
-    filterUrl = FANCAST_URL + re.search(r"'([^']+)'", filterOnClick).group(1)
-    filterName = str(filter.xpath("./a/text()")[0])
+    page = GetPage(url, CACHE_SHOWLIST)
+    availableFilters = ExtractFilters(page, filterType)
 
-    # Hide ABC and CW networks, append all the others
-    if filterName != 'ABC' or HIDE_ABC == False:
-      if filterName != 'CW' or HIDE_CW == False:
-        dir.Append(Function(DirectoryItem(TVMovieBrowser, title=filterName, summary=L('filterGenre'), subtitle='', thumb=R('icon-default.png')), mediaType=mediaType, filterType=filterType, filterUrl=filterUrl, filterName=filterName))
+  for filterName, filterUrl in availableFilters:
+    dir.Append(Function(DirectoryItem(TVMovieBrowser, title=filterName, summary=L('filterGenre'), subtitle='', thumb=R('icon-default.png')), mediaType=mediaType, filterType=filterType, filterUrl=filterUrl, filterName=filterName))
 
   if DEBUG_XML_RESPONSE:
     PMS.Log(dir.Content())
   return dir
 
 
-def TVMovieBrowser(sender, mediaType, filterType=None, filterUrl=None, filterName=None):
+@Metrics.Timed('handler.TVMovieBrowser')
+@CachedResponse(CACHE_SHOWLIST)
+def TVMovieBrowser(sender, mediaType, filterType=None, filterUrl=None, filterName=None, cursor=0):
 
   # Display a list of shows filtered by various options
 
@@ -327,120 +1794,121 @@ def TVMovieBrowser(sender, mediaType, filterType=None, filterUrl=None, filterNam
   # filterType is all / top5 / genre / network / new
   # filterValue is the selected value, eg Fox / Comedy etc.. 
   # filterName is the human redable name of the filter
+  # cursor is where the page starts in the list, see Paginate
 
   # We have either a filterUrl or we're showing 'all'
 
   if DEBUG:
     PMS.Log ("Filter type %s name %s" % (filterType, filterName))
 
-  if filterUrl == None:
-    if mediaType == 'tv':
-      filterUrl = FANCAST_TV_WIDGET
-    else:
-      filterUrl = FANCAST_MOVIES_WIDGET
-
   dir = MediaContainer()
   # TODO title1?
   dir.title2 = filterName
   dir.viewGroup = 'List'
 
-  if DEBUG:
-    PMS.Log("Fetching filtered page: %s" % filterUrl)
+  # The shows are read from the browse index built by UpdateCache
+  browseIndex = Dict.Get('browseIndex') or {}
+  browseKey = BrowseKey(mediaType, filterType, filterName)
 
-  # Get the filtered results and show the avaialble shows
-  page = XML.ElementFromURL(filterUrl, isHTML=True, cacheTime=CACHE_SHOWLIST)
+  if browseKey in browseIndex:
+    shows, nextCursor = Paginate(browseIndex[browseKey], cursor)
 
-  if filterType=='new':
-    # New episodes are within a 'new episode' div
-    shows = page.xpath("//div[@class='fullEpisodeList']//div/ul/li/div")
   else:
-    if HIDE_PROTECTED_PROVIDERS:
-      shows = page.xpath("//div[@class='fullEpisodeList']//div/ul/li[not(starts-with(@class, 'protected'))]")
-    else:
-      shows = page.xpath("//div[@class='fullEpisodeList']//div/ul/li")
+    # This list hasn't been indexed yet, get the filtered results directly
+    if filterUrl == None:
+      if mediaType == 'tv':
+        filterUrl = FANCAST_TV_WIDGET
+      else:
+        filterUrl = FANCAST_MOVIES_WIDGET
 
+    if DEBUG:
+      PMS.Log("Fetching filtered page: %s" % filterUrl)
 
+    page = GetPage(filterUrl, CACHE_SHOWLIST)
+    showIds, nextCursor = Paginate(Unique(ExtractShowIds(page, filterUrl, filterType)), cursor)
+    shows = ShowRecords(showIds)
 
   if DEBUG:
     PMS.Log ("Found %d shows" % len(shows))
 
-  for show in shows:
-    showFullUrl = show.xpath(".//a")[0].get('href') # //a here as the link can be within a 'new episode' div
-    showId = re.search('^(.*/(?:movies|tv)/[^/]+/\d+/)', showFullUrl).group(1)
-    showKey = 'show-'+showId
-
-    # Check that we have a metadata key for this show, if not just ignore it and it will be picked up in the next cache update
-    if (Dict.HasKey(showKey)):
-
-      # Grab existing metadata
-      showMeta = Dict.Get(showKey)
-      title = showMeta['title']
-      thumb = showMeta['thumb']
-      network = showMeta['network']
+  # Warm the first shows while the user reads the list
+  Prefetch(ShowPrefetches(mediaType, [show['showId'] for show in shows]))
 
-      # Set the default thumbnail if none is found
-      if thumb == '':
-        thumb = R('icon-default.png')
+  for show in shows:
+    title = show['title']
+    thumb = ThumbUrl(show['thumb'])
 
-      # Hide ABC and CW networks, append all the others
-      if not (network.find('ABC-Entertainment') >= 0) or HIDE_ABC == False:
-        if not (network.find('CW-Television-Network') >= 0) or HIDE_CW == False:
-          if mediaType == 'tv':
-            dir.Append(Function(DirectoryItem(ShowBrowserTV, title=title, summary='', subitle='', thumb=thumb), showId=showId, showName=title))
-          else:
-            dir.Append(Function(DirectoryItem(ShowBrowserMovies, title=title, summary='', subitle='', thumb=thumb), showId=showId, showName=title))
+    if mediaType == 'tv':
+      dir.Append(Function(DirectoryItem(ShowBrowserTV, title=title, summary='', subitle='', thumb=thumb), showId=show['showId'], showName=title))
     else:
-      if DEBUG:
-        PMS.Log ("No show metadata was found for %s" % showId)
+      dir.Append(Function(DirectoryItem(ShowBrowserMovies, title=title, summary='', subitle='', thumb=thumb), showId=show['showId'], showName=title))
+
+  if nextCursor != None:
+    dir.Append(Function(DirectoryItem(TVMovieBrowser, title=L('more'), thumb=R('icon-default.png')), mediaType=mediaType, filterType=filterType, filterUrl=filterUrl, filterName=filterName, cursor=nextCursor))
 
   if DEBUG_XML_RESPONSE:
     PMS.Log(dir.Content())
   return dir
 
 
-def TrailerBrowser(sender):
-  # TODO this!
-  pass
+@Metrics.Timed('handler.TrailerBrowser')
+def TrailerBrowser(sender, cursor=0):
+
+  # List the shows with trailers, each plays its trailer
+  # The list is read from the browse index built by UpdateCache, so no requests are made
+  # cursor is where the page starts in the list, see Paginate
+
+  browseIndex = Dict.Get('browseIndex') or {}
+  trailers = browseIndex.get(BrowseKey('trailers', 'all'), [])
+  if len(trailers) == 0:
+    Navigated()
+    return MessageContainer(header=L('trailers'), message=L('notrailers'), title1=L('fancast'))
+
+  dir = MediaContainer()
+  dir.title2 = L('trailers')
+  dir.viewGroup = 'Details'
+
+  trailers, nextCursor = Paginate(trailers, cursor)
+  Prefetch([('aspect', trailer['url']) for trailer in trailers[:PREFETCH_ITEMS]])
+  for trailer in trailers:
+    dir.Append(Function(WebVideoItem(PlayVideo, title=trailer['title'], subtitle=trailer['network'], summary='', thumb=ThumbUrl(trailer['thumb'])), url=trailer['url']))
 
+  if nextCursor != None:
+    dir.Append(Function(DirectoryItem(TrailerBrowser, title=L('more'), thumb=R('icon-default.png')), cursor=nextCursor))
+
+  if DEBUG_XML_RESPONSE:
+    PMS.Log(dir.Content())
+  return dir
+
+@Metrics.Timed('handler.ClipBrowser')
 def ClipBrowser(sender):
   #TODO this!
   pass
 
-def ShowBrowserTV(sender, showId, showName, selectedSeasonId=None, selectedSeasonName=None):
+@Metrics.Timed('handler.ShowBrowserTV')
+@CachedResponse(CACHE_SHOWASSETS)
+def ShowBrowserTV(sender, showId, showName, selectedSeasonId=None, selectedSeasonName=None, cursor=0):
 
   # List available assets for selected tv show
+  # Episodes are listed a page at a time from cursor, see Paginate
 
   dir = MediaContainer()
   dir.title2 = showName
 
-  page = XML.ElementFromURL(FANCAST_URL + showId + 'full-episodes', isHTML=True, cacheTime=CACHE_SHOWASSETS)
+  seasons = GetShowEpisodes(showId)
 
   # TV shows can have multiple seasons
   # If more that one season is available the list the available seasons and have the user select one
 
-  seasonsExist = False
-  seasons = page.xpath("//div[@id='listHolder']/ul[1]/li[@class='seasonsMenu']/select[@name='seasons']/option[not(@value='all')]")
-
-  if len(seasons) > 1:
-    # More that one season exists
-    seasonsExist = True
-
-  if seasonsExist and not selectedSeasonId:
+  if len(seasons) > 1 and not selectedSeasonId:
     # More that one season exist but the user has not yet selected one
     # Present a list of available seasons
 
-    for season in seasons:
-
-      seasonId = season.get('value');
-      if DEBUG: 
-        PMS.Log("Found season %s" % seasonId)
-
-      seasonName = re.search('^\s*(\S.*\S)\s*$', season.xpath("./text()")[0]).group(1)
-
-      # Find a thumbnail for the season - this is the thumbanil for the first listed episode in the season
-      thumb = page.xpath("//div[@id='" + seasonId + "']//td[@class='first']/a/img")[0].get('src')
+    # The first season is the one most likely picked, warm its first episodes
+    Prefetch([('aspect', episode.url) for episode in seasons[0].episodes[:PREFETCH_EPISODES]])
 
-      dir.Append(Function(DirectoryItem(ShowBrowserTV, title=seasonName, thumb=thumb), showId=showId, showName=showName, selectedSeasonId=seasonId, selectedSeasonName=seasonName))
+    for season in seasons:
+      dir.Append(Function(DirectoryItem(ShowBrowserTV, title=season.name, thumb=ThumbUrl(season.thumb)), showId=showId, showName=showName, selectedSeasonId=season.id, selectedSeasonName=season.name))
 
   else:
 
@@ -448,36 +1916,27 @@ def ShowBrowserTV(sender, showId, showName, selectedSeasonId=None, selectedSeaso
 
     dir.viewGroup = 'Details'
 
-    if selectedSeasonId:
-      assets = page.xpath("//div[@id='" + selectedSeasonId + "']/table[@class='videoList fourColumn']//tr[not(@class='newEpHeader')]")
-    else:
-      assets = page.xpath("//div[@id='listHolder']//tr[not(@class='newEpHeader')]")
-
-    for asset in assets:
-      thumb = asset.xpath(".//img")[0].get('src')
-      title = TidyString(asset.xpath("./td[position()=1]/a[position()=2]")[0].text)
-      summary = asset.xpath(".//p")[0].text
-      episodeId = TidyString(asset.xpath("./td[@class='two']")[0].text)
-      episodeId = re.sub (r'S', 'Season ', episodeId)
-      episodeId = re.sub (r'Ep', 'Episode ', episodeId)
-      # FIXME - This pipe is not being removed for some reason
-      episodeId = re.sub (r'|', r'', episodeId)
-      episodeId = re.sub (r'Unknown', 'Season: Unknown', episodeId)
-      airDate= TidyString(asset.xpath("./td[@class='three']")[0].text)
-      subtitle= episodeId + "\n" + "Airdate: " + airDate
-      duration = asset.xpath("./td[@class='first']//span")[0].text
-      duration = re.search ( r'([^)]+)', duration).group(1)
-      url = FANCAST_URL + asset.xpath("./td[@class='first']/a[position()=1]")[0].get('href')
-
-      duration = ConvertDuration(duration)
-
-      dir.Append(Function(WebVideoItem(PlayVideo, title=title, subtitle=subtitle, summary=summary, duration=duration, thumb=thumb), url=str(url)))
+    episodes = seasons[0].episodes
+    for season in seasons:
+      if season.id == selectedSeasonId:
+        episodes = season.episodes
+
+    episodes, nextCursor = Paginate(episodes, cursor)
+    Prefetch([('aspect', episode.url) for episode in episodes[:PREFETCH_EPISODES]])
+    for episode in episodes:
+      subtitle= episode.episode + "\n" + "Airdate: " + episode.airdate
+      dir.Append(Function(WebVideoItem(PlayVideo, title=episode.title, subtitle=subtitle, summary=episode.summary, duration=episode.duration, thumb=ThumbUrl(episode.thumb)), url=episode.url))
+
+    if nextCursor != None:
+      dir.Append(Function(DirectoryItem(ShowBrowserTV, title=L('more'), thumb=R('icon-default.png')), showId=showId, showName=showName, selectedSeasonId=selectedSeasonId, selectedSeasonName=selectedSeasonName, cursor=nextCursor))
 
   if DEBUG_XML_RESPONSE:
     PMS.Log(dir.Content())
   return dir
 
 
+@Metrics.Timed('handler.ShowBrowserMovies')
+@CachedResponse(CACHE_SHOWASSETS)
 def ShowBrowserMovies(sender, showId, showName):
 
   # Show movie 
@@ -486,30 +1945,15 @@ def ShowBrowserMovies(sender, showId, showName):
   dir.title2 = showName
   dir.viewGroup = 'Details'
 
-  # We get metadata from 2 sources the main listings page and the 'about' page
-
-  listingsPage = XML.ElementFromURL(FANCAST_URL + showId + 'full-movie', isHTML=True, cacheTime=CACHE_SHOWASSETS)
-  aboutPage = XML.ElementFromURL(FANCAST_URL + showId + 'about', isHTML=True, cacheTime=CACHE_SHOWASSETS)
-
-  # Get metadata from listingsPage
-  title = TidyString(listingsPage.xpath("//table[@class='videoList twoColumn']//td[@class='first']/a[2]")[0].text)
-  PMS.Log("title %s" % title)
-  url = FANCAST_URL + listingsPage.xpath("//table[@class='videoList twoColumn']//td[@class='first']/a")[0].get('href')
-  duration = listingsPage.xpath("//table[@class='videoList twoColumn']//td[@class='first']/a/span")[0].text
-  duration = ConvertDuration(re.search ( r'([^)]+)', duration).group(1))
-  yearAndRating = TidyString(listingsPage.xpath("//div[@id='pageHeadline']//span[@class='meta']")[0].text)
-  # Strip the brackets surrounding the year
-  yearAndRating = re.sub (r'\(([^\(]+)\)', r'\1', yearAndRating)
-  
-  # Get metadata from about page
-  summary = aboutPage.xpath("//div[@id='leftcontent']/div[@class='clearfix']/p")[0].text
-  thumb = R('icon-default.png')
+  # We get metadata from 2 sources the main listings page and the 'about' page, see GetMovie
   try:
-    thumb = aboutPage.xpath("//div[@id='thumbNail']//img")[0].get('src')
-  except:
-    pass
+    movie = GetMovie(showId)
+  except Fetch.FetchError:
+    PMS.Log("Failed to fetch the movie %s: %s" % (showId, sys.exc_info()[1]))
+    return MessageContainer(header=showName, message=L('movieunavailable'), title1=L('fancast'))
+  Prefetch([('aspect', movie.url)])
 
-  dir.Append(Function(WebVideoItem(PlayVideo, title=title, subtitle=yearAndRating, summary=summary, duration=duration, thumb=thumb), url=str(url)))
+  dir.Append(Function(WebVideoItem(PlayVideo, title=movie.title, subtitle=movie.yearAndRating, summary=movie.summary, duration=movie.duration, thumb=ThumbUrl(movie.thumb)), url=movie.url))
 
   if DEBUG_XML_RESPONSE:
     PMS.Log(dir.Content())
@@ -521,6 +1965,51 @@ def ShowBrowserMovies(sender, showId, showName):
 
       
 
+@Metrics.Timed('handler.SearchResults')
+def SearchResults(sender, query):
+
+  # Lists the shows and episodes matching query, from the search index so no requests are made
+
+  dir = MediaContainer()
+  dir.title1 = L('search')
+  dir.title2 = query
+  dir.viewGroup = 'Details'
+
+  results = SearchIdx.Search(query, SEARCH_RESULTS)
+  if len(results) == 0:
+    Navigated()
+    return MessageContainer(header=L('search'), message=L('noresults'), title1=L('fancast'))
+
+  prefetches = []
+  for kind, mediaType, record in results[:PREFETCH_ITEMS]:
+    if kind == 'show':
+      prefetches = prefetches + ShowPrefetches(mediaType, [record['showId']])
+    else:
+      prefetches.append(('aspect', record.url))
+  Prefetch(prefetches)
+
+  for kind, mediaType, record in results:
+    if kind == 'show':
+      thumb = ThumbUrl(record['thumb'])
+      if mediaType == 'tv':
+        dir.Append(Function(DirectoryItem(ShowBrowserTV, title=record['title'], summary='', subtitle=L('tv'), thumb=thumb), showId=record['showId'], showName=record['title']))
+      else:
+        dir.Append(Function(DirectoryItem(ShowBrowserMovies, title=record['title'], summary='', subtitle=L('movies'), thumb=thumb), showId=record['showId'], showName=record['title']))
+    elif kind == 'asset':
+      title = record.showTitle + ' : ' + record.episodeTitle
+      subtitle = record.season + " | " + record.episodeNumber
+      dir.Append(Function(WebVideoItem(PlayVideo, title=title, subtitle=subtitle, summary=record.description, duration=record.duration, thumb=ThumbUrl(record.thumb)), url=record.url))
+    else:
+      # An episode from a show's episode list, mediaType is the show's title
+      title = mediaType + ' : ' + record.title
+      subtitle = record.episode + "\n" + "Airdate: " + record.airdate
+      dir.Append(Function(WebVideoItem(PlayVideo, title=title, subtitle=subtitle, summary=record.summary, duration=record.duration, thumb=ThumbUrl(record.thumb)), url=record.url))
+
+  if DEBUG_XML_RESPONSE:
+    PMS.Log(dir.Content())
+  return dir
+
+@Metrics.Timed('handler.Top5Browser')
 def Top5Browser(sender, mediaType):
 
   # Shows the top 5 tv / movies or trailers
@@ -530,40 +2019,33 @@ def Top5Browser(sender, mediaType):
   dir.title2 = L('top5')
   dir.viewGroup = 'Details'
 
-  page = XML.ElementFromURL(FANCAST_URL, isHTML= True, cacheTime=CACHE_FRONTPAGE)
+  # The lists are precomputed by UpdateCache, never wait on the network here
+  # If what we hold is stale it is served anyway and refreshed in the background for next time
 
-  if mediaType == 'tv':
-    divId = 'playlistTabBody0'
-  elif mediaType == 'movies':
-    divId = 'playlistTabBody1'
-  else:
+  if mediaType not in TOP5_DIVS:
     # Trailers
-    divId = 'playlistTabBody2'
-
-  items = page.xpath("//div[@id='" + divId + "']/ol/li")
+    mediaType = 'trailers'
 
-  # The available metadata is very sparse so we grab the asset id's then search for their metadata
+  top5 = Dict.Get('top5-'+mediaType)
+  if top5 == None or time.time() - top5['updatedAt'] > CACHE_FRONTPAGE:
+    Metrics.Increment('top5.stale')
+    RefreshTop5InBackground()
 
-  assetIds = []
+  if top5 == None:
+    Navigated()
+    return MessageContainer(header=L('top5'), message=L('top5pending'), title1=L('fancast'))
 
-  for item in items:
+  assets = [asset for asset in MetaStore.GetAssets(top5.get('assetIds', [])) if asset != None]
+  Prefetch([('aspect', asset.url) for asset in assets[:PREFETCH_ITEMS]])
 
-    itemUrl = item.xpath("./a")[0].get('href')
-    assetId = re.search (r'http://www.fancast.com(.*)/videos', itemUrl).group(1)
+  for assetMetadata in assets:
 
-    assetIds.append(assetId)
-
-  GetAssetMetadata(assetIds)
-
-  for assetId in assetIds:
-
-    assetMetadata = Dict.Get('asset-'+assetId)
-    title = assetMetadata['showTitle'] + ' : ' + assetMetadata['episodeTitle']
-    subtitle = assetMetadata['season'] + " | " + assetMetadata['episodeNumber']
-    description = assetMetadata['description']
-    duration = assetMetadata['duration']
-    thumb = assetMetadata['thumb']
-    url = assetMetadata['url']
+    title = assetMetadata.showTitle + ' : ' + assetMetadata.episodeTitle
+    subtitle = assetMetadata.season + " | " + assetMetadata.episodeNumber
+    description = assetMetadata.description
+    duration = assetMetadata.duration
+    thumb = ThumbUrl(assetMetadata.thumb)
+    url = assetMetadata.url
 
     dir.Append(Function(WebVideoItem(PlayVideo, title=title, subtitle=subtitle, summary=description, duration=duration, thumb=thumb), url=url))
 
@@ -575,49 +2057,22 @@ def Top5Browser(sender, mediaType):
 
     
 
+@Metrics.Timed('handler.PlayVideo')
 def PlayVideo(sender, url):
 
+  # Nothing queued is needed while the video plays
+  Navigated()
+
   # First clear any existing comfancastbookmarks.sol files
   # This prevents the 'resume from where you left off' dialog from showing
-  os.system("/bin/rm ~/Library/Preferences/Macromedia/Flash\ Player/#SharedObjects/*/www.fancast.com/static-*/swf/FCVidContainerInit.swf/comfancastbookmarks.sol")
+  for bookmark in glob.glob(os.path.expanduser(FLASH_BOOKMARKS)):
+    try:
+      os.remove(bookmark)
+    except OSError:
+      pass
 
   # Request to play the video at URL, rewrite the URL so it puls in the correct site config
-
-  metadata = XML.ElementFromURL(url, isHTML=True, cacheTime=CACHE_ASSETMETADATA, errors='ignore')
-
-  # Determine aspect ratio
-
-  width = metadata.xpath("//meta[@name='video_width']")[0].get('content')
-  width = re.sub (r',', r'', width)
-  width = re.sub (r'"', r'', width)
-
-  height = metadata.xpath("//meta[@name='video_height']")[0].get('content')
-  height = re.sub (r',', r'', height)
-  height = re.sub (r'"', r'', height)
-
-  if DEBUG:
-    PMS.Log("width %s height %s" % (width, height))
-
-
-  if float(height) == 0:
-    # For some reason we didn't get a 'height' let's make one up
-    height = 360
-    width = 640
-
-  ratio = float(width) / float(height)
-
-  # 1.55 is the cut off ratio used by Fancast
-  if ratio < 1.55:
-    # Player is 4x3
-    aspect = '4x3'
-
-  elif ratio < 2.2:
-    # Player is 16x9
-    aspect = '16x9'
-
-  else:
-    # Player is 2.35:1 (eg Watchmen HD Trailer)
-    aspect = '2.35x1'
+  aspect = GetAspect(url)
   url = url + "#" + aspect
 
   if DEBUG:
@@ -0,0 +1,286 @@
+# Offline benchmarks for the Fancast plugin (Python 3)
+#
+# Runs the plugin's crawl and menu functions against generated fixture pages (see Fixtures.py) served locally,
+# using the stub framework in PMS.py, and reports for each:
+#  - wall time, the median over --repeat runs
+#  - parse time, the time spent in XML.ElementFromString / ElementFromURL (summed over threads, so it can exceed the wall time)
+#  - peak memory, the peak of Python memory allocated during one extra run traced with tracemalloc
+#  - peak rss, how far the resident set size grew during the first run (sampled, Linux only), this includes memory
+#    allocated by libxml2 which tracemalloc can't see
+#
+#   python Tools/Benchmark.py --shows 5000 --movies 2000
+#   python Tools/Benchmark.py --json > baseline.json
+#   python Tools/Benchmark.py --baseline baseline.json   # exits with status 1 if anything got slower or bigger than --tolerance
+#
+# Requires lxml
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import tracemalloc
+
+import Harness
+import Fixtures
+import FixtureServer
+import PMS
+
+# Used to convert /proc/self/statm to bytes
+PAGE_SIZE = 4096
+if hasattr(os, 'sysconf') and 'SC_PAGE_SIZE' in os.sysconf_names:
+  PAGE_SIZE = os.sysconf('SC_PAGE_SIZE')
+
+
+######
+# Benchmarks
+# Each is (name, setup, run), setup puts the plugin in the state to measure and is not timed
+
+def Benchmarks(plugin, site, options):
+
+  tvIds = site.ShowIds('tv', site.shows)
+  movieIds = site.ShowIds('movies', site.movies)
+  sampleTv = tvIds[:options.sample]
+  sampleMovies = movieIds[:options.sample]
+  assetIds = [showId + '%d' % (700000 + episode) for showId in tvIds for episode in range(site.episodes)][:options.assets]
+  videoUrls = [Fixtures.FANCAST_URL + assetId + '/videos' for assetId in assetIds[:options.sample]]
+
+  def Cold():
+    Harness.ResetPlugin(plugin)
+
+  def Crawled():
+    # The state after the first cache update, what every menu is served from
+    if not PMS.Dict.Get('cacheRanOnce'):
+      plugin.UpdateCache()
+    # Undo anything a metadata benchmark did to the store
+    plugin.LoadMetadata()
+
+  def NoMetadata():
+    plugin.MetaStore.Load(None)
+
+  def Restarted():
+    # The in memory caches are lost, the stored records remain
+    Crawled()
+    PMS.HTTP.ClearCache()
+    plugin.PageCache.Clear()
+    plugin.MovieCache.Clear()
+    plugin.ResponseCache.Clear()
+    plugin.AspectCache.Clear()
+    plugin.EpisodeCache.Clear()
+
+  def NoPageCaches():
+    Restarted()
+    for name in list(PMS.Data.items.keys()):
+      if name.startswith('record-'):
+        PMS.Data.Remove(name)
+
+  def NoAspects():
+    Crawled()
+    plugin.AspectCache.Clear()
+    for name in list(PMS.Data.items.keys()):
+      if name.startswith('record-aspect-'):
+        PMS.Data.Remove(name)
+
+  def NoResponses():
+    Crawled()
+    plugin.ResponseCache.Clear()
+
+  def WipedDict():
+    # A restart after the dictionary was lost, only the snapshot saved by the last cache update is left
+    Crawled()
+    PMS.Dict.Reset()
+    plugin.MetaStore.Load(None)
+    plugin.ResponseCache.Clear()
+
+  def StartAndMenu():
+    plugin.Start()
+    plugin.TVMovieBrowser(None, mediaType='tv', filterType='all')
+
+  def BrowseAll(mediaType):
+    return lambda: plugin.TVMovieBrowser(None, mediaType=mediaType, filterType='all')
+
+  def BrowseGenre():
+    filterName, filterUrl = PMS.Dict.Get('browseFilters')['tv|genre'][0]
+    plugin.TVMovieBrowser(None, mediaType='tv', filterType='genre', filterUrl=filterUrl, filterName=filterName)
+
+  def BrowseShows():
+    for showId in sampleTv:
+      seasons = plugin.ShowBrowserTV(None, showId=showId, showName=showId)
+      plugin.ShowBrowserTV(None, showId=showId, showName=showId, selectedSeasonId=seasons.items[-1].kwargs['selectedSeasonId'])
+
+  def BrowseMovies():
+    for showId in sampleMovies:
+      plugin.ShowBrowserMovies(None, showId=showId, showName=showId)
+
+  def Top5():
+    for mediaType in ('tv', 'movies', 'trailers'):
+      plugin.Top5Browser(None, mediaType=mediaType)
+
+  def SearchShows():
+    for query in ('show', 'show 1', 'episode', 'nbc', 'zzz'):
+      plugin.SearchResults(None, query=query)
+
+  def Play():
+    for url in videoUrls:
+      plugin.PlayVideo(None, url=url)
+
+  return [
+    ('UpdateCache (cold)', Cold, plugin.UpdateCache),
+    ('UpdateCache (unchanged)', Crawled, plugin.UpdateCache),
+    ('GetShowMetadata (%d shows)' % len(tvIds), NoMetadata, lambda: plugin.GetShowMetadata(tvIds)),
+    ('GetAssetMetadata (%d assets)' % len(assetIds), NoMetadata, lambda: plugin.GetAssetMetadata(assetIds)),
+    ('TVMovieBrowser (all tv)', NoResponses, BrowseAll('tv')),
+    ('TVMovieBrowser (all tv, cached)', Crawled, BrowseAll('tv')),
+    ('TVMovieBrowser (all movies)', NoResponses, BrowseAll('movies')),
+    ('TVMovieBrowser (genre)', NoResponses, BrowseGenre),
+    ('ShowBrowserTV (%d shows, cold)' % len(sampleTv), NoPageCaches, BrowseShows),
+    ('ShowBrowserTV (%d shows, restarted)' % len(sampleTv), Restarted, BrowseShows),
+    ('ShowBrowserTV (%d shows, warm)' % len(sampleTv), Crawled, BrowseShows),
+    ('ShowBrowserMovies (%d movies, cold)' % len(sampleMovies), NoPageCaches, BrowseMovies),
+    ('ShowBrowserMovies (%d movies, restarted)' % len(sampleMovies), Restarted, BrowseMovies),
+    ('ShowBrowserMovies (%d movies, warm)' % len(sampleMovies), Crawled, BrowseMovies),
+    ('Top5Browser', Crawled, Top5),
+    ('SearchResults (5 queries)', Crawled, SearchShows),
+    ('PlayVideo (%d videos, cold)' % len(videoUrls), NoAspects, Play),
+    ('PlayVideo (%d videos, warm)' % len(videoUrls), Crawled, Play),
+    # Last, as it leaves the dictionary as restored from the snapshot
+    ('Start and first menu (from snapshot)', WipedDict, StartAndMenu),
+  ]
+
+######
+# Measurement
+
+def Measure(setup, run, repeat):
+  # Returns the median wall and parse times over repeat runs, the growth in rss during the first
+  # and the peak memory of one more traced run
+
+  walls = []
+  parses = []
+  for i in range(repeat):
+    setup()
+    if i == 0:
+      sampler = RSSSampler()
+    before = PMS.ParseStats()['parseTime']
+    start = time.perf_counter()
+    run()
+    walls.append(time.perf_counter() - start)
+    parses.append(PMS.ParseStats()['parseTime'] - before)
+    if i == 0:
+      rss = sampler.Stop()
+
+  setup()
+  tracemalloc.start()
+  try:
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+  finally:
+    tracemalloc.stop()
+
+  return {'wall': Median(walls), 'parse': Median(parses), 'peak': peak, 'rss': rss}
+
+class RSSSampler(object):
+  # Samples the resident set size on a background thread until stopped, Stop() returns the largest growth seen
+
+  def __init__(self, interval=0.002):
+    self.interval = interval
+    self.start = self.peak = RSS()
+    self.stopped = threading.Event()
+    self.thread = threading.Thread(target=self.Sample)
+    self.thread.daemon = True
+    self.thread.start()
+
+  def Sample(self):
+    while not self.stopped.is_set():
+      self.peak = max(self.peak, RSS())
+      self.stopped.wait(self.interval)
+
+  def Stop(self):
+    self.stopped.set()
+    self.thread.join()
+    self.peak = max(self.peak, RSS())
+    return self.peak - self.start
+
+def RSS():
+  # Returns the resident set size in bytes, or 0 where /proc isn't available
+  try:
+    statm = open('/proc/self/statm')
+  except IOError:
+    return 0
+  try:
+    return int(statm.read().split()[1]) * PAGE_SIZE
+  finally:
+    statm.close()
+
+def Median(values):
+  values = sorted(values)
+  return values[len(values) // 2]
+
+def Regressions(results, baseline, tolerance):
+  # Returns a line for each benchmark whose wall time or peak memory exceeds the baseline by more than tolerance
+  lines = []
+  for name, result in results.items():
+    if name not in baseline:
+      continue
+    for metric in ('wall', 'peak'):
+      before = baseline[name][metric]
+      if before > 0 and result[metric] > before * (1 + tolerance):
+        lines.append("%s: %s %.4g -> %.4g (+%d%%)" % (name, metric, before, result[metric], 100 * (result[metric] / before - 1)))
+  return lines
+
+######
+
+def Main():
+  parser = argparse.ArgumentParser(description='Offline benchmarks for the Fancast plugin')
+  parser.add_argument('--shows', type=int, default=2000, help='number of tv shows on the site')
+  parser.add_argument('--movies', type=int, default=1000, help='number of movies on the site')
+  parser.add_argument('--trailers', type=int, default=200, help='number of trailers on the site')
+  parser.add_argument('--seasons', type=int, default=3, help='seasons per tv show')
+  parser.add_argument('--episodes', type=int, default=12, help='episodes per season')
+  parser.add_argument('--padding', type=int, default=20000, help='bytes of filler on each page')
+  parser.add_argument('--assets', type=int, default=500, help='number of assets for GetAssetMetadata')
+  parser.add_argument('--sample', type=int, default=20, help='number of shows / movies / videos opened by the menu benchmarks')
+  parser.add_argument('--repeat', type=int, default=3, help='timed runs of each benchmark')
+  parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fixture response')
+  parser.add_argument('--rate-limit', action='store_true', help="keep the fetch engines' rate limits")
+  parser.add_argument('--only', help='only run benchmarks whose name contains this')
+  parser.add_argument('--json', action='store_true', help='print the results as json')
+  parser.add_argument('--baseline', help='json results to compare with')
+  parser.add_argument('--tolerance', type=float, default=0.2, help='allowed increase over the baseline, 0.2 is 20%%')
+  options = parser.parse_args()
+
+  siteOptions = {'shows': options.shows, 'movies': options.movies, 'trailers': options.trailers,
+    'seasons': options.seasons, 'episodes': options.episodes, 'padding': options.padding}
+  process, proxy = FixtureServer.Start(siteOptions, latency=options.latency)
+  try:
+    plugin = Harness.LoadPlugin(proxy, rateLimit=options.rate_limit)
+    # Background prefetches would warm the pages the cold cases measure
+    plugin.PREFETCH = False
+    site = Fixtures.Site(**siteOptions)
+
+    results = {}
+    if not options.json:
+      print("%-40s %10s %10s %10s %10s" % ('benchmark', 'wall (s)', 'parse (s)', 'peak (MB)', 'rss (MB)'))
+    for name, setup, run in Benchmarks(plugin, site, options):
+      if options.only and options.only not in name:
+        continue
+      results[name] = Measure(setup, run, options.repeat)
+      if not options.json:
+        result = results[name]
+        print("%-40s %10.3f %10.3f %10.1f %10.1f" % (name, result['wall'], result['parse'], result['peak'] / 1048576.0, result['rss'] / 1048576.0))
+        sys.stdout.flush()
+  finally:
+    process.terminate()
+
+  if options.json:
+    print(json.dumps(results, indent=2, sort_keys=True))
+
+  if options.baseline:
+    regressions = Regressions(results, json.load(open(options.baseline)), options.tolerance)
+    for line in regressions:
+      sys.stderr.write("Regression: %s\n" % line)
+    if regressions:
+      sys.exit(1)
+
+if __name__ == '__main__':
+  Main()
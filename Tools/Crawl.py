@@ -0,0 +1,322 @@
+# Crawls fancast.com outside PMS (Python 3) and writes a snapshot for the plugin to import, see SNAPSHOT_IMPORT_PATH
+#
+# Pages are fetched with asyncio, up to --connections at once, and parsed in a pool of --processes worker processes
+# so the crawl can use every core of a bigger machine, leaving the media server idle
+# Extraction is shared with the plugin (Contents/Code/Extract.py). The snapshot (see Snapshot.py) holds the listings,
+# Top 5 lists and metadata store, and with --episodes the parsed full-episodes pages of the tv shows, which are stored
+# as the plugin's episode records. The plugin builds its browse index from it when importing
+# The snapshot is written next to --output and renamed over it, so the plugin never reads one that is half written
+#
+#   python Tools/Crawl.py --output /path/to/fancast.snapshot
+#   python Tools/Crawl.py --proxy 127.0.0.1:8080 --output fancast.snapshot   # against a local mirror
+#
+# Requires lxml
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import concurrent.futures
+from urllib.parse import urlsplit
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+CODE_DIR = os.path.join(os.path.dirname(TOOLS_DIR), 'Contents', 'Code')
+if CODE_DIR not in sys.path:
+  sys.path.insert(0, CODE_DIR)
+
+from lxml import html, etree
+
+import Fetch
+import Store
+import Extract
+import Snapshot
+from Support import Fingerprint
+
+# As in Contents/Code/__init__.py
+FANCAST_URL = "http://www.fancast.com"
+FANCAST_TV_WIDGET = "http://www.fancast.com/full_episodes_fragment.widget"
+FANCAST_MOVIES_WIDGET = "http://www.fancast.com/movies_fragment.widget"
+FANCAST_TRAILERS_URL = "http://www.fancast.com/trailers"
+TOP5_DIVS = {'tv': 'playlistTabBody0', 'movies': 'playlistTabBody1', 'trailers': 'playlistTabBody2'}
+HIDDEN_NETWORKS = ['ABC', 'CW']
+HIDE_PROTECTED_PROVIDERS = True
+FAILURE_RETRY_DELAY = 3600
+FAILURE_RETRY_MAX = 604800
+
+
+######
+# Parsing, run in the worker processes
+# Each takes a page's source and returns plain values, so only text crosses between processes
+
+def ParseListing(url, body):
+  page = html.fromstring(body)
+  listing = {'showIds': Extract.ShowIds(page, url == FANCAST_TRAILERS_URL, None, HIDE_PROTECTED_PROVIDERS), 'newEpisodeIds': [], 'filters': {}, 'trailerUrls': {}}
+  if url == FANCAST_TV_WIDGET:
+    listing['newEpisodeIds'] = Extract.ShowIds(page, False, 'new', HIDE_PROTECTED_PROVIDERS)
+    listing['filters']['genre'] = Extract.Filters(page, 'genre', FANCAST_URL, HIDDEN_NETWORKS)
+    listing['filters']['network'] = Extract.Filters(page, 'network', FANCAST_URL, HIDDEN_NETWORKS)
+  elif url == FANCAST_MOVIES_WIDGET:
+    listing['filters']['genre'] = Extract.Filters(page, 'genre', FANCAST_URL, HIDDEN_NETWORKS)
+  elif url == FANCAST_TRAILERS_URL:
+    listing['trailerUrls'] = Extract.TrailerUrls(page, FANCAST_URL)
+  return listing
+
+def ParseShow(showId, body):
+  record, errors = Extract.Show(html.fromstring(body), showId)
+  return (record, [(field, str(error)) for field, error in errors])
+
+def ParseAsset(assetId, body):
+  record, errors = Extract.Asset(body, assetId, FANCAST_URL, etree.fromstring)
+  return (record, [(field, str(error)) for field, error in errors])
+
+def ParseEpisodes(body):
+  # The seasons as plain lists, as they are put in the snapshot
+  return Extract.Dump(Extract.Episodes(html.fromstring(body), FANCAST_URL))
+
+def ParseTop5(body):
+  return Extract.Top5(html.fromstring(body), TOP5_DIVS, FANCAST_URL)
+
+
+######
+# Fetching
+
+class Fetcher(object):
+  # A minimal asyncio HTTP/1.1 client, one connection per request, with retries as in Fetch.FetchEngine
+
+  def __init__(self, connections, retries, backoff, timeout, proxy=None):
+    self.slots = asyncio.Semaphore(connections)
+    self.retries = retries
+    self.backoff = backoff
+    self.timeout = timeout
+    self.proxy = proxy
+    self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'bytes': 0}
+
+  async def Get(self, url):
+    # Returns (headers, body) for url, raising Fetch.FetchError unless it answers 200 OK
+    # Only http and https urls are fetched, as by Fetch.FetchEngine
+    scheme = urlsplit(url).scheme
+    if scheme not in ('http', 'https'):
+      raise Fetch.FetchError(url, "unsupported scheme '%s'" % scheme)
+    attempt = 0
+    while True:
+      attempt = attempt + 1
+      try:
+        async with self.slots:
+          status, headers, body = await asyncio.wait_for(self.Exchange(url), self.timeout)
+        error = "HTTP status %d" % status
+      except (OSError, asyncio.TimeoutError, ValueError):
+        status = None
+        error = str(sys.exc_info()[1]) or sys.exc_info()[0].__name__
+      self.stats['requests'] = self.stats['requests'] + 1
+
+      if status == 200:
+        self.stats['bytes'] = self.stats['bytes'] + len(body)
+        return (headers, body.decode(Charset(headers.get('content-type')), 'replace'))
+      if (status != None and status not in Fetch.RETRY_STATUSES) or attempt > self.retries:
+        self.stats['failures'] = self.stats['failures'] + 1
+        raise Fetch.FetchError(url, "%s after %d attempts" % (error, attempt), status)
+
+      self.stats['retries'] = self.stats['retries'] + 1
+      await asyncio.sleep(self.backoff * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+
+  async def Exchange(self, url):
+    parts = urlsplit(url)
+    path = parts.path or '/'
+    if parts.query:
+      path = path + '?' + parts.query
+    connectTo = parts.netloc
+    secure = parts.scheme == 'https'
+    if self.proxy:
+      # Proxies (eg a local mirror) are spoken to in plain http and take the absolute url
+      connectTo = self.proxy
+      secure = False
+      path = url
+    host, port = (connectTo.split(':') + [secure and '443' or '80'])[:2]
+
+    reader, writer = await asyncio.open_connection(host, int(port), ssl=secure or None, server_hostname=secure and host or None)
+    try:
+      writer.write(('GET %s HTTP/1.1\r\nHost: %s\r\nUser-Agent: %s\r\nConnection: close\r\nAccept-Encoding: identity\r\n\r\n' % (path, parts.netloc, Fetch.USER_AGENT)).encode('latin-1'))
+      await writer.drain()
+      response = await reader.read()
+    finally:
+      writer.close()
+
+    head, separator, body = response.partition(b'\r\n\r\n')
+    if not separator:
+      raise ValueError('incomplete response')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ')[1])
+    headers = {}
+    for line in lines[1:]:
+      name, value = line.split(':', 1)
+      headers[name.strip().lower()] = value.strip()
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+      body = Dechunk(body)
+    return (status, headers, body)
+
+def Dechunk(body):
+  chunks = []
+  while True:
+    size, separator, body = body.partition(b'\r\n')
+    size = int(size.split(b';')[0], 16)
+    if size == 0:
+      return b''.join(chunks)
+    chunks.append(body[:size])
+    body = body[size + 2:]
+
+def Charset(contentType):
+  if contentType and 'charset=' in contentType:
+    return contentType.split('charset=')[-1].split(';')[0].strip()
+  return 'utf-8'
+
+
+######
+# Crawl
+
+class Crawler(object):
+
+  def __init__(self, fetcher, pool, episodes):
+    self.fetcher = fetcher
+    self.pool = pool
+    self.episodes = episodes
+    self.store = Store.MetadataStore()
+    self.listings = {}
+    self.top5 = {}
+    self.seasons = {}
+
+  async def Parse(self, function, *args):
+    return await asyncio.get_event_loop().run_in_executor(self.pool, function, *args)
+
+  async def Run(self):
+    # The three listings, then every filter listing they name
+    await asyncio.gather(*[self.Listing(url) for url in (FANCAST_TV_WIDGET, FANCAST_MOVIES_WIDGET, FANCAST_TRAILERS_URL)])
+    filterUrls = []
+    for url in list(self.listings.keys()):
+      for filterType, availableFilters in self.listings[url]['filters'].items():
+        filterUrls = filterUrls + [filterUrl for filterName, filterUrl in availableFilters]
+    await asyncio.gather(*[self.Listing(url) for url in filterUrls])
+
+    # The Top 5 assets and every listed show, then the episode lists if wanted
+    showIds = []
+    for listing in self.listings.values():
+      showIds = showIds + listing['showIds']
+    await asyncio.gather(self.Top5(), *[self.Show(showId) for showId in Unique(showIds)])
+    if self.episodes:
+      await asyncio.gather(*[self.Episodes(showId) for showId in Unique(showIds) if showId.startswith('/tv/')])
+
+  async def Listing(self, url):
+    try:
+      headers, body = await self.fetcher.Get(url)
+    except Fetch.FetchError:
+      Log("Failed to fetch listing %s" % sys.exc_info()[1])
+      return
+    listing = await self.Parse(ParseListing, url, body)
+    listing.update({'etag': headers.get('etag'), 'lastModified': headers.get('last-modified'),
+      'bodyHash': Fingerprint([body]), 'fingerprint': Fingerprint(listing['showIds'])})
+    self.listings[url] = listing
+
+  async def Top5(self):
+    try:
+      headers, body = await self.fetcher.Get(FANCAST_URL)
+    except Fetch.FetchError:
+      Log("Failed to fetch the Top 5 %s" % sys.exc_info()[1])
+      return
+    top5 = await self.Parse(ParseTop5, body)
+    assetIds = Unique([assetId for ids in top5.values() for assetId in ids])
+    await asyncio.gather(*[self.Asset(assetId) for assetId in assetIds])
+    for mediaType, ids in top5.items():
+      # Assets whose metadata couldn't be fetched are left out, as in the plugin
+      self.top5[mediaType] = {'updatedAt': time.time(), 'assetIds': [id for id in ids if self.store.HasAsset(id)]}
+
+  async def Show(self, showId):
+    await self.Record('show', showId, FANCAST_URL + showId + 'photos', ParseShow, self.store.PutShow)
+
+  async def Asset(self, assetId):
+    await self.Record('asset', assetId, FANCAST_URL + assetId + '/videos', ParseAsset, self.store.PutAsset)
+
+  async def Record(self, kind, id, url, parse, put):
+    # Fetches and extracts the record for a show or asset, noting a failure in the store as the plugin does
+    now = time.time()
+    try:
+      headers, body = await self.fetcher.Get(url)
+      record, errors = await self.Parse(parse, id, body)
+    except Exception:
+      excInfo = sys.exc_info()
+      self.store.Fail(kind, id, excInfo[0].__name__, str(excInfo[1]), now, FAILURE_RETRY_DELAY, FAILURE_RETRY_MAX)
+      return
+    record.fetchedAt = record.listedAt = now
+    put(id, record)
+    if errors:
+      message = '; '.join(["%s: %s" % (field, error) for field, error in errors])
+      self.store.Fail(kind, id, 'ExtractError', message, now, FAILURE_RETRY_DELAY, FAILURE_RETRY_MAX, partial=True)
+
+  async def Episodes(self, showId):
+    try:
+      headers, body = await self.fetcher.Get(FANCAST_URL + showId + 'full-episodes')
+      self.seasons[showId] = await self.Parse(ParseEpisodes, body)
+    except Exception:
+      Log("Failed to fetch the episodes of %s: %s" % (showId, sys.exc_info()[1]))
+
+  def State(self):
+    state = {'listings': self.listings, 'top5': self.top5, 'metadataStore': self.store.Dump()}
+    if self.episodes:
+      state['episodes'] = self.seasons
+    return state
+
+def Unique(ids):
+  seen = set()
+  return [id for id in ids if not (id in seen or seen.add(id))]
+
+def Log(message):
+  sys.stderr.write(message + "\n")
+
+def WriteSnapshot(path, state):
+  # Writes the snapshot to a temporary file beside path and renames it into place, returns its size
+  blob = Snapshot.Dump(state, time.time())
+  temporary = "%s.%d.tmp" % (path, os.getpid())
+  output = open(temporary, 'wb')
+  try:
+    output.write(blob)
+    output.flush()
+    os.fsync(output.fileno())
+  finally:
+    output.close()
+  os.replace(temporary, path)
+  return len(blob)
+
+######
+
+def Main():
+  parser = argparse.ArgumentParser(description='Crawls fancast.com and writes a snapshot for the Fancast plugin to import')
+  parser.add_argument('--output', required=True, help='the snapshot file to write')
+  parser.add_argument('--proxy', help="'host:port' of a proxy or local mirror to send every request through")
+  parser.add_argument('--connections', type=int, default=32, help='concurrent requests')
+  parser.add_argument('--processes', type=int, default=os.cpu_count() or 1, help='worker processes parsing pages')
+  parser.add_argument('--retries', type=int, default=3, help='times a request is retried after a transient error')
+  parser.add_argument('--backoff', type=float, default=1.0, help='base delay (seconds) before a retry')
+  parser.add_argument('--timeout', type=float, default=30, help='seconds allowed for each request')
+  parser.add_argument('--episodes', action='store_true', help="also crawl the tv shows' episode lists")
+  options = parser.parse_args()
+
+  started = time.time()
+  pool = concurrent.futures.ProcessPoolExecutor(options.processes)
+  try:
+    async def Crawl():
+      fetcher = Fetcher(options.connections, options.retries, options.backoff, options.timeout, options.proxy)
+      crawler = Crawler(fetcher, pool, options.episodes)
+      await crawler.Run()
+      return (fetcher, crawler)
+    fetcher, crawler = asyncio.run(Crawl())
+  finally:
+    pool.shutdown()
+
+  size = WriteSnapshot(options.output, crawler.State())
+  counts = crawler.store.Counts()
+  Log("Crawled %d listings, %d shows and %d assets (%d failing) with %d requests (%d retries, %d failed, %d bytes) in %.1fs, wrote %d bytes to %s"
+    % (len(crawler.listings), counts['shows'], counts['assets'], counts['failures'], fetcher.stats['requests'], fetcher.stats['retries'],
+       fetcher.stats['failures'], fetcher.stats['bytes'], time.time() - started, size, options.output))
+
+if __name__ == '__main__':
+  Main()
@@ -0,0 +1,101 @@
+# Local HTTP server serving the fixture pages (see Fixtures.py) in place of www.fancast.com
+#
+# It behaves as an HTTP proxy, requests may use the absolute url (as the plugin's fetch engines and urllib do when given a proxy)
+# or just the path. Responses carry an ETag and conditional requests are answered with 304 Not Modified
+# latency adds a delay to every response and errorRate the fraction of requests answered with 503, to exercise retries
+#
+# Start() runs the server in a separate process so its work doesn't count towards the timings and memory of the process under test
+
+import sys
+import time
+import socket
+import random
+import hashlib
+import threading
+import multiprocessing
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import Fixtures
+
+
+class FixtureServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+  def __init__(self, site, port=0, latency=0.0, errorRate=0.0):
+    HTTPServer.__init__(self, ('127.0.0.1', port), FixtureHandler)
+    self.site = site
+    self.latency = latency
+    self.errorRate = errorRate
+    self.lock = threading.Lock()
+    self.hits = 0
+
+  def handle_error(self, request, clientAddress):
+    # Clients routinely hang up part way through a response (eg the engines' partial reads), that isn't worth reporting
+    if not isinstance(sys.exc_info()[1], (ConnectionError, socket.timeout)):
+      HTTPServer.handle_error(self, request, clientAddress)
+
+
+class FixtureHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+  # Headers and body are written separately, without this each response can wait on a delayed ack
+  disable_nagle_algorithm = True
+
+  def log_message(self, format, *args):
+    pass
+
+  def do_GET(self):
+    server = self.server
+    server.lock.acquire()
+    try:
+      server.hits = server.hits + 1
+    finally:
+      server.lock.release()
+
+    url = self.path
+    if not url.startswith('http'):
+      url = Fixtures.FANCAST_URL + url
+
+    if server.latency:
+      time.sleep(server.latency)
+
+    body = server.site.Page(url)
+    if body == None:
+      self.Reply(404)
+      return
+    if server.errorRate and random.random() < server.errorRate:
+      self.Reply(503)
+      return
+
+    contentType = 'image/jpeg'
+    if not isinstance(body, bytes):
+      body = body.encode('utf-8')
+      contentType = 'text/html; charset=utf-8'
+    etag = '"%s"' % hashlib.md5(body).hexdigest()
+    if self.headers.get('If-None-Match') == etag:
+      self.Reply(304, {'ETag': etag})
+      return
+    self.Reply(200, {'ETag': etag, 'Content-Type': contentType}, body)
+
+  def Reply(self, status, headers={}, body=b''):
+    self.send_response(status)
+    for name, value in headers.items():
+      self.send_header(name, value)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+
+def Serve(siteOptions, latency, errorRate, ports):
+  server = FixtureServer(Fixtures.Site(**siteOptions), latency=latency, errorRate=errorRate)
+  ports.put(server.server_address[1])
+  server.serve_forever()
+
+def Start(siteOptions, latency=0.0, errorRate=0.0):
+  # Starts a fixture server for Fixtures.Site(**siteOptions) in a child process
+  # Returns (process, 'host:port'), terminate the process when done
+  ports = multiprocessing.Queue()
+  process = multiprocessing.Process(target=Serve, args=(siteOptions, latency, errorRate, ports))
+  process.daemon = True
+  process.start()
+  return (process, '127.0.0.1:%d' % ports.get(timeout=30))
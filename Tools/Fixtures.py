@@ -0,0 +1,201 @@
+# Fixture pages for running the Fancast plugin offline
+#
+# fancast.com can no longer be recorded, so these pages reproduce the markup of each page type the plugin reads
+# (widgets, trailers, photos, full-episodes, full-movie, about, videos, asset and front pages)
+# as used by the extraction code in Contents/Code. The number of shows, seasons and episodes can be scaled up freely
+#
+# Site.Page(url) returns the body for any fancast url, or None for a url the site wouldn't have
+# Images (any url on images.fancast.com) are returned as bytes, every other page as text
+
+import re
+
+NETWORKS = ['NBC', 'FOX', 'ABC-Entertainment', 'Comedy-Central', 'CW-Television-Network', 'SyFy']
+NETWORK_FILTERS = ['NBC', 'FOX', 'ABC', 'Comedy Central', 'CW', 'SyFy']
+GENRES = ['Comedy', 'Drama', 'Reality', 'Kids', 'Action', 'Documentary']
+
+FANCAST_URL = 'http://www.fancast.com'
+IMAGES_URL = 'http://images.fancast.com'
+TV_WIDGET = '/full_episodes_fragment.widget'
+MOVIES_WIDGET = '/movies_fragment.widget'
+
+
+class Site(object):
+
+  def __init__(self, shows=200, movies=100, trailers=50, seasons=3, episodes=12, padding=20000, imageSize=30000):
+    # padding is the number of bytes of filler (scripts, navigation etc) added to each page, as on the real site
+    # imageSize is the size in bytes of every image
+    self.shows = shows
+    self.movies = movies
+    self.trailers = trailers
+    self.seasons = seasons
+    self.episodes = episodes
+    self.padding = padding
+    self.imageSize = imageSize
+    # Bump version to change every page's content, eg to exercise change detection
+    self.version = 0
+
+  ######
+  # Ids
+
+  def ShowIds(self, kind, count):
+    offset = 1000
+    if kind == 'movies':
+      offset = 500000
+    return ['/%s/%s-%d/%d/' % (kind, kind.capitalize(), i, offset + i) for i in range(count)]
+
+  def Index(self, showId):
+    return int(re.search(r'-(\d+)/', showId).group(1))
+
+  def Filler(self):
+    return '<script type="text/javascript">/* %s */</script>' % ('x' * self.padding)
+
+  ######
+  # Pages
+
+  def Widget(self, kind, genre=None, network=None):
+    if kind == 'tv':
+      base, count = TV_WIDGET, self.shows
+    else:
+      base, count = MOVIES_WIDGET, self.movies
+
+    out = ['<html><head><title>Fancast</title>', self.Filler(), '</head><body><div id="filters">']
+    out.append('<div class="FilterbyGenre"><ul><li class="selected"><a href="#">All</a></li>')
+    for name in GENRES:
+      out.append('<li><a href="#" onclick="filterEpList(\'%s?genre=%s\')">%s</a></li>' % (base, name, name))
+    out.append('</ul></div>')
+    if kind == 'tv':
+      out.append('<div class="FilterbyNetwork"><ul><li class="selected"><a href="#">All</a></li>')
+      for name in NETWORK_FILTERS:
+        out.append('<li><a href="#" onclick="filterEpList(\'%s?network=%s\')">%s</a></li>' % (base, name.replace(' ', '-'), name))
+      out.append('</ul></div>')
+    out.append('</div><div class="fullEpisodeList">')
+
+    for column in range(3):
+      out.append('<div class="column"><ul>')
+      for i, showId in enumerate(self.ShowIds(kind, count)):
+        if i % 3 != column:
+          continue
+        if genre and GENRES[i % len(GENRES)] != genre:
+          continue
+        if network and NETWORK_FILTERS[i % len(NETWORKS)].replace(' ', '-') != network:
+          continue
+        attributes = ''
+        if kind == 'movies' and i % 7 == 6:
+          attributes = ' class="protectedStarz"'
+        if kind == 'tv' and i % 5 == 0:
+          out.append('<li%s><div class="newEpisode"><a href="%s">Show %d</a><span>New</span></div></li>' % (attributes, showId, i))
+        else:
+          out.append('<li%s><a href="%s">Show %d</a></li>' % (attributes, showId, i))
+      out.append('</ul></div>')
+
+    out.append('</div></body></html>')
+    return ''.join(out)
+
+  def Trailers(self):
+    out = ['<html><head>', self.Filler(), '</head><body><div id="episodeList"><ul class="fullEpisodeList"><li class="head">Title</li>']
+    for i, showId in enumerate(self.ShowIds('movies', self.trailers)):
+      out.append('<li><a href="%s%d/videos">Trailer %d</a></li>' % (showId, 900000 + i, i))
+    out.append('</ul></div></body></html>')
+    return ''.join(out)
+
+  def Photos(self, showId):
+    i = self.Index(showId)
+    network = NETWORKS[i % len(NETWORKS)]
+    swoosh = ''
+    if i % 11 != 10:
+      swoosh = '<div id="swoosh"><a href="/tv-networks/%s/%d/">%s</a></div>' % (network, 40 + i % len(NETWORKS), network)
+    return ('<html><head>%s</head><body><div id="pageHeadline"><h1><span class="title">\n    Show %d (v%d)  \n</span></h1></div>'
+      '<div id="listHolder"><ul id="viewTable"><li><a href="#"><img src="http://images.fancast.com/121_87/%d.jpg"/></a></li>'
+      '<li><a href="#"><img src="http://images.fancast.com/121_87/%d-2.jpg"/></a></li></ul></div>%s</body></html>'
+      % (self.Filler(), i, self.version, i, i, swoosh))
+
+  def FullEpisodes(self, showId):
+    out = ['<html><head>', self.Filler(), '</head><body><div id="listHolder"><ul><li class="seasonsMenu"><select name="seasons"><option value="all">All Seasons</option>']
+    for season in range(self.seasons):
+      out.append('<option value="season%d">\n   Season %d  \n</option>' % (season + 1, season + 1))
+    out.append('</select></li></ul>')
+    for season in range(self.seasons):
+      out.append('<div id="season%d"><table class="videoList fourColumn"><tr class="newEpHeader"><td>New</td></tr>' % (season + 1))
+      for episode in range(self.episodes):
+        out.append('<tr><td class="first"><a href="%s%d/videos"><img src="http://images.fancast.com/episodes/%d_%d.jpg"/><span>%d:%02d)</span></a>'
+          '<a href="%s%d/videos">\n  Episode %d  \n</a><p>What happens in episode %d.</p></td>'
+          '<td class="two">S%d | Ep%d</td><td class="three">  %02d/%02d/2009 </td></tr>'
+          % (showId, 700000 + season * 1000 + episode, season, episode, 20 + episode % 20, episode % 60,
+             showId, 700000 + season * 1000 + episode, episode + 1, episode + 1, season + 1, episode + 1, 1 + season, 1 + episode % 28))
+      out.append('</table></div>')
+    out.append('</div></body></html>')
+    return ''.join(out)
+
+  def FullMovie(self, showId):
+    i = self.Index(showId)
+    return ('<html><head>%s</head><body><div id="pageHeadline"><h1><span class="title">Movie %d</span><span class="meta"> (2009) PG-13 </span></h1></div>'
+      '<table class="videoList twoColumn"><tr><td class="first"><a href="%s%d/videos"><img src="http://images.fancast.com/movies/%d.jpg"/><span>1:%02d:10)</span></a>'
+      '<a href="%s%d/videos">  Movie %d  </a></td><td class="two">Full Movie</td></tr></table></body></html>'
+      % (self.Filler(), i, showId, 600000 + i, i, i % 60, showId, 600000 + i, i))
+
+  def About(self, showId):
+    i = self.Index(showId)
+    return ('<html><head>%s</head><body><div id="leftcontent"><div class="clearfix"><p>All about movie %d.</p></div></div>'
+      '<div id="thumbNail"><span><img src="http://images.fancast.com/movies/%d-large.jpg"/></span></div></body></html>'
+      % (self.Filler(), i, i))
+
+  def Videos(self, assetId):
+    # The asset page, used both for its video.playerData (GetAssetMetadata) and its head (PlayVideo)
+    i = int(re.search(r'(\d+)/videos$', assetId).group(1))
+    width, height = (('640', '480'), ('640', '360'), ('1,280', '544'))[i % 3]
+    return ('<html><head><title>Video</title><meta name="video_width" content="%s"/><meta name="video_height" content="%s"/></head>'
+      '<body>%s<script type="text/javascript">video.playerData = "<entity><imageUrl>http://images.fancast.com/assets/%d.jpg</imageUrl>'
+      '<metadata><entityName>Show %d</entityName><videoTitle>Episode %d</videoTitle><description>What happens in episode %d.</description>'
+      '<duration>%d:%02d</duration><airDate>01/%02d/2009</airDate><season>%d</season><episode>%d</episode></metadata></entity>";</script></body></html>'
+      % (width, height, self.Filler(), i, i % 100, i, i, 20 + i % 20, i % 60, 1 + i % 28, 1 + i % 5, 1 + i % 22))
+
+  def Image(self, url):
+    # Not a real jpeg, just the header and the url repeated up to imageSize, so every image is distinct
+    body = b'\xff\xd8\xff\xe0' + url.encode('utf-8')
+    return (body * (self.imageSize // len(body) + 1))[:self.imageSize]
+
+  def FrontPage(self):
+    out = ['<html><head>', self.Filler(), '</head><body>']
+    for tab, kind in enumerate(('tv', 'movies', 'movies')):
+      out.append('<div id="playlistTabBody%d"><ol>' % tab)
+      for i, showId in enumerate(self.ShowIds(kind, 5)):
+        out.append('<li><a href="%s%s%d/videos">Top %d</a></li>' % (FANCAST_URL, showId, 800000 + tab * 10 + i, i + 1))
+      out.append('</ol></div>')
+    out.append('</body></html>')
+    return ''.join(out)
+
+  ######
+  # Routing
+
+  def Page(self, url):
+    if url.startswith(IMAGES_URL + '/'):
+      return self.Image(url)
+
+    path = url
+    if path.startswith(FANCAST_URL):
+      path = path[len(FANCAST_URL):]
+
+    match = re.match(r'^(%s|%s)(?:\?(genre|network)=(.*))?$' % (re.escape(TV_WIDGET), re.escape(MOVIES_WIDGET)), path)
+    if match:
+      kind = 'movies'
+      if match.group(1) == TV_WIDGET:
+        kind = 'tv'
+      filters = {}
+      if match.group(2):
+        filters[match.group(2)] = match.group(3)
+      return self.Widget(kind, **filters)
+
+    if path == '/trailers':
+      return self.Trailers()
+    if path in ('', '/'):
+      return self.FrontPage()
+
+    match = re.match(r'^(/(?:tv|movies)/[^/]+/\d+/)(photos|full-episodes|full-movie|about)$', path)
+    if match:
+      pages = {'photos': self.Photos, 'full-episodes': self.FullEpisodes, 'full-movie': self.FullMovie, 'about': self.About}
+      return pages[match.group(2)](match.group(1))
+
+    if re.match(r'^/(?:tv|movies)/[^/]+/\d+/\d+/videos$', path):
+      return self.Videos(path)
+
+    return None
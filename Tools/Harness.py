@@ -0,0 +1,62 @@
+# Loads the Fancast plugin outside PMS (Python 3), against the stub framework (PMS.py) and a fixture server (FixtureServer.py)
+#
+#   process, proxy = FixtureServer.Start({'shows': 2000})
+#   plugin = Harness.LoadPlugin(proxy)
+#
+# Every request the plugin makes, through the framework stubs or its own fetch engines, is sent to the fixture server
+
+import os
+import sys
+import importlib.util
+import urllib.request as urllib2
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+CODE_DIR = os.path.join(os.path.dirname(TOOLS_DIR), 'Contents', 'Code')
+
+# The stub framework must shadow any real one, the plugin's own modules come next
+for path in (CODE_DIR, TOOLS_DIR):
+  if path in sys.path:
+    sys.path.remove(path)
+  sys.path.insert(0, path)
+
+import PMS
+
+
+def LoadPlugin(proxy, rateLimit=False):
+  # Imports the plugin (as the module 'Fancast') and calls its Start()
+  # proxy is the 'host:port' of the fixture server
+  # Unless rateLimit is set the fetch engines' rate limits are lifted, so timings measure the plugin rather than the limiter
+
+  urllib2.install_opener(urllib2.build_opener(urllib2.ProxyHandler({'http': 'http://' + proxy})))
+
+  if 'Fancast' in sys.modules:
+    plugin = sys.modules['Fancast']
+  else:
+    spec = importlib.util.spec_from_file_location('Fancast', os.path.join(CODE_DIR, '__init__.py'))
+    plugin = importlib.util.module_from_spec(spec)
+    sys.modules['Fancast'] = plugin
+    spec.loader.exec_module(plugin)
+
+  for engine in (plugin.CrawlEngine, plugin.UserEngine):
+    engine.proxy = proxy
+    if not rateLimit:
+      engine.rate = 1000000.0
+      engine.burst = 1000000
+
+  plugin.Start()
+  return plugin
+
+def ResetPlugin(plugin):
+  # Returns the plugin and the framework stubs to a freshly installed state, no cache or stored metadata
+  PMS.Reset()
+  plugin.PageCache.Clear()
+  plugin.MovieCache.Clear()
+  plugin.ResponseCache.Clear()
+  plugin.AspectCache.Clear()
+  plugin.EpisodeCache.Clear()
+  plugin.Navigated()
+  plugin.MetaStore.Load(None)
+  plugin.ImageStore.Load(None)
+  plugin.RecordStore.Load(None)
+  plugin.imageCommittedAt = 0
+  plugin.Metrics.Reset()
@@ -0,0 +1,348 @@
+# Load generator for the Fancast plugin (Python 3)
+#
+# Simulates many clients browsing the plugin at once, optionally while the crawl runs, against generated fixture pages
+# (see Fixtures.py) served locally with configurable latency and errors, using the stub framework in PMS.py
+#
+# Each client thread replays navigation sessions, following the items of each menu as a Plex client would:
+#   MainMenu -> TVMovieMainMenu -> (TVMovieBrowser | TVMovieFilterSelector -> TVMovieBrowser) -> ShowBrowserTV / ShowBrowserMovies -> PlayVideo
+#   MainMenu -> TVMovieMainMenu -> Top5Browser -> PlayVideo
+#   MainMenu -> TrailerBrowser -> PlayVideo
+# with random choices at each step, and with --thumbs the thumbnails of the items listed are requested too
+#
+# For each phase it reports per handler the number of calls, errors and the p50 / p95 / p99 / max latency,
+# and overall throughput. Phases are run without the crawl, and with --crawl while the crawl runs in a loop
+# so the effect of crawl contention on interactive requests can be seen side by side
+# Both phases follow an unreported warm up, and start with empty in memory caches unless --warm is given
+#
+#   python Tools/Load.py --clients 20 --duration 30
+#   python Tools/Load.py --clients 50 --crawl full --latency 0.05 --error-rate 0.01
+#
+# Requires lxml
+
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+
+import Harness
+import FixtureServer
+import PMS
+
+
+######
+# Sessions
+
+class Recorder(object):
+  # Collects the latency of every handler call, thread safe
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.latencies = {}
+    self.errors = {}
+    self.sessions = 0
+
+  def Call(self, name, function, *args, **kwargs):
+    # Calls function, recording its latency under name, returns None if it raised
+    start = time.perf_counter()
+    try:
+      result = function(*args, **kwargs)
+      failed = False
+    except Exception:
+      result = None
+      failed = True
+    elapsed = time.perf_counter() - start
+    self.lock.acquire()
+    try:
+      self.latencies.setdefault(name, []).append(elapsed)
+      if failed:
+        self.errors[name] = self.errors.get(name, 0) + 1
+    finally:
+      self.lock.release()
+    return result
+
+  def SessionDone(self):
+    self.lock.acquire()
+    try:
+      self.sessions = self.sessions + 1
+    finally:
+      self.lock.release()
+
+class Client(object):
+  # One simulated client, Session() browses from the main menu down to a video
+
+  def __init__(self, plugin, recorder, rng, think, thumbs):
+    self.plugin = plugin
+    self.recorder = recorder
+    self.rng = rng
+    self.think = think
+    self.thumbs = thumbs
+
+  def Follow(self, item):
+    # Calls the handler behind a Function() item as the framework does for a client, returns what it returned
+    handler = item.item.key
+    if self.think:
+      time.sleep(self.rng.uniform(0, 2 * self.think))
+    return self.recorder.Call(handler.__name__, handler, None, **item.kwargs)
+
+  def Items(self, container, handlerName=None):
+    # The Function() items of a container, optionally only those for handlerName
+    items = getattr(container, 'items', None) or []
+    items = [item for item in items if isinstance(item, PMS.Function) and hasattr(item.item, 'key')]
+    if handlerName:
+      items = [item for item in items if getattr(item.item.key, '__name__', None) == handlerName]
+    return items
+
+  def Pick(self, container, handlerName=None):
+    items = self.Items(container, handlerName)
+    if not items:
+      return None
+    return self.rng.choice(items)
+
+  def FetchThumbs(self, container):
+    # Requests the thumbnails served by the plugin for the first items listed, as a client showing the list does
+    for item in self.Items(container)[:self.thumbs]:
+      thumb = item.item.attributes.get('thumb')
+      if isinstance(thumb, PMS.Function):
+        self.recorder.Call('Thumb', thumb.item, **thumb.kwargs)
+
+  def Open(self, item):
+    container = self.Follow(item)
+    if self.thumbs:
+      self.FetchThumbs(container)
+    return container
+
+  def Session(self):
+    mainMenu = self.recorder.Call('MainMenu', self.plugin.MainMenu)
+    trailersItem = self.Pick(mainMenu, 'TrailerBrowser')
+    if trailersItem != None and self.rng.random() < 0.1:
+      # Trailers, then play one of them
+      video = self.Pick(self.Open(trailersItem), 'PlayVideo')
+      if video != None:
+        self.Follow(video)
+      return
+
+    mediaMenu = self.Pick(mainMenu, 'TVMovieMainMenu')
+    if mediaMenu == None:
+      return
+    mediaMenu = self.Follow(mediaMenu)
+
+    choice = self.rng.random()
+    if choice < 0.2:
+      # Top 5, then play one of them
+      top5 = self.Open(self.Pick(mediaMenu, 'Top5Browser'))
+      video = self.Pick(top5, 'PlayVideo')
+      if video != None:
+        self.Follow(video)
+      return
+
+    if choice < 0.5:
+      # All shows, or new episodes
+      shows = self.Open(self.Pick(mediaMenu, 'TVMovieBrowser'))
+    else:
+      # By genre or network
+      filters = self.Follow(self.Pick(mediaMenu, 'TVMovieFilterSelector'))
+      filterItem = self.Pick(filters, 'TVMovieBrowser')
+      if filterItem == None:
+        return
+      shows = self.Open(filterItem)
+
+    # Sometimes look further down the list
+    while self.rng.random() < 0.2:
+      more = [item for item in self.Items(shows, 'TVMovieBrowser') if 'cursor' in item.kwargs]
+      if not more:
+        break
+      shows = self.Open(more[0])
+
+    show = self.Pick(shows, 'ShowBrowserTV') or self.Pick(shows, 'ShowBrowserMovies')
+    if show == None:
+      return
+    assets = self.Open(show)
+
+    # Multi season shows list their seasons first
+    season = self.Pick(assets, 'ShowBrowserTV')
+    if season != None and 'selectedSeasonId' in season.kwargs and not 'cursor' in season.kwargs:
+      assets = self.Open(season)
+
+    video = self.Pick(assets, 'PlayVideo')
+    if video != None:
+      self.Follow(video)
+
+  def Run(self, deadline):
+    while time.time() < deadline:
+      self.Session()
+      self.recorder.SessionDone()
+
+
+######
+# Crawl
+
+class CrawlLoop(object):
+  # Runs the crawl over and over on a background thread until stopped
+  # 'incremental' runs UpdateCache as scheduled, 'full' also refetches every listing and all metadata each time
+  # The plugin settings changed for 'full' are put back by Stop
+
+  # The settings a full crawl overrides
+  FULL = {'INCREMENTAL_UPDATE': False, 'REFRESH_MIN_AGE': 0, 'REFRESH_BUDGET_COUNT': 1000000, 'REFRESH_BUDGET_TIME': 1000000}
+
+  def __init__(self, plugin, mode):
+    self.plugin = plugin
+    self.mode = mode
+    self.saved = {}
+    self.stopping = threading.Event()
+    self.cycles = 0
+    self.thread = threading.Thread(target=self.Run)
+    self.thread.daemon = True
+
+  def Run(self):
+    while not self.stopping.is_set():
+      if self.mode == 'full':
+        self.plugin.MetaStore.Expire('show')
+        self.plugin.MetaStore.Expire('asset')
+      try:
+        self.plugin.UpdateCache()
+      except Exception:
+        sys.stderr.write("Crawl failed: %s\n" % sys.exc_info()[1])
+      self.cycles = self.cycles + 1
+
+  def Start(self):
+    if self.mode == 'full':
+      for name, value in self.FULL.items():
+        self.saved[name] = getattr(self.plugin, name)
+        setattr(self.plugin, name, value)
+    self.thread.start()
+
+  def Stop(self):
+    self.stopping.set()
+    self.thread.join()
+    for name, value in self.saved.items():
+      setattr(self.plugin, name, value)
+    self.saved = {}
+
+
+######
+# Phases and reporting
+
+def Percentile(values, fraction):
+  # values must be sorted
+  if not values:
+    return 0.0
+  return values[min(len(values) - 1, int(fraction * len(values)))]
+
+def RunPhase(plugin, options, crawlMode):
+  # Runs options.clients clients for options.duration seconds, with the crawl running unless crawlMode is None
+  # Returns the phase's results
+
+  if not options.warm:
+    # Every phase starts with the same empty in memory caches
+    plugin.ResponseCache.Clear()
+    plugin.PageCache.Clear()
+    plugin.MovieCache.Clear()
+    plugin.AspectCache.Clear()
+    plugin.EpisodeCache.Clear()
+
+  recorder = Recorder()
+  crawl = None
+  crawlRequests = plugin.CrawlEngine.Stats()['requests']
+  if crawlMode:
+    crawl = CrawlLoop(plugin, crawlMode)
+    crawl.Start()
+
+  started = time.time()
+  deadline = started + options.duration
+  threads = []
+  for index in range(options.clients):
+    client = Client(plugin, recorder, random.Random(options.seed + index), options.think, options.thumbs)
+    thread = threading.Thread(target=client.Run, args=(deadline,))
+    thread.start()
+    threads.append(thread)
+  for thread in threads:
+    thread.join()
+  elapsed = time.time() - started
+
+  cycles = 0
+  if crawl:
+    crawl.Stop()
+    cycles = crawl.cycles
+
+  handlers = {}
+  calls = 0
+  for name, latencies in recorder.latencies.items():
+    latencies = sorted(latencies)
+    calls = calls + len(latencies)
+    handlers[name] = {'calls': len(latencies), 'errors': recorder.errors.get(name, 0), 'mean': sum(latencies) / len(latencies),
+      'p50': Percentile(latencies, 0.5), 'p95': Percentile(latencies, 0.95), 'p99': Percentile(latencies, 0.99), 'max': latencies[-1]}
+
+  return {'crawl': crawlMode or 'none', 'clients': options.clients, 'duration': elapsed, 'sessions': recorder.sessions,
+    'calls': calls, 'callsPerSecond': calls / elapsed, 'sessionsPerSecond': recorder.sessions / elapsed,
+    'crawlCycles': cycles, 'crawlRequests': plugin.CrawlEngine.Stats()['requests'] - crawlRequests, 'handlers': handlers}
+
+def PrintPhase(phase):
+  print("Crawl: %s, %d clients for %.1fs: %d sessions (%.1f/s), %d calls (%.1f/s), %d crawl cycles, %d crawl requests"
+    % (phase['crawl'], phase['clients'], phase['duration'], phase['sessions'], phase['sessionsPerSecond'], phase['calls'],
+       phase['callsPerSecond'], phase['crawlCycles'], phase['crawlRequests']))
+  print("  %-24s %8s %7s %9s %9s %9s %9s" % ('handler', 'calls', 'errors', 'p50 (ms)', 'p95 (ms)', 'p99 (ms)', 'max (ms)'))
+  for name in sorted(phase['handlers'].keys()):
+    handler = phase['handlers'][name]
+    print("  %-24s %8d %7d %9.1f %9.1f %9.1f %9.1f" % (name, handler['calls'], handler['errors'],
+      handler['p50'] * 1000, handler['p95'] * 1000, handler['p99'] * 1000, handler['max'] * 1000))
+
+def PrintContention(idle, crawling):
+  # How much slower each handler's p95 is while the crawl runs
+  print("Crawl contention (p95 while crawling / p95 idle):")
+  for name in sorted(crawling['handlers'].keys()):
+    if name in idle['handlers'] and idle['handlers'][name]['p95'] > 0:
+      print("  %-24s %6.2fx" % (name, crawling['handlers'][name]['p95'] / idle['handlers'][name]['p95']))
+
+######
+
+def Main():
+  parser = argparse.ArgumentParser(description='Load generator for the Fancast plugin')
+  parser.add_argument('--shows', type=int, default=2000, help='number of tv shows on the site')
+  parser.add_argument('--movies', type=int, default=1000, help='number of movies on the site')
+  parser.add_argument('--trailers', type=int, default=200, help='number of trailers on the site')
+  parser.add_argument('--seasons', type=int, default=3, help='seasons per tv show')
+  parser.add_argument('--episodes', type=int, default=12, help='episodes per season')
+  parser.add_argument('--padding', type=int, default=20000, help='bytes of filler on each page')
+  parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every fixture response')
+  parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of fixture responses that are 503 errors')
+  parser.add_argument('--rate-limit', action='store_true', help="keep the fetch engines' rate limits")
+  parser.add_argument('--clients', type=int, default=10, help='concurrent clients')
+  parser.add_argument('--duration', type=float, default=20, help='seconds each phase runs for')
+  parser.add_argument('--warmup', type=float, default=5, help='seconds of unreported browsing first, so both phases find the stored records')
+  parser.add_argument('--think', type=float, default=0.0, help='mean seconds a client waits between requests')
+  parser.add_argument('--thumbs', type=int, default=0, help='thumbnails requested for each list shown')
+  parser.add_argument('--crawl', choices=('none', 'incremental', 'full'), default='incremental',
+    help="crawl run in a loop during the second phase, 'none' runs only the phase without it")
+  parser.add_argument('--warm', action='store_true', help='keep the in memory caches between phases')
+  parser.add_argument('--seed', type=int, default=1, help='seed for the clients\' choices')
+  parser.add_argument('--json', action='store_true', help='print the results as json')
+  options = parser.parse_args()
+
+  siteOptions = {'shows': options.shows, 'movies': options.movies, 'trailers': options.trailers,
+    'seasons': options.seasons, 'episodes': options.episodes, 'padding': options.padding}
+  process, proxy = FixtureServer.Start(siteOptions, latency=options.latency, errorRate=options.error_rate)
+  try:
+    plugin = Harness.LoadPlugin(proxy, rateLimit=options.rate_limit)
+    Harness.ResetPlugin(plugin)
+    plugin.UpdateCache()
+    if options.warmup > 0:
+      RunPhase(plugin, argparse.Namespace(**dict(vars(options), duration=options.warmup)), None)
+
+    phases = [RunPhase(plugin, options, None)]
+    if not options.json:
+      PrintPhase(phases[0])
+    if options.crawl != 'none':
+      phases.append(RunPhase(plugin, options, options.crawl))
+      if not options.json:
+        PrintPhase(phases[1])
+        PrintContention(phases[0], phases[1])
+  finally:
+    process.terminate()
+
+  if options.json:
+    print(json.dumps(phases, indent=2, sort_keys=True))
+
+if __name__ == '__main__':
+  Main()
@@ -0,0 +1,374 @@
+# Stand-in for the Plex Media Server framework (v1) used by the Fancast plugin, for Python 3
+#
+# Provides the API surface the plugin uses (PMS.Log, Dict, Prefs, HTTP, XML, JSON, Data, String, Plugin, L, R,
+# @parallelize / @task, MediaContainer and the item classes) so the plugin can be imported and run outside PMS
+# The plugin imports it with 'from PMS import *', put this directory ahead of Contents/Code on sys.path
+#
+# Behaviour is kept close enough to the framework for timings to be meaningful:
+#  - HTTP.Request honours cacheTime with an in-memory cache, as the framework's HTTP cache does
+#  - XML parses with lxml as the framework does, and counts the time spent parsing (see ParseStats)
+#  - @parallelize runs the @task functions defined within it on their own threads and waits for them all
+#  - Dict and Data are held in memory
+#
+# Reset() returns everything to a clean state between runs
+
+import sys
+import time
+import threading
+import json
+import urllib.request as urllib2
+from urllib.parse import quote, quote_plus
+from lxml import etree, html
+
+# The names the plugin gets from 'from PMS import *'
+__all__ = ['PMS', 'Log', 'Dict', 'Prefs', 'Data', 'HTTP', 'XML', 'JSON', 'String', 'Plugin', 'L', 'R', 'parallelize', 'task',
+  'MediaContainer', 'MessageContainer', 'DirectoryItem', 'WebVideoItem', 'VideoItem', 'SearchDirectoryItem', 'Function', 'Redirect', 'DataObject']
+
+
+class Counters(object):
+  # Thread safe counters shared by the stubs below
+
+  def __init__(self):
+    self.lock = threading.Lock()
+    self.values = {}
+
+  def Add(self, name, amount=1):
+    self.lock.acquire()
+    try:
+      self.values[name] = self.values.get(name, 0) + amount
+    finally:
+      self.lock.release()
+
+  def Get(self, name):
+    return self.values.get(name, 0)
+
+  def Reset(self):
+    self.lock.acquire()
+    try:
+      self.values = {}
+    finally:
+      self.lock.release()
+
+counters = Counters()
+
+######
+# Logging
+
+class LogStub(object):
+
+  def __init__(self):
+    self.quiet = True
+    self.lines = []
+
+  def Log(self, message):
+    self.lines.append(message)
+    if not self.quiet:
+      sys.stderr.write('PMS: %s\n' % message)
+
+PMS = LogStub()
+Log = PMS.Log
+
+######
+# Storage
+
+class DictStub(object):
+
+  def __init__(self):
+    self.items = {}
+
+  def Get(self, key):
+    return self.items.get(key)
+
+  def Set(self, key, value):
+    counters.Add('dictSets')
+    self.items[key] = value
+
+  def HasKey(self, key):
+    return key in self.items
+
+  def __getitem__(self, key):
+    return self.items.get(key)
+
+  def __setitem__(self, key, value):
+    self.Set(key, value)
+
+  def Reset(self):
+    self.items = {}
+
+Dict = DictStub()
+
+
+class PrefsStub(object):
+  # Every preference starts unset (False), as the plugin's Defaults.xml has them
+
+  def __init__(self):
+    self.items = {}
+
+  def Get(self, id):
+    return self.items.get(id)
+
+  def Set(self, id, value):
+    self.items[id] = value
+
+  def Reset(self):
+    self.items = {}
+
+Prefs = PrefsStub()
+
+
+class DataStub(object):
+
+  def __init__(self):
+    self.items = {}
+
+  def Save(self, name, data):
+    self.items[name] = data
+
+  def Load(self, name):
+    return self.items.get(name)
+
+  def SaveObject(self, name, obj):
+    self.items[name] = obj
+
+  def LoadObject(self, name):
+    return self.items.get(name)
+
+  def Exists(self, name):
+    return name in self.items
+
+  def Remove(self, name):
+    self.items.pop(name, None)
+
+  def Reset(self):
+    self.items = {}
+
+Data = DataStub()
+
+######
+# Network and parsing
+
+class HTTPStub(object):
+
+  def __init__(self):
+    self.cache = {}
+    self.lock = threading.Lock()
+
+  def Request(self, url, values=None, headers={}, cacheTime=None, autoUpdate=False, encoding=None, errors=None):
+    now = time.time()
+    if cacheTime:
+      self.lock.acquire()
+      try:
+        cached = self.cache.get(url)
+      finally:
+        self.lock.release()
+      if cached != None and cached[0] > now:
+        counters.Add('httpCacheHits')
+        return cached[1]
+
+    counters.Add('httpRequests')
+    body = urllib2.urlopen(urllib2.Request(url, headers=headers)).read().decode(encoding or 'utf-8', 'replace')
+
+    if cacheTime:
+      self.lock.acquire()
+      try:
+        self.cache[url] = (now + cacheTime, body)
+      finally:
+        self.lock.release()
+    return body
+
+  def ClearCache(self):
+    self.lock.acquire()
+    try:
+      self.cache = {}
+    finally:
+      self.lock.release()
+
+HTTP = HTTPStub()
+
+
+class XMLStub(object):
+
+  def ElementFromURL(self, url, isHTML=False, values=None, headers={}, cacheTime=None, autoUpdate=False, encoding=None, errors=None):
+    return self.ElementFromString(HTTP.Request(url, headers=headers, cacheTime=cacheTime, encoding=encoding), isHTML)
+
+  def ElementFromString(self, string, isHTML=False):
+    start = time.time()
+    try:
+      if isHTML:
+        return html.fromstring(string)
+      return etree.fromstring(string)
+    finally:
+      counters.Add('parses')
+      counters.Add('parseTime', time.time() - start)
+
+  def StringFromElement(self, element):
+    return etree.tostring(element)
+
+XML = XMLStub()
+
+
+def ParseStats():
+  # Returns the number of documents parsed and the total time spent parsing them (summed over all threads)
+  return {'parses': counters.Get('parses'), 'parseTime': counters.Get('parseTime')}
+
+
+class JSONStub(object):
+
+  def StringFromObject(self, obj):
+    return json.dumps(obj)
+
+  def ObjectFromString(self, string):
+    return json.loads(string)
+
+JSON = JSONStub()
+
+
+class StringStub(object):
+
+  def Quote(self, s, usePlus=False):
+    if usePlus:
+      return quote_plus(s)
+    return quote(s)
+
+String = StringStub()
+
+######
+# Plugin
+
+class PluginStub(object):
+
+  def __init__(self):
+    self.LastPrefix = None
+    self.handlers = {}
+    self.viewGroups = {}
+
+  def AddPrefixHandler(self, prefix, handler, name=None, thumb=None, art=None):
+    self.handlers[prefix] = handler
+
+  def AddViewGroup(self, name, viewMode=None, mediaType=None):
+    self.viewGroups[name] = viewMode
+
+  def Prefixes(self):
+    return list(self.handlers.keys())
+
+Plugin = PluginStub()
+
+
+def L(key):
+  return key
+
+def R(name):
+  return 'resource:' + name
+
+######
+# Parallel tasks
+# Within a @parallelize function each @task is queued, they all run on their own threads once the function returns
+
+taskQueues = threading.local()
+
+def parallelize(function):
+  queue = []
+  stack = getattr(taskQueues, 'stack', [])
+  taskQueues.stack = stack
+  stack.append(queue)
+  try:
+    function()
+  finally:
+    stack.pop()
+
+  threads = []
+  for taskFunction in queue:
+    thread = threading.Thread(target=taskFunction)
+    thread.start()
+    threads.append(thread)
+  for thread in threads:
+    thread.join()
+  return function
+
+def task(function):
+  stack = getattr(taskQueues, 'stack', [])
+  if stack:
+    stack[-1].append(function)
+  else:
+    function()
+  return function
+
+######
+# Containers and items
+
+class MediaContainer(object):
+  title1 = None
+  content = None
+  viewGroup = None
+  art = None
+
+  def __init__(self, **kwargs):
+    self.items = []
+    self.title2 = None
+    for name, value in kwargs.items():
+      setattr(self, name, value)
+
+  def Append(self, item):
+    self.items.append(item)
+
+  def __len__(self):
+    return len(self.items)
+
+  def Content(self):
+    return '<MediaContainer size="%d"/>' % len(self.items)
+
+
+class MessageContainer(object):
+
+  def __init__(self, header=None, message=None, title1=None):
+    self.header = header
+    self.message = message
+    self.title1 = title1
+
+
+class DirectoryItem(object):
+
+  def __init__(self, key, title=None, **kwargs):
+    self.key = key
+    self.title = title
+    self.attributes = kwargs
+
+class WebVideoItem(DirectoryItem):
+  pass
+
+class VideoItem(DirectoryItem):
+  pass
+
+class SearchDirectoryItem(DirectoryItem):
+  pass
+
+
+class Function(object):
+
+  def __init__(self, item, **kwargs):
+    self.item = item
+    self.kwargs = kwargs
+
+
+class Redirect(object):
+
+  def __init__(self, url):
+    self.url = url
+
+
+class DataObject(object):
+
+  def __init__(self, data, contentType):
+    self.data = data
+    self.contentType = contentType
+
+######
+
+def Reset():
+  # Clears every stub's state and counters
+  Dict.Reset()
+  Prefs.Reset()
+  Data.Reset()
+  HTTP.ClearCache()
+  counters.Reset()
+  PMS.lines = []